@@ -32,14 +32,29 @@ from tkinter.messagebox import showinfo
 from PIL import ImageTk, Image
 from functools import partial
 import os
+import sys
 import shutil
+import subprocess
+import json
+import atexit
+import hashlib
+import tempfile
+import zipfile
+import time
+import argparse
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, CancelledError, as_completed, wait
+from multiprocessing import shared_memory, get_context
 import numpy as np
 import pandas as pd
-from scipy.stats import spearmanr
+from scipy.stats import rankdata
 from scipy.signal import find_peaks, peak_widths
 from sklearn.metrics.pairwise import euclidean_distances
 import scipy.spatial as spatial
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import seaborn as sns
 from cami import *
 import gc
@@ -65,6 +80,28 @@ x2=None
 montage=None
 epochs_delete=None
 
+#frequency bands (select_freq and batch pipeline)
+band_options=['Alpha (8-12 Hz)', 'Beta (12.5-30Hz)','Gamma (30-50Hz)','Theta (4-7Hz)','Delta (1-4Hz)',
+              'Alpha-1 (8-10Hz)','Alpha-2 (10.5-12.5Hz)','Beta-1 (12.5-16Hz)','Beta-2 (16.5-20Hz)','Beta-3 (20.5-28Hz)']
+band_ranges=[(8,12),(12.5,30),(30,50),(4,7),(1,4),(8,10),(10.5,12.5),(12.5,16),(16.5,20),(20.5,28)]
+
+#floating point type of the epoch arrays, buffers and results (see set_precision)
+float_dtype=np.float64
+
+#on-disk storage of the DFC results (see create_dfc_store); chunk_bytes is the size of each chunk file
+dfc_storage={'on_disk':False,'dir':os.path.join(os.path.expanduser('~'),'.eeg_causality_tools','dfc_store'),'chunk_bytes':2**26}
+
+#selects double (default) or single precision for the analyses
+def set_precision(precision):
+    """Sets float_dtype from 'float64' or 'float32'. Single precision halves
+    the memory and bandwidth of the epoch arrays, intermediate buffers and
+    saved results; cumulative sums that would lose accuracy stay in double
+    precision."""
+    global float_dtype
+    if precision not in ('float64','float32'):
+        raise ValueError(f"Unknown precision '{precision}'")
+    float_dtype=np.dtype(precision).type
+
 #load raw data
 def load_edf():
     global raw1
@@ -78,6 +115,7 @@ def load_edf():
         showinfo(title="Error",message="Could not load the file")
         error=1
     if error==0:
+        raw_steps[:]=[new_raw_steps(filename.get(),raw1.info['sfreq'],0,raw1.n_times),None]
         window=Toplevel(main)
         window.title("Additional dataset")
         window.geometry("450x200")
@@ -95,6 +133,7 @@ def load_edf():
                     filename2=StringVar()
                     filename2.set(fd.askopenfilename(title="Load raw EEG",filetypes=(('EDF file','*.edf'),('All files','*.*'))))
                     raw2=mne.io.read_raw_edf(filename2.get()).load_data()
+                    raw_steps[1]=new_raw_steps(filename2.get(),raw2.info['sfreq'],0,raw2.n_times)
                 except:
                     showinfo(title="Error",message="Could not load the file")
             elif add_edf.get()==2:
@@ -128,11 +167,13 @@ def load_edf():
                             start2,stop2=raw1.time_as_index([dbs_time,raw1.times[-1]])
                             raw2=mne.io.RawArray(raw1.get_data(start=start2),raw1.info)
                             raw1=mne.io.RawArray(raw1.get_data(stop=stop1),raw1.info)
+                            raw_steps[:]=[new_raw_steps(filename.get(),raw1.info['sfreq'],0,stop1),new_raw_steps(filename.get(),raw1.info['sfreq'],start2,start2+raw2.n_times)]
                     elif time_or_ann.get()==2:
                         start1,stop1=raw1.time_as_index([0,float(time_split.get())])
                         start2,stop2=raw1.time_as_index([float(time_split.get()),raw1.times[-1]])
                         raw2=mne.io.RawArray(raw1.get_data(start=start2),raw1.info)
                         raw1=mne.io.RawArray(raw1.get_data(stop=stop1),raw1.info)
+                        raw_steps[:]=[new_raw_steps(filename.get(),raw1.info['sfreq'],0,stop1),new_raw_steps(filename.get(),raw1.info['sfreq'],start2,start2+raw2.n_times)]
                     window2.destroy()
                     showinfo(title="File loaded", message="Raw EEG file loaded")
                 Button(window2,text="OK",command=cont_load2).grid(row=3,column=0,columnspan=2)
@@ -212,6 +253,8 @@ def load_fif():
                 eeg1=eeg1.reorder_channels(order)
                 if eeg2 is not None:
                     eeg2=eeg2.reorder_channels(order)
+                x_cache.clear()
+                epoch_stores.clear()
                 plt.close("all")
                 gc.collect()
                 window2.destroy()
@@ -343,6 +386,9 @@ def load_montage():
                         raw1=raw1.pick_channels(connected_chans)
                         connection_dic={sel_correspondence[i].get():montage.ch_names[i] for i in range(len(montage.ch_names)) if sel_correspondence[i].get()!='Not connected'}
                         raw1.rename_channels(mapping=connection_dic)
+                        for n in range(2):
+                            record_step(n,'pick',list(connected_chans))
+                            record_step(n,'rename',dict(connection_dic))
                         raw1.set_montage(montage)
                         if raw2 is not None:
                             raw2=raw2.pick_channels(connected_chans)
@@ -383,6 +429,8 @@ def load_montage():
                             raw1=raw1.reorder_channels(order)
                             if raw2 is not None:
                                 raw2=raw2.reorder_channels(order)
+                            for n in range(2):
+                                record_step(n,'pick',list(order))
                             window3.destroy()
                             plt.close("all")
                             showinfo(title="Load complete", message="EEG montage loaded")
@@ -516,7 +564,9 @@ def load_montage():
                             global events1_data
                             global events2_data
                             global event_dict
+                            first_samp=raw1.first_samp
                             raw1=raw1.crop(tmin=float(cond1_start.get()),tmax=float(cond1_end.get()))
+                            record_crop(0,first_samp,raw1)
                             stim1vals=raw1.get_data(picks=[stim_chan.get()])
                             events1_data=stim1vals.copy()
                             stim1data=[[]]
@@ -555,7 +605,9 @@ def load_montage():
                             events1=mne.find_events(stim1data,consecutive=False,min_duration=float(cond1_ev_tmin.get()))
                             event_dict={event1name.get():1,event2name.get():2}
                             if raw2 is not None:
+                                first_samp=raw2.first_samp
                                 raw2=raw2.crop(tmin=float(cond2_start.get()),tmax=float(cond2_end.get()))
+                                record_crop(1,first_samp,raw2)
                                 stim2vals=raw2.get_data(picks=[stim_chan.get()])
                                 events2_data=stim2vals.copy()
                                 stim2data=[[]]
@@ -628,6 +680,8 @@ def preprocess():
                 raw1.drop_channels(bads)
                 if raw2 is not None:
                     raw2.drop_channels(bads)
+                for n in range(2):
+                    record_step(n,'pick',list(raw1.ch_names))
             fmin=StringVar()
             fmin.set("1")
             fmax=StringVar()
@@ -651,8 +705,10 @@ def preprocess():
             def step2():
                 global raw1
                 global raw2
+                record_filter(0,raw1,float(fmin.get()),float(fmax.get()))
                 raw1=raw1.filter(float(fmin.get()),float(fmax.get()))
                 if raw2 is not None:
+                    record_filter(1,raw2,float(fmin.get()),float(fmax.get()))
                     raw2=raw2.filter(float(fmin.get()),float(fmax.get()))
                 def step3():
                     do_ica=IntVar()
@@ -686,31 +742,39 @@ def preprocess():
                                 global raw2
                                 plt.close("all")
                                 if ref_opt.get()==1:
+                                    record_affine(0,raw1.info,lambda r: r.set_eeg_reference(verbose='ERROR'))
                                     raw1=raw1.copy().set_eeg_reference()
                                     if raw2 is not None:
+                                        record_affine(1,raw2.info,lambda r: r.set_eeg_reference(verbose='ERROR'))
                                         raw2=raw2.copy().set_eeg_reference()
                                 elif ref_opt.get()==2:
                                     excl_chan=chan_ref_exc.get().replace(" ","").split(',')
                                     ref_chans=[chan for chan in raw1.ch_names if chan not in excl_chan]
+                                    record_affine(0,raw1.info,lambda r: r.set_eeg_reference(ref_chans,verbose='ERROR'))
                                     raw1=raw1.copy().set_eeg_reference(ref_chans)
                                     if raw2 is not None:
+                                        record_affine(1,raw2.info,lambda r: r.set_eeg_reference(ref_chans,verbose='ERROR'))
                                         raw2=raw2.copy().set_eeg_reference(ref_chans)
                                 elif ref_opt.get()==3:
                                     ref_chans=chan_ref_inc.get().replace(" ","").split(',')
+                                    record_affine(0,raw1.info,lambda r: r.set_eeg_reference(ref_chans,verbose='ERROR'))
                                     raw1=raw1.copy().set_eeg_reference(ref_chans)
                                     if raw2 is not None:
+                                        record_affine(1,raw2.info,lambda r: r.set_eeg_reference(ref_chans,verbose='ERROR'))
                                         raw2=raw2.copy().set_eeg_reference(ref_chans)
                                 elif ref_opt.get()==4:
                                     raw1.del_proj()
                                     sphere1 = mne.make_sphere_model('auto', 'auto', raw1.info)
                                     src1 = mne.setup_volume_source_space(sphere=sphere, exclude=30., pos=15.)
                                     forward1 = mne.make_forward_solution(raw1.info, trans=None, src=src, bem=sphere)
+                                    record_affine(0,raw1.info,lambda r: r.set_eeg_reference('REST',forward=forward1,verbose='ERROR'))
                                     raw1=raw1.copy().set_eeg_reference('REST',forward=forward1)
                                     if raw2 is not None:
                                         raw2.del_proj()
                                         sphere2 = mne.make_sphere_model('auto', 'auto', raw2.info)
                                         src2 = mne.setup_volume_source_space(sphere=sphere, exclude=30., pos=15.)
                                         forward1 = mne.make_forward_solution(raw1.info, trans=None, src=src, bem=sphere)
+                                        record_affine(1,raw2.info,lambda r: r.set_eeg_reference('REST',forward=forward2,verbose='ERROR'))
                                         raw2=raw2.copy().set_eeg_reference('REST',forward=forward2)
                                 win8.destroy()
                                 showinfo(title="Info",message="We will now save this\nprocessed continuous EEG data.\nEvents will be stored as an additional EEG channel.\nAfter this, we will do epoching\n(splitting the EEG in trials)")
@@ -944,6 +1008,7 @@ def preprocess():
                                   if to_remove2[0]!='':
                                     to_remove2=[int(to_remove2[i]) for i in range(len(to_remove2))]
                                     ica2.exclude=to_remove2
+                                    record_affine(0,raw1.info,ica2.apply)
                                     ica2.apply(raw1)
                                   win6.destroy()
                                   plt.close("all")
@@ -985,6 +1050,7 @@ def preprocess():
                                             if to_remove2_3[0]!='':
                                               to_remove2_3=[int(to_remove2_3[i]) for i in range(len(to_remove2))]
                                               ica2_2.exclude=to_remove2_3
+                                              record_affine(1,raw2.info,ica2_2.apply)
                                               ica2_2.apply(raw2)
                                             win8.destroy()
                                             plt.close("all")
@@ -1069,6 +1135,7 @@ def preprocess():
                         peakbtn["text"]="Redo find peaks"
                         def deletepeaks1():
                             global raw1
+                            record_notch(0,f2[pk],wd2)
                             filt_raw=mne.filter.notch_filter(raw1.get_data(),raw1.info['sfreq'],f2[pk],fir_window='hann',notch_widths=wd2)
                             raw1=mne.io.RawArray(filt_raw,raw1.info)
                             win3.destroy()
@@ -1114,6 +1181,7 @@ def preprocess():
                         def deletepeaks2():
                             global raw2
                             if len(pk>0):
+                                record_notch(1,f2[pk],wd2)
                                 filt_raw=mne.filter.notch_filter(raw2.get_data(),raw2.info['sfreq'],f2[pk],fir_window='hann',notch_widths=wd2)
                                 raw2=mne.io.RawArray(filt_raw,raw2.info)
                             win3.destroy()
@@ -1146,8 +1214,7 @@ def select_freq():
     if eeg1 is not None:
         st_or_freq=IntVar()
         st_or_freq.set(1)
-        optionband=['Alpha (8-12 Hz)', 'Beta (12.5-30Hz)','Gamma (30-50Hz)','Theta (4-7Hz)','Delta (1-4Hz)',
-                    'Alpha-1 (8-10Hz)','Alpha-2 (10.5-12.5Hz)','Beta-1 (12.5-16Hz)','Beta-2 (16.5-20Hz)','Beta-3 (20.5-28Hz)']
+        optionband=band_options
         sel_band=StringVar()
         sel_band.set(optionband[0])
         fmin=StringVar()
@@ -1166,8 +1233,9 @@ def select_freq():
         def do_filter():
             global eeg1
             global eeg2
+            global raw1
+            global raw2
             if st_or_freq.get()==1:
-                band_ranges=[(8,12),(12.5,30),(30,50),(4,7),(1,4),(8,10),(10.5,12.5),(12.5,16),(16.5,20),(20.5,28)]
                 for i in range(len(optionband)):
                     if sel_band.get()==optionband[i]:
                         fmin.set(str(band_ranges[i][0]))
@@ -1175,6 +1243,13 @@ def select_freq():
             eeg1=eeg1.copy().filter(float(fmin.get()),float(fmax.get()))
             if eeg2 is not None:
                 eeg2=eeg2.copy().filter(float(fmin.get()),float(fmax.get()))
+            #the continuous recordings (DFC from raw) get the same band
+            if raw1 is not None:
+                record_filter(0,raw1,float(fmin.get()),float(fmax.get()))
+                raw1=raw1.filter(float(fmin.get()),float(fmax.get()))
+            if raw2 is not None:
+                record_filter(1,raw2,float(fmin.get()),float(fmax.get()))
+                raw2=raw2.filter(float(fmin.get()),float(fmax.get()))
             win.destroy()
             showinfo(title="Filter applied",message="Filter applied to pre-processed EEG data.\nSelected frequency band range "+fmin.get()+" to "+fmax.get()+"Hz to remain")
         Button(win,text="OK",command=do_filter).grid(row=3,column=0,padx=10,columnspan=5)
@@ -1183,44 +1258,371 @@ def select_freq():
         Label(win,text="ERROR\nIt is required at least\n1 preprocessed data",justify=CENTER).grid(row=0,column=0,padx=10,pady=10)        
         Button(win,text="OK",command=win.destroy).grid(row=1,column=0,padx=10)
     
+#energy version of the epochs of every dataset, kept until the dataset changes (see analysed_data)
+x_cache={}
+
+#epochs analysed with their raw or energy values
+def analysed_data(name,epochs,energy):
+    """Returns epochs itself (no copy) for the raw values, or an Epochs object
+    with the squared values for the energy. The latter is computed once per
+    dataset and kept in x_cache under name while epochs is alive, so that
+    opening a window neither squares the data again nor rebuilds its epoch
+    store; a step that changes the epochs in place clears x_cache."""
+    if (epochs is None) or (not energy):
+        return epochs
+    entry=x_cache.get(name)
+    if (entry is not None) and (entry[0]() is epochs):
+        return entry[1]
+    a=epochs.get_data()
+    np.square(a,out=a)
+    x=mne.EpochsArray(a,epochs.info,events=epochs.events,tmin=epochs.tmin,event_id=epochs.event_id,verbose='ERROR')
+    x_cache[name]=(weakref.ref(epochs),x)
+    return x
+
 #adjusts calcs if user selects to work with energy or raw values
 def make_x():
     global x1
     global x2
     global xraw1
     global xraw2
-    error=0
-    if raw_or_energy.get()==1: #work with raw value
-        #if epoched data is provided
-        if eeg1 is not None:
-            x1=eeg1.copy()
+    energy=raw_or_energy.get()==2
+    x1=analysed_data('x1',eeg1,energy)
+    x2=analysed_data('x2',eeg2,energy)
+    #the continuous recordings are streamed and only their chunks squared (see stream_dfc)
+    xraw1=raw1
+    xraw2=raw2
+    return int(eeg1 is None)
+
+#contiguous epoch arrays of every dataset, built once and shared by all the metrics
+epoch_stores={}
+
+#in-memory store of the epochs of one dataset
+def epoch_store(epochs):
+    """Returns the store of an mne.Epochs object, building it on first use.
+    The data is read once into a single C-contiguous array with the epochs
+    grouped by event, so that the array of each event is a contiguous view
+    and the metrics never create Epochs subsets. The store is dropped when
+    the Epochs object is garbage collected, and rebuilt when float_dtype
+    changes.
+    Returns
+    -------
+    store : dict
+        'data': array of shape (n_epochs,n_chans,n_times), grouped by event;
+        'events': dict with the array of each event name;
+        'position': row of 'data' of every epoch, in the original order;
+        'times': time axis, in s; 'ch_names': list of channel names;
+        'ch_index': dict with the index of every channel; 'sfreq': sampling
+        frequency, in Hz.
+    """
+    entry=epoch_stores.get(id(epochs))
+    if (entry is not None) and (entry[0]() is epochs) and (entry[1]['data'].dtype==float_dtype):
+        return entry[1]
+    codes=epochs.events[:,2]
+    order=np.argsort(codes,kind='stable')
+    data=np.ascontiguousarray(epochs.get_data()[order],dtype=float_dtype)
+    position=np.empty(len(order),dtype=int)
+    position[order]=np.arange(len(order))
+    store={'data':data,'events':{},'position':position,'times':epochs.times.copy(),'ch_names':list(epochs.ch_names),
+           'ch_index':{name:i for i,name in enumerate(epochs.ch_names)},'sfreq':epochs.info['sfreq']}
+    sorted_codes=codes[order]
+    for key,code in epochs.event_id.items():
+        start,stop=np.searchsorted(sorted_codes,[code,code+1])
+        store['events'][key]=data[start:stop]
+    key=id(epochs)
+    epoch_stores[key]=(weakref.ref(epochs,lambda ref: epoch_stores.pop(key,None)),store)
+    return store
+
+#array of the epochs of one event, from the store
+def event_data(epochs,key):
+    """Returns the C-contiguous array (n_epochs,n_chans,n_times) of the epochs
+    of event key (an event name or a '/'-separated tag selection, as in
+    epochs[key])."""
+    store=epoch_store(epochs)
+    if key not in store['events']:
+        tags=set(key.split('/'))
+        codes=[code for name,code in epochs.event_id.items() if tags<=set(name.split('/'))]
+        if len(codes)==0:
+            raise KeyError(f"Event '{key}' not found")
+        rows=store['position'][np.isin(epochs.events[:,2],codes)]
+        store['events'][key]=np.ascontiguousarray(store['data'][rows])
+    return store['events'][key]
+
+#array of one epoch, in the original order of the dataset
+def epoch_data(epochs,epoch):
+    """Returns the array (n_chans,n_times) of epoch number epoch."""
+    store=epoch_store(epochs)
+    return store['data'][store['position'][epoch]]
+
+#runs computations in a worker thread while the Tk window stays responsive
+def run_task(win,pbar,pbtxt,jobs,interval=0.2,title="Calculation in progress"):
+    """Runs job(progress=...) for every job of the list in a worker thread.
+    The worker only records its progress; the Tk thread polls it with
+    win.after every interval seconds, so the window is repainted at most a few
+    times per second whatever the speed of the computation. A small window
+    allows to pause/resume or cancel the calculation.
+    Parameters
+    ----------
+    win : Toplevel
+        Window that owns the progress bar.
+    pbar : Progressbar
+        Progress bar to update.
+    pbtxt : Label
+        Label that shows the progress as text.
+    jobs : list
+        Functions that accept a progress keyword, e.g. partial(compute_corr,x1,event_names).
+    interval : float
+        Time between refreshes of the progress bar, in seconds.
+    title : str
+        Title of the pause/cancel window.
+    Returns
+    -------
+    results : list, None
+        Result of every job, or None if the calculation was cancelled or failed.
+    """
+    state={'done':0,'total':0,'job':0,'results':[],'error':None}
+    cancel=threading.Event()
+    resume=threading.Event()
+    resume.set()
+    def progress(done,total):
+        resume.wait()
+        if cancel.is_set():
+            raise CancelledError()
+        state['done'],state['total']=done,total
+    def work():
+        try:
+            for n,job in enumerate(jobs):
+                state['job']=n
+                state['done'],state['total']=0,0
+                state['results'].append(job(progress=progress))
+        except BaseException as e:
+            state['error']=e
+    finished=BooleanVar(win,False)
+    ctrl=Toplevel(win)
+    ctrl.title(title)
+    Label(ctrl,text=title).grid(row=0,column=0,columnspan=2,padx=10,pady=10)
+    def pause():
+        if resume.is_set():
+            resume.clear()
+            btn_pause['text']="Resume"
         else:
-            error=1
-        if eeg2 is not None:
-            x2=eeg2.copy()
-        #if continuous edf data is provided
-        if raw1 is not None:
-            xraw1=raw1.copy()
-        if raw2 is not None:
-            xraw2=raw2.copy()
-    else: #work with squared value (energy)
-        #if epoched data is provided
-        if eeg1 is not None:
-            a=np.square(eeg1.get_data())
-            x1=mne.EpochsArray(a,eeg1.info,events=event_dict)
+            resume.set()
+            btn_pause['text']="Pause"
+    def stop():
+        cancel.set()
+        resume.set()
+        btn_pause.state(['disabled'])
+        btn_cancel.state(['disabled'])
+        pbtxt['text']="cancelling, please wait"
+    btn_pause=Button(ctrl,text="Pause",command=pause)
+    btn_pause.grid(row=1,column=0,padx=10,pady=10)
+    btn_cancel=Button(ctrl,text="Cancel",command=stop)
+    btn_cancel.grid(row=1,column=1,padx=10,pady=10)
+    ctrl.protocol("WM_DELETE_WINDOW",stop)
+    thread=threading.Thread(target=work,daemon=True)
+    def poll():
+        if (state['total']>0) and not cancel.is_set():
+            pbar['value']=100*state['done']/state['total']
+            text=f"{state['done']:d}/{state['total']:d}"
+            if len(jobs)>1:
+                text=f"[{state['job']+1:d}/{len(jobs):d}] "+text
+            if not resume.is_set():
+                text+=" (paused)"
+            pbtxt['text']=text
+        if thread.is_alive():
+            win.after(int(interval*1000),poll)
         else:
-            error=1
-        if eeg2 is not None:
-            a=np.square(eeg2.get_data())
-            x2=mne.EpochsArray(a,eeg2.info,events=event_dict)
-        #if continuous edf data is provided
-        if raw1 is not None:
-            a=np.square(raw1.get_data())
-            xraw1=mne.io.RawArray(a,raw1.info,events=event_dict)
-        if raw2 is not None:
-            a=np.square(raw2.get_data())
-            xraw2=mne.io.RawArray(a,raw2.info,events=event_dict)        
-    return error
+            finished.set(True)
+    pbar['value']=0.0
+    pbtxt['text']="--"
+    thread.start()
+    ctrl.transient(win)
+    ctrl.wait_visibility()
+    ctrl.grab_set()
+    win.after(int(interval*1000),poll)
+    win.wait_variable(finished)
+    ctrl.destroy()
+    if isinstance(state['error'],CancelledError):
+        pbar['value']=0.0
+        pbtxt['text']="cancelled"
+        return None
+    elif state['error'] is not None:
+        pbtxt['text']="error"
+        showinfo(title="Error",message=f"The calculation failed:\n{state['error']}")
+        return None
+    pbar['value']=100.0
+    pbtxt['text']="done!"
+    return state['results']
+
+#packed storage of symmetric connectivity matrices
+def pack_triangle(a):
+    """Upper triangle (diagonal included) of the matrices of a, array of shape
+    (...,n_chans,n_chans), in condensed row-major form of shape
+    (...,n_chans*(n_chans+1)//2)."""
+    iu=np.triu_indices(a.shape[-1])
+    return np.ascontiguousarray(a[...,iu[0],iu[1]])
+
+#full matrices from the packed storage, for plotting and CSV tables
+def unpack_triangle(p,sign=1):
+    """Inverse of pack_triangle. sign=-1 expands antisymmetric matrices (e.g.
+    the imaginary coherence, see spectral_signs).
+    Returns an array of shape (...,n_chans,n_chans)."""
+    n_chans=int(round((np.sqrt(8*p.shape[-1]+1)-1)/2))
+    if n_chans*(n_chans+1)//2!=p.shape[-1]:
+        raise ValueError("The last axis does not hold a packed triangle")
+    iu=np.triu_indices(n_chans)
+    a=np.empty(p.shape[:-1]+(n_chans,n_chans),dtype=p.dtype)
+    a[...,iu[1],iu[0]]=sign*p
+    a[...,iu[0],iu[1]]=p
+    return a
+
+#splits the data into the leading and the delayed series
+def lagged_slices(vals,delayval):
+    """Returns the source and target series used by the lagged connectivity
+    measures, i.e. vals[...,:-delayval] and vals[...,delayval:].
+    Parameters
+    ----------
+    vals : np.array
+        Array of shape (...,n_chans,n_times).
+    delayval : int
+        Transmission delay, in samples (non-negative).
+    Returns
+    -------
+    x, y : np.array
+        Views of vals of shape (...,n_chans,n_times-delayval).
+    """
+    if delayval>0:
+        return vals[...,:-delayval],vals[...,delayval:]
+    return vals,vals
+
+#pearson correlation between all pairs of channels
+def lagged_corr(x,y):
+    """Pearson correlation between every channel of x and every channel of y.
+    Each series is z-scored once and the whole (n_chans,n_chans) matrix of
+    each epoch is obtained from a single matrix product.
+    Parameters
+    ----------
+    x : np.array
+        Source series, array of shape (...,n_chans,n_times).
+    y : np.array
+        Target series, array with the same shape as x.
+    Returns
+    -------
+    corr : np.array
+        Array of shape (...,n_chans,n_chans), where corr[...,i,j] is the
+        correlation between x[...,i,:] and y[...,j,:] (NaN for constant series).
+    """
+    n_times=x.shape[-1]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        zx=(x-x.mean(axis=-1,keepdims=True))/x.std(axis=-1,keepdims=True)
+        zy=(y-y.mean(axis=-1,keepdims=True))/y.std(axis=-1,keepdims=True)
+        corr=np.matmul(zx,np.swapaxes(zy,-1,-2))/n_times
+    return np.clip(corr,-1,1)
+
+#pearson correlation at every lag of a range, from one FFT per series
+def lag_scan(vals,min_lag,max_lag,max_block_bytes=2**27):
+    """Lagged Pearson correlation between all pairs of channels for every lag
+    of a range, in a single FFT-based pass. The cross-products of all the
+    lags come from the cross-spectra and the sums over the overlapping
+    segments from cumulative sums, so every lag gives the same value as
+    lagged_corr on the corresponding slices.
+    Parameters
+    ----------
+    vals : np.array
+        Array of shape (...,n_chans,n_times), e.g. the epochs of one event.
+    min_lag, max_lag : int
+        Range of lags, in samples (negative lags: the target leads).
+    max_block_bytes : int
+        Memory budget for the cross-spectra of a block of (source, target)
+        pairs; the epochs (leading axes) and, if needed, the target channels
+        are split in blocks too, so that the budget holds for any size.
+    Returns
+    -------
+    corr : np.array
+        Array of shape (...,n_lags,n_chans,n_chans), where corr[...,k,i,j] is
+        the correlation between vals[...,i,t] and vals[...,j,t+lag] (over the
+        samples where both exist), with lag=min_lag+k.
+    """
+    n_chans,n_times=vals.shape[-2:]
+    min_lag,max_lag=int(min_lag),int(max_lag)
+    if (min_lag>max_lag) or (max(abs(min_lag),abs(max_lag))>=n_times-1):
+        raise ValueError("The lags must satisfy min_lag<=max_lag and |lag|<n_times-1")
+    lags=np.arange(min_lag,max_lag+1)
+    #centering does not change the correlation, but avoids loss of precision
+    x=vals-vals.mean(axis=-1,keepdims=True)
+    nfft=int(2**np.ceil(np.log2(n_times+max(abs(min_lag),abs(max_lag)))))
+    f=np.fft.rfft(x,n=nfft,axis=-1)
+    c=np.zeros(x.shape[:-1]+(n_times+1,))
+    c2=np.zeros(x.shape[:-1]+(n_times+1,))
+    np.cumsum(x,axis=-1,dtype=np.float64,out=c[...,1:])
+    np.cumsum(np.square(x,dtype=np.float64),axis=-1,out=c2[...,1:])
+    #source segment [a,b) and target segment [a+lag,b+lag) of every lag
+    a=np.maximum(0,-lags)
+    b=n_times-np.maximum(0,lags)
+    m=(b-a).astype(float)
+    sx=np.moveaxis(c[...,b]-c[...,a],-1,-2)[...,:,:,None]
+    sxx=np.moveaxis(c2[...,b]-c2[...,a],-1,-2)[...,:,:,None]
+    sy=np.moveaxis(c[...,b+lags]-c[...,a+lags],-1,-2)[...,:,None,:]
+    syy=np.moveaxis(c2[...,b+lags]-c2[...,a+lags],-1,-2)[...,:,None,:]
+    corr=np.empty(x.shape[:-2]+(len(lags),n_chans,n_chans),dtype=np.result_type(vals.dtype,np.float32))
+    #blocks of epochs x source channels x target channels within the budget
+    n_items=int(np.prod(x.shape[:-2]))
+    pair_bytes=16*nfft
+    cols=max(1,min(n_chans,int(max_block_bytes//pair_bytes)))
+    rows=max(1,min(n_chans,int(max_block_bytes//(pair_bytes*cols))))
+    items=max(1,min(n_items,int(max_block_bytes//(pair_bytes*cols*rows))))
+    f=f.reshape((n_items,)+f.shape[-2:])
+    sx,sxx,sy,syy=[a.reshape((n_items,)+a.shape[-3:]) for a in (sx,sxx,sy,syy)]
+    out=corr.reshape((n_items,)+corr.shape[-3:])
+    for e in range(0,n_items,items):
+        for r in range(0,n_chans,rows):
+            for q in range(0,n_chans,cols):
+                #cross-correlation sum_t x_i[t]*x_j[t+lag], lag<0 wraps to the end
+                sxy=np.fft.irfft(np.conj(f[e:e+items,r:r+rows,None,:])*f[e:e+items,None,q:q+cols,:],n=nfft,axis=-1)[...,lags%nfft]
+                sxy=np.moveaxis(sxy,-1,-3)
+                with np.errstate(divide='ignore',invalid='ignore'):
+                    num=m[:,None,None]*sxy-sx[e:e+items,:,r:r+rows,:]*sy[e:e+items,:,:,q:q+cols]
+                    den=np.sqrt((m[:,None,None]*sxx[e:e+items,:,r:r+rows,:]-sx[e:e+items,:,r:r+rows,:]**2)*
+                                (m[:,None,None]*syy[e:e+items,:,:,q:q+cols]-sy[e:e+items,:,:,q:q+cols]**2))
+                    out[e:e+items,:,r:r+rows,q:q+cols]=np.clip(num/den,-1,1)
+    return corr
+
+#surrogate significance test dialog, shared by the windows of the epoch measures
+def surrogate_dialog(parent,measure,get_kwargs):
+    """Asks for the surrogate parameters, runs compute_surrogate_test on the
+    loaded conditions (get_kwargs returns the delay and the other parameters
+    of the measure, read from the parent window) and saves the z-scores and
+    p-values of every condition/event as CSV tables."""
+    win=Toplevel(parent)
+    n_surr=StringVar()
+    n_surr.set("1000")
+    kind=StringVar()
+    kindlist=['shift','phase','shuffle']
+    Label(win,text="Significance test with surrogates").grid(row=0,column=0,columnspan=3,padx=10,pady=10)
+    Label(win,text="Number of surrogates:").grid(row=1,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=n_surr,width=6).grid(row=1,column=1,sticky=W)
+    Label(win,text="Surrogate type:").grid(row=2,column=0,padx=10,sticky=W)
+    OptionMenu(win,kind,kindlist[0],*kindlist).grid(row=2,column=1,sticky=W)
+    pbar=Progressbar(win,orient=HORIZONTAL,length=200,mode='determinate')
+    pbar['value']=0.0
+    pbtxt=Label(win,text="--")
+    def step():
+        event_names=list(event_dict.keys())
+        kwargs=get_kwargs()
+        jobs=[partial(compute_surrogate_test,x1,event_names,measure,n_surrogates=int(n_surr.get()),kind=kind.get(),**kwargs)]
+        if x2 is not None:
+            jobs.append(partial(compute_surrogate_test,x2,event_names,measure,n_surrogates=int(n_surr.get()),kind=kind.get(),**kwargs))
+        results=run_task(win,pbar,pbtxt,jobs)
+        if results is None:
+            return
+        showinfo(title="Info",message="For each condition and event you'll save\nthe z-scores and then the p-values (CSV tables)")
+        for test,x,cond in zip(results,[x1,x2],[cond1_name.get(),cond2_name.get()]):
+            for key_idx,key in enumerate(event_names):
+                for stat,lbl in (('z','z-scores'),('p','p-values')):
+                    fname = fd.asksaveasfilename(title=f"Surrogate {lbl} for condition "+cond+" event "+key,defaultextension=".csv",filetypes=(("Comma Separated Values", "*.csv"),("All Files", "*.*")))
+                    pd.DataFrame(test[stat][key_idx],index=x.ch_names,columns=x.ch_names).to_csv(fname)
+    Button(win,text='Start calculation',command=step).grid(row=3,column=0,sticky=W,padx=10,pady=10)
+    pbar.grid(row=3,column=1,sticky=W)
+    pbtxt.grid(row=3,column=2,sticky=W,padx=(0,10))
 
 #pearson correlation and comparison between conditions
 def pearson_corr():
@@ -1237,43 +1639,15 @@ def pearson_corr():
         n_chans=len(eeg1.ch_names)
         def step():
             if int(delay.get())>=0:
-                delayval=int(float(delay.get())*eeg1.info['sfreq']/1000)
-                max_epo_x1=max([len(x1[key]) for key in event_dict.keys()])
-                corr_val_x1=np.empty((len(event_dict.keys()),max_epo_x1,n_chans,n_chans))
-                corr_val_x1.fill(np.nan)
+                jobs=[partial(compute_corr,x1,list(event_dict.keys()),float(delay.get()),'pearson')]
                 if x2 is not None:
-                    max_epo_x2=max([len(x2[key]) for key in event_dict.keys()])
-                    corr_val_x2=np.empty((len(event_dict.keys()),max_epo_x2,n_chans,n_chans))
-                    corr_val_x2.fill(np.nan)
-                pbar['value']=0.0
-                k=0                
-                for i in range(n_chans):
-                    for j in range(n_chans):
-                        win.update_idletasks()
-                        win.update()
-                        k+=1
-                        pbar['value'] += 100/(n_chans*n_chans)
-                        pbtxt['text']=f"{k:d}/{n_chans*n_chans:d}"
-                        key_idx=0
-                        for key in event_dict.keys():
-                            n_epochs=len(x1[key])
-                            for epoch in range(n_epochs):
-                                if delayval>0:
-                                    corr_val_x1[key_idx,epoch,i,j]=np.corrcoef(x1[key][epoch]._data[0,i,:-delayval],x1[key][epoch]._data[0,j,delayval:])[0,1]
-                                elif delayval==0:
-                                    corr_val_x1[key_idx,epoch,i,j]=np.corrcoef(x1[key][epoch]._data[0,i,:],x1[key][epoch]._data[0,j,:])[0,1]
-                                else:
-                                    showinfo(title="Error",message="Delay must be positive")
-                            if x2 is not None:
-                                n_epochs2=len(x2[key])
-                                for epoch2 in range(n_epochs2):
-                                    if delayval>0:
-                                        corr_val_x2[key_idx,epoch2,i,j]=np.corrcoef(x2[key][epoch2]._data[0,i,:-delayval],x2[key][epoch2]._data[0,j,delayval:])[0,1]
-                                    elif delayval==0:
-                                        corr_val_x2[key_idx,epoch2,i,j]=np.corrcoef(x2[key][epoch2]._data[0,i,:],x2[key][epoch2]._data[0,j,:])[0,1]
-                                    else:
-                                        showinfo(title="Error",message="Delay must be positive")
-                            key_idx+=1
+                    jobs.append(partial(compute_corr,x2,list(event_dict.keys()),float(delay.get()),'pearson'))
+                results=run_task(win,pbar,pbtxt,jobs)
+                if results is None:
+                    return
+                corr_val_x1=results[0]
+                if x2 is not None:
+                    corr_val_x2=results[1]
                 def save_corr():
                     showinfo(title="Info",message="First you'll save the average\nacross epochs (CSV table)")
                     key_idx=0
@@ -1462,6 +1836,26 @@ def pearson_corr():
                 Button(win,text="Close",command=win.destroy).grid(row=5,column=0,padx=10,pady=10,columnspan=3)
             else:
                 showinfo(title="Error",message="Delay must be a positive number")
+        def step_scan():
+            if float(min_lag.get())>float(max_lag.get()):
+                showinfo(title="Error",message="The minimum lag must not exceed the maximum lag")
+                return
+            event_names=list(event_dict.keys())
+            jobs=[partial(compute_lag_scan,x1,event_names,float(min_lag.get()),float(max_lag.get()))]
+            if x2 is not None:
+                jobs.append(partial(compute_lag_scan,x2,event_names,float(min_lag.get()),float(max_lag.get())))
+            results=run_task(win,pbar,pbtxt,jobs)
+            if results is None:
+                return
+            showinfo(title="Info",message="For each condition you'll save the scan of all epochs\n(Numpy array of size (n_events,n_epochs,n_lags,n_chans,n_chans))\nand then, for each event, the lag (ms) of the peak\nof the epoch-averaged scan (CSV table)")
+            for (corr,lags,best_lag),x,cond in zip(results,[x1,x2],[cond1_name.get(),cond2_name.get()]):
+                fname = fd.asksaveasfilename(title=f"Lag scan ({lags[0]:.0f} to {lags[-1]:.0f} ms) condition "+cond,defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                np.save(fname,corr)
+                with np.errstate(invalid='ignore'):
+                    mean_best=peak_lag(np.nanmean(corr,axis=1),lags)
+                for key_idx,key in enumerate(event_names):
+                    fname = fd.asksaveasfilename(title="Peak lag (ms) for condition "+cond+" event "+key,defaultextension=".csv",filetypes=(("Comma Separated Values", "*.csv"),("All Files", "*.*")))
+                    pd.DataFrame(mean_best[key_idx],index=x.ch_names,columns=x.ch_names).to_csv(fname)
         Label(win,text="Calculate correlations").grid(row=0,column=0,columnspan=3,padx=10,pady=10)
         Label(win,text="Transmission delay between brain regions (ms):").grid(row=1,column=0,padx=10,sticky=W)
         Entry(win,textvariable=delay,width=4).grid(row=1,column=1,sticky=W)
@@ -1472,6 +1866,138 @@ def pearson_corr():
         btn.grid(row=2,column=0,sticky=W,padx=10)
         pbar.grid(row=2,column=1,sticky=W)
         pbtxt.grid(row=2,column=2,sticky=W)        
+        min_lag=StringVar()
+        min_lag.set("-100")
+        max_lag=StringVar()
+        max_lag.set("100")
+        frame_scan=Frame(win)
+        Label(frame_scan,text="Scan lags from (ms):").grid(row=0,column=0,sticky=W)
+        Entry(frame_scan,textvariable=min_lag,width=5).grid(row=0,column=1,sticky=W)
+        Label(frame_scan,text=" to ").grid(row=0,column=2,sticky=W)
+        Entry(frame_scan,textvariable=max_lag,width=5).grid(row=0,column=3,sticky=W)
+        Button(frame_scan,text="Lag scan",command=step_scan).grid(row=0,column=4,padx=10,sticky=W)
+        frame_scan.grid(row=6,column=0,columnspan=3,padx=10,pady=(0,10),sticky=W)
+        Button(win,text="Significance test (surrogates)",command=lambda: surrogate_dialog(win,'pearson',lambda: {'delay':float(delay.get())})).grid(row=7,column=0,padx=10,pady=(0,10),sticky=W)
+
+#spearman correlation between all pairs of channels
+def lagged_spearman(x,y):
+    """Spearman correlation between every channel of x and every channel of y.
+    Each series is ranked only once (ties receive their average rank, as in
+    scipy.stats.spearmanr) and the ranks are correlated with lagged_corr.
+    Parameters
+    ----------
+    x : np.array
+        Source series, array of shape (...,n_chans,n_times).
+    y : np.array
+        Target series, array with the same shape as x.
+    Returns
+    -------
+    corr : np.array
+        Array of shape (...,n_chans,n_chans), where corr[...,i,j] is the
+        Spearman correlation between x[...,i,:] and y[...,j,:].
+    """
+    rx=rankdata(x,axis=-1)
+    if y is x:
+        ry=rx
+    else:
+        ry=rankdata(y,axis=-1)
+    return lagged_corr(rx,ry)
+
+#headless lagged correlation of every epoch of every event
+def compute_corr(epochs,event_names,delay=10,method='pearson',progress=None,symmetric=False):
+    """Lagged correlation between all pairs of channels, for every epoch of
+    every event, without any user interface.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    event_names : list
+        Names of the events to analyse.
+    delay : float
+        Transmission delay between brain regions, in ms (non-negative).
+    method : str
+        'pearson' or 'spearman'.
+    progress : function, None
+        Called as progress(done,total) after each event.
+    symmetric : bool
+        Store only the upper triangle, packed as in pack_triangle (requires
+        zero delay, which makes the matrices symmetric).
+    Returns
+    -------
+    corr : np.array
+        Array of shape (n_events,max_epochs,n_chans,n_chans), or
+        (n_events,max_epochs,n_chans*(n_chans+1)//2) in symmetric mode,
+        padded with NaN for the events with less epochs.
+    """
+    engines={'pearson':lagged_corr,'spearman':lagged_spearman}
+    if method not in engines:
+        raise ValueError(f"Unknown correlation method '{method}'")
+    if float(delay)<0:
+        raise ValueError("Delay must be a non-negative number")
+    delayval=int(float(delay)*epochs.info['sfreq']/1000)
+    if symmetric and delayval!=0:
+        raise ValueError("The symmetric mode requires zero delay")
+    n_chans=len(epochs.ch_names)
+    data=[event_data(epochs,key) for key in event_names]
+    shape=(n_chans*(n_chans+1)//2,) if symmetric else (n_chans,n_chans)
+    corr=np.full((len(event_names),max([vals.shape[0] for vals in data]))+shape,np.nan,dtype=float_dtype)
+    for k,vals in enumerate(data):
+        c=engines[method](*lagged_slices(vals,delayval))
+        corr[k,:vals.shape[0]]=pack_triangle(c) if symmetric else c
+        if progress is not None:
+            progress(k+1,len(event_names))
+    return corr
+
+#headless lag scan of the correlation of every epoch of every event
+def compute_lag_scan(epochs,event_names,min_lag=-100,max_lag=100,absolute=True,progress=None):
+    """Pearson correlation between all pairs of channels for every lag of a
+    range (see lag_scan), for every epoch of every event, and the lag of the
+    peak of each pair.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    event_names : list
+        Names of the events to analyse.
+    min_lag, max_lag : float
+        Range of lags, in ms (negative lags: the target leads).
+    absolute : bool
+        Whether the peak is the maximum of |corr| (True) or of corr.
+    progress : function, None
+        Called as progress(done,total) after each event.
+    Returns
+    -------
+    corr : np.array
+        Array of shape (n_events,max_epochs,n_lags,n_chans,n_chans), padded
+        with NaN for the events with less epochs.
+    lags : np.array
+        Lags, in ms.
+    best_lag : np.array
+        Array of shape (n_events,max_epochs,n_chans,n_chans) with the lag of
+        the peak, in ms (NaN where the correlation is undefined).
+    """
+    sfreq=epochs.info['sfreq']
+    min_lagval=int(np.floor(float(min_lag)*sfreq/1000))
+    max_lagval=int(np.ceil(float(max_lag)*sfreq/1000))
+    lags=np.arange(min_lagval,max_lagval+1)*1000/sfreq
+    n_chans=len(epochs.ch_names)
+    data=[event_data(epochs,key) for key in event_names]
+    corr=np.full((len(event_names),max([vals.shape[0] for vals in data]),len(lags),n_chans,n_chans),np.nan,dtype=float_dtype)
+    for k,vals in enumerate(data):
+        corr[k,:vals.shape[0]]=lag_scan(vals,min_lagval,max_lagval)
+        if progress is not None:
+            progress(k+1,len(event_names))
+    best_lag=peak_lag(corr,lags,absolute)
+    return corr,lags,best_lag
+
+#lag of the peak of a lag scan
+def peak_lag(corr,lags,absolute=True):
+    """Lag of the maximum (of |corr| if absolute) along the lag axis (-3) of
+    corr, NaN where all the lags are NaN."""
+    a=np.abs(corr) if absolute else corr
+    valid=~np.all(np.isnan(a),axis=-3)
+    idx=np.argmax(np.where(np.isnan(a),-np.inf,a),axis=-3)
+    return np.where(valid,np.asarray(lags)[idx],np.nan)
 
 #spearman correlation and comparison between conditions
 def spearman_corr():
@@ -1488,43 +2014,15 @@ def spearman_corr():
         n_chans=len(eeg1.ch_names)
         def step():
             if int(delay.get())>=0:
-                delayval=int(float(delay.get())*eeg1.info['sfreq']/1000)
-                max_epo_x1=max([len(x1[key]) for key in event_dict.keys()])
-                corr_val_x1=np.empty((len(event_dict.keys()),max_epo_x1,n_chans,n_chans))
-                corr_val_x1.fill(np.nan)
+                jobs=[partial(compute_corr,x1,list(event_dict.keys()),float(delay.get()),'spearman')]
                 if x2 is not None:
-                    max_epo_x2=max([len(x2[key]) for key in event_dict.keys()])
-                    corr_val_x2=np.empty((len(event_dict.keys()),max_epo_x2,n_chans,n_chans))
-                    corr_val_x2.fill(np.nan)
-                pbar['value']=0.0
-                k=0                
-                for i in range(n_chans):
-                    for j in range(n_chans):
-                        win.update_idletasks()
-                        win.update()
-                        k+=1
-                        pbar['value'] += 100/(n_chans*n_chans)
-                        pbtxt['text']=f"{k:d}/{n_chans*n_chans:d}"
-                        key_idx=0
-                        for key in event_dict.keys():
-                            n_epochs=len(x1[key])
-                            for epoch in range(n_epochs):
-                                if delayval>0:
-                                    corr_val_x1[key_idx,epoch,i,j]=spearmanr(x1[key][epoch]._data[0,i,:-delayval],x1[key][epoch]._data[0,j,delayval:]).correlation
-                                elif delayval==0:
-                                    corr_val_x1[key_idx,epoch,i,j]=spearmanr(x1[key][epoch]._data[0,i,:],x1[key][epoch]._data[0,j,:]).correlation
-                                else:
-                                    showinfo(title="Error",message="Delay must be positive")
-                            if x2 is not None:
-                                n_epochs2=len(x2[key])
-                                for epoch2 in range(n_epochs2):
-                                    if delayval>0:
-                                        corr_val_x2[key_idx,epoch2,i,j]=spearmanr(x2[key][epoch2]._data[0,i,:-delayval],x2[key][epoch2]._data[0,j,delayval:]).correlation
-                                    elif delayval==0:
-                                        corr_val_x2[key_idx,epoch2,i,j]=spearmanr(x2[key][epoch2]._data[0,i,:],x2[key][epoch2]._data[0,j,:]).correlation
-                                    else:
-                                        showinfo(title="Error",message="Delay must be positive")
-                            key_idx+=1
+                    jobs.append(partial(compute_corr,x2,list(event_dict.keys()),float(delay.get()),'spearman'))
+                results=run_task(win,pbar,pbtxt,jobs)
+                if results is None:
+                    return
+                corr_val_x1=results[0]
+                if x2 is not None:
+                    corr_val_x2=results[1]
                 def save_corr():
                     showinfo(title="Info",message="First you'll save the average\nacross epochs (CSV table)")
                     key_idx=0
@@ -1723,6 +2221,851 @@ def spearman_corr():
         btn.grid(row=2,column=0,sticky=W,padx=10)
         pbar.grid(row=2,column=1,sticky=W)
         pbtxt.grid(row=2,column=2,sticky=W)
+        Button(win,text="Significance test (surrogates)",command=lambda: surrogate_dialog(win,'spearman',lambda: {'delay':float(delay.get())})).grid(row=6,column=0,padx=10,pady=(0,10),sticky=W)
+
+#symbolization of the series according to a partition
+def symbolize(vals,symb_type=None,n_symbols=2,divs=None):
+    """Converts each series into a sequence of integer symbols.
+    Parameters
+    ----------
+    vals : np.array
+        Array of shape (...,n_times). Each series along the last axis is
+        partitioned independently.
+    symb_type : str, None
+        'equal-divs' for n_symbols intervals of equal size between the minimum
+        and maximum of the series, 'equal-points' for n_symbols intervals with
+        the same number of points, or None to use the given divs.
+    n_symbols : int
+        Number of symbols, used with 'equal-divs' and 'equal-points'.
+    divs : list
+        Partition divisions, used when symb_type is None.
+    Returns
+    -------
+    symbols : np.array
+        Integer array with the same shape as vals, where each value is the
+        number of divisions that are lower than or equal to the sample.
+    """
+    vals=np.asarray(vals)
+    if symb_type=='equal-divs':
+        vmin=vals.min(axis=-1,keepdims=True)
+        vmax=vals.max(axis=-1,keepdims=True)
+        divs=vmin+(vmax-vmin)*np.arange(1,n_symbols)/n_symbols
+    elif symb_type=='equal-points':
+        divs=np.moveaxis(np.quantile(vals,np.arange(1,n_symbols)/n_symbols,axis=-1),0,-1)
+    else:
+        divs=np.broadcast_to(np.sort(np.asarray(divs,dtype=float)),vals.shape[:-1]+(len(divs),))
+    symbols=np.zeros(vals.shape,dtype=np.int64)
+    for k in range(divs.shape[-1]):
+        symbols+=vals>=divs[...,k:k+1]
+    return symbols
+
+#symbolization of the leading and delayed series, done once per run
+def symbolize_lagged(vals,delayval,symb_type=None,n_symbols=2,x_divs=None,y_divs=None):
+    """Symbolizes the source (vals[...,:-delayval]) and the delayed target
+    (vals[...,delayval:]) series of every channel, so that the symbols can be
+    reused by all the channel pairs.
+    Returns
+    -------
+    sx, sy : np.array
+        Integer arrays of shape (...,n_chans,n_times-delayval).
+    """
+    x,y=lagged_slices(vals,delayval)
+    sx=symbolize(x,symb_type,n_symbols,x_divs)
+    sy=symbolize(y,symb_type,n_symbols,y_divs)
+    return sx,sy
+
+#number of symbols used by a partition
+def alphabet_size(symb_type,n_symbols,x_divs=None,y_divs=None):
+    """Number of symbols, which for user-given divisions is len(divs)+1"""
+    if symb_type is None:
+        return max(len(x_divs),len(y_divs))+1
+    return n_symbols
+
+#codes a sequence of symbols (a word) as a single integer
+def symbol_words(symbols,length,tau,n_symbols,start,stop,future=False):
+    """Integer code of the words of the given length, spaced by tau, for every
+    time t in [start,stop). Past words are (s[t],s[t-tau],...) and future words
+    are (s[t+tau],s[t+2*tau],...)."""
+    code=np.zeros(symbols.shape[:-1]+(stop-start,),dtype=np.int64)
+    for k in range(length):
+        if future:
+            offset=(k+1)*tau
+        else:
+            offset=-k*tau
+        code+=symbols[...,start+offset:stop+offset]*n_symbols**k
+    return code
+
+#log base of the information units
+def unit_log(units):
+    """Natural logarithm of the base of 'bits', 'nat' or 'ban'"""
+    return np.log({'bits':2,'nat':np.e,'ban':10}[units])
+
+#transfer entropy from the joint histogram of (future of y, past of y, past of x)
+def te_from_counts(counts,units='bits'):
+    """Transfer entropy from the joint counts, array of shape (...,n_yf,n_yp,n_xp)."""
+    p=counts/counts.sum(axis=(-3,-2,-1),keepdims=True)
+    p_ypxp=p.sum(axis=-3,keepdims=True)
+    p_yfyp=p.sum(axis=-1,keepdims=True)
+    p_yp=p.sum(axis=(-3,-1),keepdims=True)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        terms=np.where(p>0,p*np.log(p*p_yp/(p_ypxp*p_yfyp)),0)
+    return terms.sum(axis=(-3,-2,-1))/unit_log(units)
+
+#mutual information from the joint histogram of (y, x)
+def mi_from_counts(counts,units='bits'):
+    """Mutual information from the joint counts, array of shape (...,n_y,n_x)."""
+    p=counts/counts.sum(axis=(-2,-1),keepdims=True)
+    p_x=p.sum(axis=-2,keepdims=True)
+    p_y=p.sum(axis=-1,keepdims=True)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        terms=np.where(p>0,p*np.log(p/(p_x*p_y)),0)
+    return terms.sum(axis=(-2,-1))/unit_log(units)
+
+#transfer entropy from x to y, using already symbolized series
+def te_symbols(sx,sy,n_symbols,symbolic_length=(1,1,1),tau=1,units='bits'):
+    """Transfer entropy from x to y, computed from the symbol sequences.
+    Parameters
+    ----------
+    sx, sy : np.array
+        Symbols of the source and of the target series (same length).
+    n_symbols : int
+        Number of symbols of the partition.
+    symbolic_length : tuple
+        Word lengths for the past of x, past of y and future of y.
+    tau : int
+        Spacing between consecutive symbols of a word.
+    units : str
+        'bits', 'nat' or 'ban'.
+    Returns
+    -------
+    te : float
+        Transfer entropy from x to y.
+    """
+    lxp,lyp,lyf=symbolic_length
+    start=(max(lxp,lyp)-1)*tau
+    stop=sx.shape[-1]-lyf*tau
+    xp=symbol_words(sx,lxp,tau,n_symbols,start,stop)
+    yp=symbol_words(sy,lyp,tau,n_symbols,start,stop)
+    yf=symbol_words(sy,lyf,tau,n_symbols,start,stop,future=True)
+    n_xp,n_yp,n_yf=n_symbols**lxp,n_symbols**lyp,n_symbols**lyf
+    counts=np.bincount((yf*n_yp+yp)*n_xp+xp,minlength=n_yf*n_yp*n_xp)
+    return te_from_counts(counts.reshape(n_yf,n_yp,n_xp),units)
+
+#mutual information between x and y, using already symbolized series
+def mi_symbols(sx,sy,n_symbols,symbolic_length=(1,1),tau=1,units='bits'):
+    """Mutual information between the words of x and of y, computed from the
+    symbol sequences (see te_symbols for the parameters)."""
+    lx,ly=symbolic_length
+    start=(max(lx,ly)-1)*tau
+    stop=sx.shape[-1]
+    xw=symbol_words(sx,lx,tau,n_symbols,start,stop)
+    yw=symbol_words(sy,ly,tau,n_symbols,start,stop)
+    n_x,n_y=n_symbols**lx,n_symbols**ly
+    counts=np.bincount(yw*n_x+xw,minlength=n_y*n_x)
+    return mi_from_counts(counts.reshape(n_y,n_x),units)
+
+#transfer entropy between all pairs of channels of one epoch
+def te_matrix(sx,sy,n_symbols,symbolic_length=(1,1,1),tau=1,units='bits'):
+    """Transfer entropy from every channel of x to every channel of y.
+    The words of every channel are coded once, combined into one joint index
+    per (source, target) pair and counted with a single bulk bincount, giving
+    the same values as calling te_symbols for each pair.
+    Parameters
+    ----------
+    sx, sy : np.array
+        Symbols of the source and of the target series, integer arrays of
+        shape (n_chans,n_samples).
+    n_symbols : int
+        Number of symbols of the partition.
+    symbolic_length : tuple
+        Word lengths for the past of x, past of y and future of y.
+    tau : int
+        Spacing between consecutive symbols of a word.
+    units : str
+        'bits', 'nat' or 'ban'.
+    Returns
+    -------
+    te : np.array
+        Array of shape (n_chans,n_chans), where te[i,j] is the transfer entropy
+        from channel i of x to channel j of y.
+    """
+    lxp,lyp,lyf=symbolic_length
+    start=(max(lxp,lyp)-1)*tau
+    stop=sx.shape[-1]-lyf*tau
+    xp=symbol_words(sx,lxp,tau,n_symbols,start,stop)
+    yp=symbol_words(sy,lyp,tau,n_symbols,start,stop)
+    yf=symbol_words(sy,lyf,tau,n_symbols,start,stop,future=True)
+    n_xp,n_yp,n_yf=n_symbols**lxp,n_symbols**lyp,n_symbols**lyf
+    return pair_counts(xp,(yf*n_yp+yp)*n_xp,n_yf*n_yp*n_xp,lambda c:te_from_counts(c.reshape(c.shape[:2]+(n_yf,n_yp,n_xp)),units))
+
+#transfer entropy for many interaction delays, reusing the coded words
+def te_delay_sweep(sx,sy,n_symbols,delays,symbolic_length=(1,1,1),tau=1,units='bits'):
+    """Transfer entropy from every channel of x to every channel of y for
+    several interaction delays. The series are symbolized once (not once per
+    delay) and their words are coded once over the whole series; each delay
+    only shifts the target codes before the bulk bincount of te_matrix.
+    Parameters
+    ----------
+    sx, sy : np.array
+        Symbols of the whole source and target series (sx with the x
+        partition, sy with the y partition), integer arrays of shape
+        (n_chans,n_times).
+    n_symbols : int
+        Number of symbols of the partition.
+    delays : list
+        Interaction delays, in samples (non-negative).
+    symbolic_length, tau, units :
+        As in te_matrix.
+    Returns
+    -------
+    te : np.array
+        Array of shape (n_delays,n_chans,n_chans), where te[k,i,j] is the
+        transfer entropy from channel i of x to channel j of y delayed by
+        delays[k] samples (the same as te_matrix on the lagged slices).
+    """
+    lxp,lyp,lyf=symbolic_length
+    start=(max(lxp,lyp)-1)*tau
+    stop=sx.shape[-1]-lyf*tau
+    n_xp,n_yp,n_yf=n_symbols**lxp,n_symbols**lyp,n_symbols**lyf
+    xp=symbol_words(sx,lxp,tau,n_symbols,start,stop)
+    yj=(symbol_words(sy,lyf,tau,n_symbols,start,stop,future=True)*n_yp+symbol_words(sy,lyp,tau,n_symbols,start,stop))*n_xp
+    te=np.empty((len(delays),sx.shape[0],sy.shape[0]))
+    for k,d in enumerate(delays):
+        d=int(d)
+        if (d<0) or (d>=stop-start):
+            raise ValueError("The delays must be non-negative and shorter than the series")
+        te[k]=pair_counts(xp[:,:xp.shape[1]-d],yj[:,d:],n_yf*n_yp*n_xp,lambda c:te_from_counts(c.reshape(c.shape[:2]+(n_yf,n_yp,n_xp)),units))
+    return te
+
+#mutual information between all pairs of channels of one epoch
+def mi_matrix(sx,sy,n_symbols,symbolic_length=(1,1),tau=1,units='bits'):
+    """Mutual information between every channel of x and every channel of y,
+    from a single bulk bincount (see te_matrix for the parameters)."""
+    lx,ly=symbolic_length
+    start=(max(lx,ly)-1)*tau
+    stop=sx.shape[-1]
+    xw=symbol_words(sx,lx,tau,n_symbols,start,stop)
+    yw=symbol_words(sy,ly,tau,n_symbols,start,stop)
+    n_x,n_y=n_symbols**lx,n_symbols**ly
+    return pair_counts(xw,yw*n_x,n_y*n_x,lambda c:mi_from_counts(c.reshape(c.shape[:2]+(n_y,n_x)),units))
+
+#mutual information of the upper triangle only, for symmetric series
+def mi_packed(sx,sy,n_symbols,symbolic_length=(1,1),tau=1,units='bits',max_items=2**24):
+    """Mutual information of the pairs i<=j only, packed as in pack_triangle.
+    Valid when the matrix is symmetric (zero delay, same partition and word
+    length for x and y), where it halves the histogram work of mi_matrix.
+    Pairs are processed in blocks of at most max_items indices."""
+    lx,ly=symbolic_length
+    start=(max(lx,ly)-1)*tau
+    stop=sx.shape[-1]
+    xw=symbol_words(sx,lx,tau,n_symbols,start,stop)
+    yw=symbol_words(sy,ly,tau,n_symbols,start,stop)*n_symbols**lx
+    n_x,n_y=n_symbols**lx,n_symbols**ly
+    iu=np.triu_indices(sx.shape[0])
+    counts=np.empty((len(iu[0]),n_x*n_y))
+    rows=max(1,max_items//max(xw.shape[1],1))
+    for b in range(0,len(iu[0]),rows):
+        i,j=iu[0][b:b+rows],iu[1][b:b+rows]
+        idx=xw[i]+yw[j]+(np.arange(len(i))*n_x*n_y)[:,None]
+        counts[b:b+rows]=np.bincount(idx.ravel(),minlength=len(i)*n_x*n_y).reshape(len(i),n_x*n_y)
+    return mi_from_counts(counts.reshape(-1,n_y,n_x),units)
+
+#joint histograms of all the (source, target) pairs
+def pair_counts(src,tgt,n_bins,reduce=None,max_items=2**24):
+    """Counts of src[i,t]+tgt[j,t] for every pair (i,j), where src and tgt are
+    integer codes of shape (n_chans,n_samples) whose sum is below n_bins.
+    Returns an array of shape (n_chans,n_chans,n_bins), or, with reduce, the
+    result of reduce on the counts of every block of source channels
+    (e.g. te_from_counts), so that the counts of all the pairs are never held
+    at once. Source channels are processed in blocks of at most max_items
+    indices and max_items bins."""
+    n_src,n_tgt,n_samples=src.shape[0],tgt.shape[0],src.shape[1]
+    rows=max(1,max_items//max(n_tgt*max(n_samples,n_bins),1))
+    offset=(np.arange(min(rows,n_src)*n_tgt)*n_bins).reshape(-1,n_tgt,1)
+    out=None
+    for i in range(0,n_src,rows):
+        r=min(rows,n_src-i)
+        idx=src[i:i+r,None,:]+tgt[None,:,:]+offset[:r]
+        counts=np.bincount(idx.ravel(),minlength=r*n_tgt*n_bins).reshape(r,n_tgt,n_bins)
+        if reduce is not None:
+            counts=reduce(counts)
+        if out is None:
+            out=np.empty((n_src,)+counts.shape[1:])
+        out[i:i+r]=counts
+    if out is None:
+        out=np.empty((0,n_tgt) if reduce is not None else (0,n_tgt,n_bins))
+    return out
+
+#information-theory measure of every moving window
+def windowed_info(kernel,vals,starttimes,wlenval,delayval,symb_type=None,n_symbols=2,x_divs=None,y_divs=None,block=64,**kwargs):
+    """Dynamic functional connectivity using transfer entropy or mutual
+    information. Each window is symbolized separately (as its own series) and
+    passed to the all-pairs kernel.
+    Parameters
+    ----------
+    kernel : function
+        te_matrix or mi_matrix.
+    vals : np.array
+        Array of shape (n_chans,n_times).
+    starttimes : np.array
+        First sample of each moving window.
+    wlenval : int
+        Window length, in samples.
+    delayval : int
+        Transmission delay, in samples.
+    symb_type, n_symbols, x_divs, y_divs :
+        Partition, as in symbolize.
+    block : int
+        Number of windows symbolized together.
+    **kwargs :
+        symbolic_length, tau and units, passed to the kernel.
+    Returns
+    -------
+    dfc : np.array
+        Array of shape (len(starttimes),n_chans,n_chans).
+    """
+    dfc=np.empty((len(starttimes),vals.shape[0],vals.shape[0]),dtype=np.result_type(vals.dtype,np.float32))
+    for b in range(0,len(starttimes),block):
+        x,y=window_stack(vals,starttimes[b:b+block],wlenval,delayval)
+        sx=symbolize(x,symb_type,n_symbols,x_divs)
+        sy=symbolize(y,symb_type,n_symbols,y_divs)
+        for m in range(sx.shape[0]):
+            dfc[b+m]=kernel(sx[m],sy[m],n_symbols,**kwargs)
+    return dfc
+
+#copies an array to shared memory, to be read by the process pool workers
+def share_array(a):
+    """Copies an array to a new shared memory block.
+    Returns the block (to be closed and unlinked by the caller) and the
+    (name,shape,dtype) spec used by the workers to attach to it."""
+    a=np.ascontiguousarray(a)
+    shm=shared_memory.SharedMemory(create=True,size=max(a.nbytes,1))
+    np.ndarray(a.shape,dtype=a.dtype,buffer=shm.buf)[...]=a
+    return shm,(shm.name,a.shape,a.dtype.str)
+
+#attaches to an array shared by share_array
+def attach_array(spec):
+    """Returns the shared memory block and a read-only array view on it."""
+    name,shape,dtype=spec
+    shm=shared_memory.SharedMemory(name=name)
+    a=np.ndarray(shape,dtype=np.dtype(dtype),buffer=shm.buf)
+    a.flags.writeable=False
+    return shm,a
+
+#process pool worker: all-pairs kernel for a block of epochs and source channels
+def info_worker(kernel,sx_spec,sy_spec,epochs,rows,n_symbols,kwargs):
+    shm_x,sx=attach_array(sx_spec)
+    shm_y,sy=attach_array(sy_spec)
+    try:
+        out=np.stack([kernel(sx[e,rows[0]:rows[1]],sy[e],n_symbols,**kwargs) for e in epochs])
+    finally:
+        del sx,sy
+        shm_x.close()
+        shm_y.close()
+    return out
+
+#process pool worker: moving-window kernel for a block of windows of one series
+def windowed_info_worker(kernel,spec,item,starttimes,wlenval,delayval,symb_args,kwargs):
+    shm,vals=attach_array(spec)
+    try:
+        out=windowed_info(kernel,vals[item],starttimes,wlenval,delayval,*symb_args,**kwargs)
+    finally:
+        del vals
+        shm.close()
+    return out
+
+#process pool of the workers
+def process_pool(n_jobs):
+    """Pool of n_jobs processes started with 'spawn': the pools are created
+    from worker threads of the Tk process, which must not be forked."""
+    return ProcessPoolExecutor(max_workers=n_jobs,mp_context=get_context('spawn'))
+
+#runs the tasks of the pool and reports the progress
+def run_pool(worker,tasks,n_jobs,store,progress=None,executor=None):
+    """Submits worker(*task) for every (key,task) in tasks and calls
+    store(key,result) as the results arrive. The progress callback is called
+    as progress(done,total); if it raises (e.g. to cancel the calculation),
+    the tasks that did not start yet are dropped. With executor, the tasks
+    go to that pool, which is left open for later calls, instead of a new
+    pool of n_jobs processes."""
+    done=0
+    own=executor is None
+    if own:
+        executor=process_pool(n_jobs)
+    futures={}
+    try:
+        futures={executor.submit(worker,*task):key for key,task in tasks}
+        for future in as_completed(futures):
+            store(futures[future],future.result())
+            done+=1
+            if progress is not None:
+                progress(done,len(futures))
+    finally:
+        if own:
+            executor.shutdown(wait=True,cancel_futures=True)
+        else:
+            #the pool is kept, but no task of this call may outlive it
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+#transfer entropy or mutual information of many epochs, using a process pool
+def parallel_info(kernel,symbols,n_symbols,n_jobs=None,progress=None,packed=False,extra_shape=(),executor=None,**kwargs):
+    """Applies te_matrix or mi_matrix to every epoch of every condition/event,
+    splitting the work in (condition/event, block of epochs, block of source
+    channels) tasks over a pool of n_jobs processes. The symbols are passed to
+    the workers through shared memory.
+    Parameters
+    ----------
+    kernel : function
+        te_matrix or mi_matrix.
+    symbols : list
+        List of (sx,sy) tuples (see symbolize_lagged), one per
+        condition/event, each of shape (n_epochs,n_chans,n_samples).
+    n_symbols : int
+        Number of symbols of the partition.
+    n_jobs : int, None
+        Number of processes (None for all cores, 1 to run in this process).
+    progress : function, None
+        Called as progress(done,total) after each task.
+    packed : bool
+        Whether the kernel returns packed triangles (mi_packed); the tasks are
+        then not split by source channels.
+    extra_shape : tuple
+        Leading axes of the output of the kernel, before the (source, target)
+        axes (e.g. (n_delays,) for te_delay_sweep).
+    executor : ProcessPoolExecutor, None
+        Pool to reuse across calls (see run_pool); a new one by default.
+    **kwargs :
+        symbolic_length, tau and units, passed to the kernel.
+    Returns
+    -------
+    results : list
+        List of arrays of shape (n_epochs,n_chans,n_chans), or
+        (n_epochs,n_chans*(n_chans+1)//2) if packed, one per entry of symbols.
+    """
+    if n_jobs is None:
+        n_jobs=os.cpu_count()
+    if packed:
+        results=[np.empty((sx.shape[0],sx.shape[1]*(sx.shape[1]+1)//2),dtype=float_dtype) for sx,sy in symbols]
+    else:
+        results=[np.empty((sx.shape[0],)+tuple(extra_shape)+(sx.shape[1],sy.shape[1]),dtype=float_dtype) for sx,sy in symbols]
+    total_epochs=sum([sx.shape[0] for sx,sy in symbols])
+    if n_jobs<=1 or total_epochs==0:
+        k=0
+        for n in range(len(symbols)):
+            for e in range(symbols[n][0].shape[0]):
+                results[n][e]=kernel(symbols[n][0][e],symbols[n][1][e],n_symbols,**kwargs)
+                k+=1
+                if progress is not None:
+                    progress(k,total_epochs)
+        return results
+    #aim at ~4 tasks per process, splitting the source channels if there are few epochs
+    n_tasks=4*n_jobs
+    epoch_block=max(1,total_epochs//n_tasks)
+    n_chans=symbols[0][0].shape[1]
+    row_block=max(1,int(np.ceil(n_chans*total_epochs/n_tasks))) if (total_epochs<n_tasks) and not packed else n_chans
+    shms=[]
+    tasks=[]
+    try:
+        for n,(sx,sy) in enumerate(symbols):
+            shm_x,sx_spec=share_array(sx)
+            shm_y,sy_spec=share_array(sy)
+            shms+=[shm_x,shm_y]
+            for e in range(0,sx.shape[0],epoch_block):
+                epochs=list(range(e,min(e+epoch_block,sx.shape[0])))
+                for r in range(0,n_chans,row_block):
+                    rows=(r,min(r+row_block,n_chans))
+                    tasks.append(((n,epochs,rows),(kernel,sx_spec,sy_spec,epochs,rows,n_symbols,kwargs)))
+        def store(key,out):
+            n,epochs,rows=key
+            if packed:
+                results[n][epochs[0]:epochs[-1]+1]=out
+            else:
+                results[n][epochs[0]:epochs[-1]+1,...,rows[0]:rows[1],:]=out
+        run_pool(info_worker,tasks,n_jobs,store,progress,executor)
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return results
+
+#moving-window transfer entropy or mutual information, using a process pool
+def parallel_windowed_info(kernel,vals,starttimes,wlenval,delayval,symb_type=None,n_symbols=2,x_divs=None,y_divs=None,n_jobs=None,progress=None,emit=None,**kwargs):
+    """Parallel version of windowed_info for many series.
+    Parameters
+    ----------
+    vals : list
+        List of arrays of shape (n_items,n_chans,n_times), e.g. the epochs of
+        each condition/event, or a raw recording as vals[None].
+    starttimes : list
+        First sample of each moving window, one array per entry of vals.
+    n_jobs : int, None
+        Number of processes (None for all cores, 1 to run in this process).
+    progress : function, None
+        Called as progress(done,total) after each task.
+    emit : function, None
+        If given, called as emit(n,item,b,dfc) with the DFC of the windows
+        b, b+1, ... of vals[n][item] as they are computed (by blocks of
+        windows, all the items of a block before the next block), and
+        nothing is returned.
+    (other parameters as in windowed_info)
+    Returns
+    -------
+    results : list
+        List of arrays of shape (n_items,n_windows,n_chans,n_chans), one per entry of vals.
+    """
+    if n_jobs is None:
+        n_jobs=os.cpu_count()
+    symb_args=(symb_type,n_symbols,x_divs,y_divs)
+    results=None
+    if emit is None:
+        results=[np.empty((v.shape[0],len(st),v.shape[1],v.shape[1]),dtype=float_dtype) for v,st in zip(vals,starttimes)]
+        def emit(n,item,b,out):
+            results[n][item,b:b+out.shape[0]]=out
+    #windows per task, bounded to about 64 MB of results
+    max_block=max(1,2**26//(8*vals[0].shape[1]**2))
+    if n_jobs<=1:
+        total=sum([v.shape[0]*int(np.ceil(len(st)/max_block)) for v,st in zip(vals,starttimes)])
+        k=0
+        for n in range(len(vals)):
+            for b in range(0,len(starttimes[n]),max_block):
+                for item in range(vals[n].shape[0]):
+                    emit(n,item,b,windowed_info(kernel,vals[n][item],starttimes[n][b:b+max_block],wlenval,delayval,*symb_args,**kwargs))
+                    k+=1
+                    if progress is not None:
+                        progress(k,total)
+        return results
+    n_series=sum([v.shape[0] for v in vals])
+    shms=[]
+    tasks=[]
+    try:
+        for n,v in enumerate(vals):
+            shm,spec=share_array(v)
+            shms.append(shm)
+            win_block=min(max_block,max(1,int(np.ceil(len(starttimes[n])*n_series/(4*n_jobs)))))
+            for b in range(0,len(starttimes[n]),win_block):
+                for item in range(v.shape[0]):
+                    tasks.append(((n,item,b),(kernel,spec,item,starttimes[n][b:b+win_block],wlenval,delayval,symb_args,kwargs)))
+        def store(key,out):
+            emit(*key,out)
+        run_pool(windowed_info_worker,tasks,n_jobs,store,progress)
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return results
+
+#headless transfer entropy / mutual information of every epoch of every event
+def compute_info(epochs,event_names,delay=10,measure='te',symb_type='equal-divs',n_symbols=2,x_divs=None,y_divs=None,
+                 symbolic_length=None,tau=1,units='bits',n_jobs=None,progress=None,symmetric=False):
+    """Symbolic transfer entropy or mutual information between all pairs of
+    channels, for every epoch of every event, without any user interface.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    event_names : list
+        Names of the events to analyse.
+    delay : float
+        Transmission delay between brain regions, in ms (non-negative).
+    measure : str
+        'te' (transfer entropy) or 'mi' (mutual information).
+    symb_type, n_symbols, x_divs, y_divs :
+        Symbolization of the series, as in symbolize (the divisions are given
+        in the units of the data, i.e. V).
+    symbolic_length : tuple, None
+        Word lengths, (x_past,y_past,y_future) for 'te' and (x,y) for 'mi'
+        (None for all ones).
+    tau : int
+        Spacing of the symbols of each word, in samples.
+    units : str
+        'bits', 'nat' or 'ban'.
+    n_jobs : int, None
+        Number of processes (None for all cores, 1 to run in this process).
+    progress : function, None
+        Called as progress(done,total) after each task.
+    symmetric : bool
+        Compute and store only the upper triangle, packed as in pack_triangle
+        ('mi' with zero delay and the same partition and word length for x
+        and y, which make the matrices symmetric).
+    Returns
+    -------
+    info : np.array
+        Array of shape (n_events,max_epochs,n_chans,n_chans), or
+        (n_events,max_epochs,n_chans*(n_chans+1)//2) in symmetric mode,
+        padded with NaN for the events with less epochs.
+    """
+    kernels={'te':(te_matrix,(1,1,1)),'mi':(mi_matrix,(1,1))}
+    if measure not in kernels:
+        raise ValueError(f"Unknown information measure '{measure}'")
+    if float(delay)<0:
+        raise ValueError("Delay must be a non-negative number")
+    kernel,default_length=kernels[measure]
+    if symbolic_length is None:
+        symbolic_length=default_length
+    delayval=int(float(delay)*epochs.info['sfreq']/1000)
+    if symmetric:
+        same_divs=(x_divs is None and y_divs is None) or (x_divs is not None and y_divs is not None and np.array_equal(x_divs,y_divs))
+        if (measure!='mi') or (delayval!=0) or (not same_divs) or (symbolic_length[0]!=symbolic_length[1]):
+            raise ValueError("The symmetric mode requires 'mi' with zero delay and the same partition and word length for x and y")
+        kernel=mi_packed
+    n_symb=alphabet_size(symb_type,n_symbols,x_divs,y_divs)
+    symbols=[symbolize_lagged(event_data(epochs,key),delayval,symb_type,n_symb,x_divs,y_divs) for key in event_names]
+    results=parallel_info(kernel,symbols,n_symb,n_jobs=n_jobs,progress=progress,packed=symmetric,symbolic_length=symbolic_length,tau=tau,units=units)
+    info=np.full((len(event_names),max([r.shape[0] for r in results]))+results[0].shape[1:],np.nan,dtype=float_dtype)
+    for k in range(len(event_names)):
+        info[k,:results[k].shape[0]]=results[k]
+    return info
+
+#headless transfer entropy for a range of interaction delays
+def compute_te_sweep(epochs,event_names,delays=(0,10,20,30,40,50,60,70,80,90,100),symb_type='equal-divs',n_symbols=2,x_divs=None,y_divs=None,
+                     symbolic_length=(1,1,1),tau=1,units='bits',n_jobs=None,progress=None):
+    """Symbolic transfer entropy between all pairs of channels for several
+    interaction delays, for every epoch of every event (see te_delay_sweep).
+    The series are symbolized once, over the whole epoch, for all the delays,
+    so data-driven partitions ('equal-divs', 'equal-points') use the whole
+    epoch rather than the lagged slices of compute_info.
+    Parameters
+    ----------
+    delays : list
+        Interaction delays, in ms (non-negative).
+    (other parameters as in compute_info)
+    Returns
+    -------
+    te : np.array
+        Array of shape (n_events,max_epochs,n_delays,n_chans,n_chans), padded
+        with NaN for the events with less epochs.
+    delays : np.array
+        Delays actually used, in ms (rounded to whole samples).
+    """
+    sfreq=epochs.info['sfreq']
+    delayvals=np.array([int(float(d)*sfreq/1000) for d in delays])
+    if np.any(delayvals<0):
+        raise ValueError("Delays must be non-negative numbers")
+    n_symb=alphabet_size(symb_type,n_symbols,x_divs,y_divs)
+    symbols=[]
+    for key in event_names:
+        vals=event_data(epochs,key)
+        sx=symbolize(vals,symb_type,n_symb,x_divs)
+        sy=sx if (symb_type is not None) or np.array_equal(x_divs,y_divs) else symbolize(vals,symb_type,n_symb,y_divs)
+        symbols.append((sx,sy))
+    results=parallel_info(te_delay_sweep,symbols,n_symb,n_jobs=n_jobs,progress=progress,extra_shape=(len(delayvals),),
+                          delays=delayvals,symbolic_length=tuple(symbolic_length),tau=tau,units=units)
+    te=np.full((len(event_names),max([r.shape[0] for r in results]))+results[0].shape[1:],np.nan,dtype=float_dtype)
+    for k in range(len(event_names)):
+        te[k,:results[k].shape[0]]=results[k]
+    return te,delayvals*1000/sfreq
+
+#surrogate series for significance testing
+def make_surrogates(vals,n_surrogates,kind='shift',rng=None,min_shift=None):
+    """Surrogates of every series, generated in one batch. Each channel is
+    randomized independently, which keeps its own properties but destroys
+    the coupling between channels.
+    Parameters
+    ----------
+    vals : np.array
+        Array of shape (...,n_chans,n_times).
+    n_surrogates : int
+        Number of surrogates.
+    kind : str
+        'shuffle' (random permutation of the samples), 'shift' (random
+        circular time shift, keeps the autocorrelation) or 'phase' (random
+        Fourier phases, keeps the power spectrum).
+    rng : np.random.Generator, int, None
+        Random generator or seed.
+    min_shift : int, None
+        Minimum circular shift, in samples (default: 10% of the series).
+    Returns
+    -------
+    surr : np.array
+        Array of shape (n_surrogates,...,n_chans,n_times).
+    """
+    rng=np.random.default_rng(rng)
+    n_times=vals.shape[-1]
+    shape=(n_surrogates,)+vals.shape
+    if kind=='shuffle':
+        return rng.permuted(np.broadcast_to(vals,shape),axis=-1)
+    elif kind=='shift':
+        if min_shift is None:
+            min_shift=max(1,n_times//10)
+        min_shift=min(int(min_shift),n_times//2)
+        shift=rng.integers(min_shift,n_times-min_shift+1,size=shape[:-1])
+        idx=(np.arange(n_times)+shift[...,None])%n_times
+        return np.take_along_axis(np.broadcast_to(vals,shape),idx,axis=-1)
+    elif kind=='phase':
+        f=np.fft.rfft(vals,axis=-1)
+        phases=rng.uniform(0,2*np.pi,size=shape[:-1]+(f.shape[-1],))
+        phases[...,0]=0
+        if n_times%2==0:
+            phases[...,-1]=0
+        return np.fft.irfft(f*np.exp(1j*phases),n=n_times,axis=-1).astype(vals.dtype)
+    raise ValueError(f"Unknown surrogate type '{kind}'")
+
+#connectivity of a stack of series with any of the epoch measures
+def stack_metric(vals,measure,delayval,symb_type='equal-divs',n_symbols=2,x_divs=None,y_divs=None,
+                 symbolic_length=None,tau=1,units='bits',n_jobs=None,executor=None):
+    """Applies the batched kernel of a measure ('pearson', 'spearman', 'te' or
+    'mi') to every item of vals, array of shape (n_items,n_chans,n_times).
+    For 'te' and 'mi', executor is an optional pool reused across calls (see
+    parallel_info). Returns an array of shape (n_items,n_chans,n_chans)."""
+    if measure in ('pearson','spearman'):
+        engine={'pearson':lagged_corr,'spearman':lagged_spearman}[measure]
+        return engine(*lagged_slices(vals,delayval))
+    kernels={'te':(te_matrix,(1,1,1)),'mi':(mi_matrix,(1,1))}
+    if measure not in kernels:
+        raise ValueError(f"Unknown measure '{measure}'")
+    kernel,default_length=kernels[measure]
+    n_symb=alphabet_size(symb_type,n_symbols,x_divs,y_divs)
+    symbols=symbolize_lagged(vals,delayval,symb_type,n_symb,x_divs,y_divs)
+    return parallel_info(kernel,[symbols],n_symb,n_jobs=n_jobs,executor=executor,symbolic_length=symbolic_length or default_length,tau=tau,units=units)[0]
+
+#headless surrogate significance test of the epoch-averaged connectivity
+def compute_surrogate_test(epochs,event_names,measure='pearson',delay=10,n_surrogates=1000,kind='shift',seed=None,
+                           max_batch_bytes=2**28,n_jobs=None,progress=None,**kwargs):
+    """Significance of the connectivity of every pair of channels, averaged
+    over the epochs of each event, against surrogates. The surrogates of all
+    the epochs are generated in batches (see make_surrogates) and each batch
+    goes through the batched kernel of the measure in a single call, so the
+    null distribution costs a few large calls instead of one loop per
+    surrogate. Only the running mean and sum of squared deviations of the
+    null are kept (merged batch by batch, as in Welford's algorithm). For
+    'te' and 'mi', a single process pool serves all the batches.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    event_names : list
+        Names of the events to analyse.
+    measure : str
+        'pearson', 'spearman', 'te' or 'mi'.
+    delay : float
+        Transmission delay between brain regions, in ms (non-negative).
+    n_surrogates : int
+        Number of surrogates.
+    kind : str
+        'shuffle', 'shift' or 'phase' (see make_surrogates).
+    seed : int, None
+        Seed of the random generator.
+    max_batch_bytes : int
+        Memory budget for the surrogate series of one batch.
+    n_jobs : int, None
+        Number of processes for 'te' and 'mi'.
+    progress : function, None
+        Called as progress(done,total) after each batch.
+    **kwargs :
+        symb_type, n_symbols, x_divs, y_divs, symbolic_length, tau and units,
+        as in compute_info.
+    Returns
+    -------
+    test : dict
+        'value': observed epoch-averaged connectivity, 'z': z-score against the
+        null, 'p': p-value (one-sided for 'te' and 'mi', on the absolute value
+        for the correlations), each an array of shape (n_events,n_chans,n_chans).
+    """
+    if float(delay)<0:
+        raise ValueError("Delay must be a non-negative number")
+    if int(n_surrogates)<1:
+        raise ValueError("At least one surrogate is required")
+    rng=np.random.default_rng(seed)
+    delayval=int(float(delay)*epochs.info['sfreq']/1000)
+    two_sided=measure in ('pearson','spearman')
+    n_chans=len(epochs.ch_names)
+    test={key:np.full((len(event_names),n_chans,n_chans),np.nan,dtype=float_dtype) for key in ('value','z','p')}
+    data=[event_data(epochs,key) for key in event_names]
+    batches=[max(1,int(max_batch_bytes//max(vals.nbytes,1))) for vals in data]
+    total=sum([int(np.ceil(n_surrogates/b)) for b in batches])
+    done=0
+    if n_jobs is None:
+        n_jobs=os.cpu_count()
+    executor=process_pool(n_jobs) if (measure in ('te','mi')) and (n_jobs>1) else None
+    try:
+        for k,vals in enumerate(data):
+            with np.errstate(invalid='ignore'):
+                obs=np.nanmean(stack_metric(vals,measure,delayval,n_jobs=n_jobs,executor=executor,**kwargs),axis=0)
+            stat=np.abs(obs) if two_sided else obs
+            count=np.zeros((n_chans,n_chans))
+            n=0
+            mean=np.zeros((n_chans,n_chans))
+            m2=np.zeros((n_chans,n_chans))
+            for b in range(0,n_surrogates,batches[k]):
+                m=min(batches[k],n_surrogates-b)
+                surr=make_surrogates(vals,m,kind,rng).reshape((-1,)+vals.shape[1:])
+                with np.errstate(invalid='ignore'):
+                    null=np.nanmean(stack_metric(surr,measure,delayval,n_jobs=n_jobs,executor=executor,**kwargs).reshape((m,)+vals.shape[:1]+(n_chans,n_chans)),axis=1)
+                count+=((np.abs(null) if two_sided else null)>=stat).sum(axis=0)
+                #merges the mean and squared deviations of the batch into the running ones
+                batch_mean=null.mean(axis=0)
+                delta=batch_mean-mean
+                mean+=delta*m/(n+m)
+                m2+=np.square(null-batch_mean).sum(axis=0)+np.square(delta)*n*m/(n+m)
+                n+=m
+                done+=1
+                if progress is not None:
+                    progress(done,total)
+            std=np.sqrt(m2/n)
+            test['value'][k]=obs
+            with np.errstate(divide='ignore',invalid='ignore'):
+                test['z'][k]=(obs-mean)/std
+            test['p'][k]=np.where(np.isnan(obs),np.nan,(count+1)/(n_surrogates+1))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True,cancel_futures=True)
+    return test
+
+#headless optimal embedding delay of every channel
+def compute_optimal_delay(epochs,event_names,progress=None):
+    """Optimal Takens' reconstruction delay of every channel, for every epoch
+    of every event, without any user interface.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    event_names : list
+        Names of the events to analyse.
+    progress : function, None
+        Called as progress(done,total) after each epoch.
+    Returns
+    -------
+    optim_tau : np.array
+        Array of shape (n_events,max_epochs,n_chans), padded with NaN for the
+        events with less epochs.
+    """
+    n_chans=len(epochs.ch_names)
+    data=[event_data(epochs,key) for key in event_names]
+    optim_tau=np.full((len(event_names),max([vals.shape[0] for vals in data]),n_chans),np.nan)
+    total=sum([vals.shape[0] for vals in data])
+    count=0
+    for k,vals in enumerate(data):
+        for ev in range(vals.shape[0]):
+            for sel_chan in range(n_chans):
+                optim_tau[k,ev,sel_chan]=int(complexity_delay(vals[ev,sel_chan,:]))
+            count+=1
+            if progress is not None:
+                progress(count,total)
+    return optim_tau
+
+#partition divisions given in microvolts, converted to volts
+def divisions_volts(divs):
+    """Converts divisions in uV (list, or comma-separated string) to a list
+    in V; None stays None."""
+    if divs is None:
+        return None
+    if isinstance(divs,str):
+        divs=divs.split(sep=',')
+    return [float(i)*10**-6 for i in divs]
+
+#symbolization chosen in the windows of transfer entropy and mutual information
+def symbolization_args(div_type,x_divs=None,y_divs=None):
+    """Returns the (symb_type,x_divs,y_divs) of symbolize for the partition
+    options of the TE/MI windows: div_type 1 for equal-sized divisions, 2 for
+    divisions with the same number of points, 3 for the given X and Y
+    divisions, in uV (see divisions_volts)."""
+    if div_type==1:
+        return 'equal-divs',None,None
+    if div_type==2:
+        return 'equal-points',None,None
+    return None,divisions_volts(x_divs),divisions_volts(y_divs)
 
 #transfer entropy and comparison between conditions
 def te():
@@ -1749,6 +3092,8 @@ def te():
     tau.set('1')
     unit=StringVar()
     optionlist=['bits','nat','ban']
+    n_proc=StringVar()
+    n_proc.set(str(os.cpu_count()))
     error=make_x()
     if error==1:
         Label(win,text="ERROR\nIt is required at least\n1 preprocessed data",justify=CENTER).grid(row=0,column=0,padx=10,pady=10)        
@@ -1759,79 +3104,18 @@ def te():
         n_chans=len(eeg1.ch_names)
         def step():
             if int(delay.get())>=0:
-                delayval=int(float(delay.get())*eeg1.info['sfreq']/1000)
-                max_epo_x1=max([len(x1[key]) for key in event_dict.keys()])
-                corr_val_x1=np.empty((len(event_dict.keys()),max_epo_x1,n_chans,n_chans))
-                corr_val_x1.fill(np.nan)
+                symb_type,x_divs,y_divs=symbolization_args(div_type.get(),xdiv_vals.get(),ydiv_vals.get())
+                jobs=[partial(compute_info,x1,list(event_dict.keys()),float(delay.get()),'te',symb_type,int(ns.get()),x_divs,y_divs,
+                                      symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),tau=int(tau.get()),units=unit.get(),n_jobs=int(n_proc.get()))]
                 if x2 is not None:
-                    max_epo_x2=max([len(x2[key]) for key in event_dict.keys()])
-                    corr_val_x2=np.empty((len(event_dict.keys()),max_epo_x2,n_chans,n_chans))
-                    corr_val_x2.fill(np.nan)
-                if div_type.get()==1:
-                    symb_type='equal-divs'
-                    x_divs,y_divs=None,None
-                elif div_type.get()==2:
-                    symb_type='equal-points'
-                    x_divs,y_divs=None,None
-                elif div_type.get()==3:
-                    x_divs=[float(i)*10**-6 for i in xdiv_vals.get().split(sep=',')]
-                    y_divs=[float(i)*10**-6 for i in ydiv_vals.get().split(sep=',')]
-                    symb_type=None
-                total_steps=0
-                for i in range(n_chans):
-                    for j in range(n_chans):
-                        for key in event_dict.keys():
-                            for epoch1len in range(len(x1[key])):
-                                total_steps+=1
-                            if x2 is not None:
-                                for epoch2len in range(len(x2[key])):
-                                    total_steps+=1            
-                pbar['value']=0.0
-                k=0                
-                for i in range(n_chans):
-                    for j in range(n_chans):
-                        key_idx=0
-                        for key in event_dict.keys():
-                            n_epochs=len(x1[key])
-                            for epoch in range(n_epochs):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/total_steps
-                                pbtxt['text']=f"{k:d}/{total_steps:d}"
-                                if delayval>0:
-                                    corr_val_x1[key_idx,epoch,i,j]=transfer_entropy(x1[key][epoch]._data[0,i,:-delayval],x1[key][epoch]._data[0,j,delayval:],
-                                                                                    symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                    symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                    x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                elif delayval==0:
-                                    corr_val_x1[key_idx,epoch,i,j]=transfer_entropy(x1[key][epoch]._data[0,i,:],x1[key][epoch]._data[0,j,:],
-                                                                                    symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                    symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                    x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                else:
-                                    showinfo(title="Error",message="Delay must be positive")
-                            if x2 is not None:
-                                n_epochs2=len(x2[key])
-                                for epoch2 in range(n_epochs2):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/total_steps
-                                    pbtxt['text']=f"{k:d}/{total_steps:d}"
-                                    if delayval>0:
-                                        corr_val_x2[key_idx,epoch2,i,j]=transfer_entropy(x2[key][epoch2]._data[0,i,:-delayval],x2[key][epoch2]._data[0,j,delayval:],
-                                                                                          symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                          symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                          x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                    elif delayval==0:
-                                        corr_val_x2[key_idx,epoch2,i,j]=transfer_entropy(x2[key][epoch2]._data[0,i,:],x2[key][epoch2]._data[0,j,:],
-                                                                                          symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                          symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                          x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                    else:
-                                        showinfo(title="Error",message="Delay must be positive")
-                            key_idx+=1
+                    jobs.append(partial(compute_info,x2,list(event_dict.keys()),float(delay.get()),'te',symb_type,int(ns.get()),x_divs,y_divs,
+                                      symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),tau=int(tau.get()),units=unit.get(),n_jobs=int(n_proc.get())))
+                results=run_task(win,pbar,pbtxt,jobs)
+                if results is None:
+                    return
+                corr_val_x1=results[0]
+                if x2 is not None:
+                    corr_val_x2=results[1]
                 def save_corr():
                     showinfo(title="Info",message="First you'll save the average\nacross epochs (CSV table)")
                     key_idx=0
@@ -2026,38 +3310,15 @@ def te():
                 showinfo(title="Error",message="Delay must be a positive number")
         def find_optimal_tau():
             event_names=list(event_dict.keys())
-            optim_tau=np.empty((1,len(event_names),len(x1.events),len(x1.ch_names)))
+            jobs=[partial(compute_optimal_delay,x1,event_names)]
             if x2 is not None:
-                optim_tau=np.empty((2,len(event_names),max((len(x1.events),len(x2.events))),len(x1.ch_names)))
-            optim_tau.fill(np.nan)
-            count=0
-            pmax2=0
-            for k in range(len(event_names)):
-                for sel_chan in range(len(x1.ch_names)):
-                    for ev in range(len(x1[event_names[k]])):
-                        pmax2+=1
-                    if x2 is not None:
-                        for ev in range(len(x2[event_names[k]])):
-                            pmax2+=1
-            for k in range(len(event_names)):
-                vals1=x1[event_names[k]].get_data()
-                for sel_chan in range(len(x1.ch_names)):
-                    for ev in range(vals1.shape[0]):
-                        count+=1
-                        win.update_idletasks()
-                        win.update()
-                        pbar2['value'] += 100/pmax2
-                        pbtxt2['text']=f"{count:d}/{pmax2:d}"
-                        optim_tau[0,k,ev,sel_chan]=int(complexity_delay(vals1[ev,sel_chan,:]))
-                    if x2 is not None:
-                        vals2=x2[event_names[k]].get_data()
-                        for ev in range(vals2.shape[0]):
-                            count+=1
-                            win.update_idletasks()
-                            win.update()
-                            pbar2['value'] += 100/pmax2
-                            pbtxt2['text']=f"{count:d}/{pmax2:d}"
-                            optim_tau[1,k,ev,sel_chan]=int(complexity_delay(vals2[ev,sel_chan,:]))
+                jobs.append(partial(compute_optimal_delay,x2,event_names))
+            results=run_task(win,pbar2,pbtxt2,jobs)
+            if results is None:
+                return
+            optim_tau=np.full((len(results),len(event_names),max([r.shape[1] for r in results]),len(x1.ch_names)),np.nan)
+            for cond in range(len(results)):
+                optim_tau[cond,:,:results[cond].shape[1],:]=results[cond]
             cond_names=[cond1_name.get()]
             if x2 is not None:
                 cond_names.append(cond2_name.get())
@@ -2074,6 +3335,31 @@ def te():
             ax.set_xlabel("Condition/event")
             ax.set_ylabel("Optimal tau (Takens' reconstruction delay)")
             plt.show()
+        def step_sweep():
+            step_ms=float(sweep_step.get())
+            delays=np.arange(float(sweep_min.get()),float(sweep_max.get())+step_ms/2,step_ms) if step_ms>0 else []
+            if (len(delays)==0) or (delays[0]<0):
+                showinfo(title="Error",message="Delays must be non-negative, with a positive step")
+                return
+            symb_type,x_divs,y_divs=symbolization_args(div_type.get(),xdiv_vals.get(),ydiv_vals.get())
+            event_names=list(event_dict.keys())
+            jobs=[partial(compute_te_sweep,x1,event_names,delays,symb_type,int(ns.get()),x_divs,y_divs,
+                          symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),tau=int(tau.get()),units=unit.get(),n_jobs=int(n_proc.get()))]
+            if x2 is not None:
+                jobs.append(partial(compute_te_sweep,x2,event_names,delays,symb_type,int(ns.get()),x_divs,y_divs,
+                                    symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),tau=int(tau.get()),units=unit.get(),n_jobs=int(n_proc.get())))
+            results=run_task(win,pbar,pbtxt,jobs)
+            if results is None:
+                return
+            showinfo(title="Info",message="For each condition you'll save the TE of all epochs and delays\n(Numpy array of size (n_events,n_epochs,n_delays,n_chans,n_chans))\nand then, for each event, the delay (ms) that maximizes\nthe epoch-averaged TE of each pair (CSV table)")
+            for (te_vals,te_delays),x,cond in zip(results,[x1,x2],[cond1_name.get(),cond2_name.get()]):
+                fname = fd.asksaveasfilename(title="Transfer entropy delay sweep condition "+cond,defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                np.save(fname,te_vals)
+                with np.errstate(invalid='ignore'):
+                    best_delay=peak_lag(np.nanmean(te_vals,axis=1),te_delays,absolute=False)
+                for key_idx,key in enumerate(event_names):
+                    fname = fd.asksaveasfilename(title="Optimal delay (ms) for condition "+cond+" event "+key,defaultextension=".csv",filetypes=(("Comma Separated Values", "*.csv"),("All Files", "*.*")))
+                    pd.DataFrame(best_delay[key_idx],index=x.ch_names,columns=x.ch_names).to_csv(fname)
         Label(win,text="Calculate Transfer Entropy").grid(row=0,column=0,columnspan=5,padx=10,pady=10)
         Label(win,text="Transmission delay between brain regions (ms):").grid(row=1,column=0,padx=10,sticky=W)
         Entry(win,textvariable=delay,width=4).grid(row=1,column=1,sticky=W)
@@ -2105,6 +3391,8 @@ def te():
         pbtxt2.grid(row=10,column=4,sticky=W)
         Label(win,text="Units:").grid(row=11,column=0,sticky=W,padx=10)
         OptionMenu(win,unit,*optionlist).grid(row=11,column=1,sticky=W) 
+        Label(win,text="Number of processes:").grid(row=11,column=2,sticky=W)
+        Entry(win,textvariable=n_proc,width=3).grid(row=11,column=3,sticky=W)
         pbar=Progressbar(win,orient=HORIZONTAL,length=500,mode='determinate')
         pbar['value']=0.0
         pbtxt=Label(win,text="--")
@@ -2112,6 +3400,26 @@ def te():
         btn.grid(row=12,column=0,sticky=W,padx=10)
         pbar.grid(row=12,column=1,sticky=W,columnspan=3)
         pbtxt.grid(row=12,column=4,sticky=W)
+        sweep_min=StringVar()
+        sweep_min.set("0")
+        sweep_max=StringVar()
+        sweep_max.set("100")
+        sweep_step=StringVar()
+        sweep_step.set("10")
+        frame_sweep=Frame(win)
+        Label(frame_sweep,text="Delay sweep from (ms):").grid(row=0,column=0,sticky=W)
+        Entry(frame_sweep,textvariable=sweep_min,width=4).grid(row=0,column=1,sticky=W)
+        Label(frame_sweep,text=" to ").grid(row=0,column=2,sticky=W)
+        Entry(frame_sweep,textvariable=sweep_max,width=4).grid(row=0,column=3,sticky=W)
+        Label(frame_sweep,text=" step ").grid(row=0,column=4,sticky=W)
+        Entry(frame_sweep,textvariable=sweep_step,width=4).grid(row=0,column=5,sticky=W)
+        Button(frame_sweep,text="Delay sweep",command=step_sweep).grid(row=0,column=6,padx=10,sticky=W)
+        frame_sweep.grid(row=16,column=0,columnspan=5,padx=10,pady=(0,10),sticky=W)
+        def info_kwargs():
+            symb_type,x_divs,y_divs=symbolization_args(div_type.get(),xdiv_vals.get(),ydiv_vals.get())
+            return {'delay':float(delay.get()),'symb_type':symb_type,'n_symbols':int(ns.get()),'x_divs':x_divs,'y_divs':y_divs,
+                    'symbolic_length':(int(lxp.get()),int(lyp.get()),int(lyf.get())),'tau':int(tau.get()),'units':unit.get(),'n_jobs':int(n_proc.get())}
+        Button(win,text="Significance test (surrogates)",command=lambda: surrogate_dialog(win,'te',info_kwargs)).grid(row=17,column=0,padx=10,pady=(0,10),sticky=W)
 
 #mutual information and comparison between conditions
 def mi():
@@ -2136,6 +3444,8 @@ def mi():
     tau.set('1')
     unit=StringVar()
     optionlist=['bits','nat','ban']
+    n_proc=StringVar()
+    n_proc.set(str(os.cpu_count()))
     error=make_x()
     if error==1:
         Label(win,text="ERROR\nIt is required at least\n1 preprocessed data",justify=CENTER).grid(row=0,column=0,padx=10,pady=10)        
@@ -2146,79 +3456,18 @@ def mi():
         n_chans=len(eeg1.ch_names)
         def step():
             if int(delay.get())>=0:
-                delayval=int(float(delay.get())*eeg1.info['sfreq']/1000)
-                max_epo_x1=max([len(x1[key]) for key in event_dict.keys()])
-                corr_val_x1=np.empty((len(event_dict.keys()),max_epo_x1,n_chans,n_chans))
-                corr_val_x1.fill(np.nan)
+                symb_type,x_divs,y_divs=symbolization_args(div_type.get(),xdiv_vals.get(),ydiv_vals.get())
+                jobs=[partial(compute_info,x1,list(event_dict.keys()),float(delay.get()),'mi',symb_type,int(ns.get()),x_divs,y_divs,
+                                      symbolic_length=(int(lxp.get()),int(lyp.get())),tau=int(tau.get()),units=unit.get(),n_jobs=int(n_proc.get()))]
                 if x2 is not None:
-                    max_epo_x2=max([len(x2[key]) for key in event_dict.keys()])
-                    corr_val_x2=np.empty((len(event_dict.keys()),max_epo_x2,n_chans,n_chans))
-                    corr_val_x2.fill(np.nan)
-                if div_type.get()==1:
-                    symb_type='equal-divs'
-                    x_divs,y_divs=None,None
-                elif div_type.get()==2:
-                    symb_type='equal-points'
-                    x_divs,y_divs=None,None
-                elif div_type.get()==3:
-                    x_divs=[float(i)*10**-6 for i in xdiv_vals.get().split(sep=',')]
-                    y_divs=[float(i)*10**-6 for i in ydiv_vals.get().split(sep=',')]
-                    symb_type=None
-                total_steps=0
-                for i in range(n_chans):
-                    for j in range(n_chans):
-                        for key in event_dict.keys():
-                            for epoch1len in range(len(x1[key])):
-                                total_steps+=1
-                            if x2 is not None:
-                                for epoch2len in range(len(x2[key])):
-                                    total_steps+=1            
-                pbar['value']=0.0
-                k=0                
-                for i in range(n_chans):
-                    for j in range(n_chans):
-                        key_idx=0
-                        for key in event_dict.keys():
-                            n_epochs=len(x1[key])
-                            for epoch in range(n_epochs):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/total_steps
-                                pbtxt['text']=f"{k:d}/{total_steps:d}"
-                                if delayval>0:
-                                    corr_val_x1[key_idx,epoch,i,j]=mutual_info(x1[key][epoch]._data[0,i,:-delayval],x1[key][epoch]._data[0,j,delayval:],
-                                                                                    symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                    symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                    x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                elif delayval==0:
-                                    corr_val_x1[key_idx,epoch,i,j]=mutual_info(x1[key][epoch]._data[0,i,:],x1[key][epoch]._data[0,j,:],
-                                                                                    symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                    symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                    x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                else:
-                                    showinfo(title="Error",message="Delay must be positive")
-                            if x2 is not None:
-                                n_epochs2=len(x2[key])
-                                for epoch2 in range(n_epochs2):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/total_steps
-                                    pbtxt['text']=f"{k:d}/{total_steps:d}"
-                                    if delayval>0:
-                                        corr_val_x2[key_idx,epoch2,i,j]=mutual_info(x2[key][epoch2]._data[0,i,:-delayval],x2[key][epoch2]._data[0,j,delayval:],
-                                                                                          symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                          symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                          x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                    elif delayval==0:
-                                        corr_val_x2[key_idx,epoch2,i,j]=mutual_info(x2[key][epoch2]._data[0,i,:],x2[key][epoch2]._data[0,j,:],
-                                                                                          symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                          symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                          x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                    else:
-                                        showinfo(title="Error",message="Delay must be positive")
-                            key_idx+=1
+                    jobs.append(partial(compute_info,x2,list(event_dict.keys()),float(delay.get()),'mi',symb_type,int(ns.get()),x_divs,y_divs,
+                                      symbolic_length=(int(lxp.get()),int(lyp.get())),tau=int(tau.get()),units=unit.get(),n_jobs=int(n_proc.get())))
+                results=run_task(win,pbar,pbtxt,jobs)
+                if results is None:
+                    return
+                corr_val_x1=results[0]
+                if x2 is not None:
+                    corr_val_x2=results[1]
                 def save_corr():
                     showinfo(title="Info",message="First you'll save the average\nacross epochs (CSV table)")
                     key_idx=0
@@ -2413,38 +3662,15 @@ def mi():
                 showinfo(title="Error",message="Delay must be a positive number")
         def find_optimal_tau():
             event_names=list(event_dict.keys())
-            optim_tau=np.empty((1,len(event_names),len(x1.events),len(x1.ch_names)))
+            jobs=[partial(compute_optimal_delay,x1,event_names)]
             if x2 is not None:
-                optim_tau=np.empty((2,len(event_names),max((len(x1.events),len(x2.events))),len(x1.ch_names)))
-            optim_tau.fill(np.nan)
-            count=0
-            pmax2=0
-            for k in range(len(event_names)):
-                for sel_chan in range(len(x1.ch_names)):
-                    for ev in range(len(x1[event_names[k]])):
-                        pmax2+=1
-                    if x2 is not None:
-                        for ev in range(len(x2[event_names[k]])):
-                            pmax2+=1
-            for k in range(len(event_names)):
-                vals1=x1[event_names[k]].get_data()
-                for sel_chan in range(len(x1.ch_names)):
-                    for ev in range(vals1.shape[0]):
-                        count+=1
-                        win.update_idletasks()
-                        win.update()
-                        pbar2['value'] += 100/pmax2
-                        pbtxt2['text']=f"{count:d}/{pmax2:d}"
-                        optim_tau[0,k,ev,sel_chan]=int(complexity_delay(vals1[ev,sel_chan,:]))
-                    if x2 is not None:
-                        vals2=x2[event_names[k]].get_data()
-                        for ev in range(vals2.shape[0]):
-                            count+=1
-                            win.update_idletasks()
-                            win.update()
-                            pbar2['value'] += 100/pmax2
-                            pbtxt2['text']=f"{count:d}/{pmax2:d}"
-                            optim_tau[1,k,ev,sel_chan]=int(complexity_delay(vals2[ev,sel_chan,:]))
+                jobs.append(partial(compute_optimal_delay,x2,event_names))
+            results=run_task(win,pbar2,pbtxt2,jobs)
+            if results is None:
+                return
+            optim_tau=np.full((len(results),len(event_names),max([r.shape[1] for r in results]),len(x1.ch_names)),np.nan)
+            for cond in range(len(results)):
+                optim_tau[cond,:,:results[cond].shape[1],:]=results[cond]
             cond_names=[cond1_name.get()]
             if x2 is not None:
                 cond_names.append(cond2_name.get())
@@ -2490,6 +3716,8 @@ def mi():
         pbtxt2.grid(row=9,column=4,sticky=W)        
         Label(win,text="Units:").grid(row=10,column=0,sticky=W,padx=10)
         OptionMenu(win,unit,*optionlist).grid(row=10,column=1,sticky=W) 
+        Label(win,text="Number of processes:").grid(row=10,column=2,sticky=W)
+        Entry(win,textvariable=n_proc,width=3).grid(row=10,column=3,sticky=W)
         pbar=Progressbar(win,orient=HORIZONTAL,length=500,mode='determinate')
         pbar['value']=0.0
         pbtxt=Label(win,text="--")
@@ -2497,6 +3725,296 @@ def mi():
         btn.grid(row=11,column=0,sticky=W,padx=10)
         pbar.grid(row=11,column=1,sticky=W,columnspan=3)
         pbtxt.grid(row=11,column=4,sticky=W)
+        def info_kwargs():
+            symb_type,x_divs,y_divs=symbolization_args(div_type.get(),xdiv_vals.get(),ydiv_vals.get())
+            return {'delay':float(delay.get()),'symb_type':symb_type,'n_symbols':int(ns.get()),'x_divs':x_divs,'y_divs':y_divs,
+                    'symbolic_length':(int(lxp.get()),int(lyp.get())),'tau':int(tau.get()),'units':unit.get(),'n_jobs':int(n_proc.get())}
+        Button(win,text="Significance test (surrogates)",command=lambda: surrogate_dialog(win,'mi',info_kwargs)).grid(row=15,column=0,padx=10,pady=(0,10),sticky=W)
+
+#symmetry of the spectral connectivity measures (imcoh is antisymmetric)
+spectral_signs={'coh':1,'imcoh':-1,'wpli':1,'pli':1,'plv':1}
+
+#on-disk cache of the spectral connectivity (None as dir disables it; max_size in bytes)
+spectral_cache={'dir':os.path.join(os.path.expanduser('~'),'.eeg_causality_tools','spectral_cache'),'max_size':2*1024**3}
+
+#cache key of the spectral estimate of one event
+def spectral_cache_key(data,sfreq,event,fmins,fmaxs,mode='multitaper',bandwidth=None):
+    """Returns the hex digest identifying the multitaper estimate of one
+    event: a content hash of the epoch data plus (event, fmin, fmax, mode,
+    bandwidth). The measures are not part of the key, since all of them are
+    stored together."""
+    data=np.ascontiguousarray(data)
+    h=hashlib.sha1()
+    h.update(repr((data.shape,data.dtype.str,float(sfreq),event,tuple(map(float,fmins)),tuple(map(float,fmaxs)),mode,bandwidth)).encode())
+    h.update(memoryview(data).cast('B'))
+    return h.hexdigest()
+
+#reads a cached spectral estimate
+def spectral_cache_load(key,cache):
+    """Returns the dict of cached arrays for key, or None if it is not in the
+    cache. A hit refreshes the modification time, used as the LRU order.
+    A corrupt file (e.g. truncated) is removed and counts as a miss."""
+    if (cache is None) or (cache.get('dir') is None):
+        return None
+    fname=os.path.join(cache['dir'],key+'.npz')
+    if not os.path.exists(fname):
+        return None
+    try:
+        with np.load(fname) as f:
+            con={method:f[method] for method in f.files}
+        os.utime(fname)
+    except (OSError,ValueError,EOFError,KeyError,zipfile.BadZipFile):
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+        return None
+    return con
+
+#writes a spectral estimate to the cache, evicting the least recently used ones
+def spectral_cache_store(key,con,cache):
+    """Saves the dict of arrays con under key (atomically, so that several
+    processes can share the cache) and removes the least recently used files
+    until the cache is below cache['max_size'] bytes."""
+    if (cache is None) or (cache.get('dir') is None):
+        return
+    os.makedirs(cache['dir'],exist_ok=True)
+    #the temporary file is not a .npz, so it is never taken for a cache entry
+    fd_tmp,tmp=tempfile.mkstemp(prefix=key+'.',suffix='.tmp',dir=cache['dir'])
+    try:
+        with os.fdopen(fd_tmp,'wb') as f:
+            np.savez(f,**con)
+        os.replace(tmp,os.path.join(cache['dir'],key+'.npz'))
+    except OSError:
+        return
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    files=[]
+    for entry in os.scandir(cache['dir']):
+        try:
+            st=entry.stat()
+        except OSError:
+            continue
+        if entry.name.endswith('.npz'):
+            files.append((st.st_mtime,st.st_size,entry.path))
+        elif entry.name.endswith('.tmp') and (time.time()-st.st_mtime>3600):
+            #left by a process that stopped while writing it
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    files.sort()
+    total=sum([f[1] for f in files])
+    for mtime,size,path in files[:-1]:
+        if total<=cache['max_size']:
+            break
+        try:
+            os.remove(path)
+            total-=size
+        except OSError:
+            pass
+
+#removes all the cached spectral estimates
+def clear_spectral_cache(cache=None):
+    """Deletes the cache directory (spectral_cache by default)."""
+    if cache is None:
+        cache=spectral_cache
+    if (cache.get('dir') is not None) and os.path.isdir(cache['dir']):
+        shutil.rmtree(cache['dir'],ignore_errors=True)
+
+#spectral connectivity bundle of the epochs of one event
+def spectral_event(data,sfreq,fmins,fmaxs,methods,n_jobs=1,event=None,cache=None):
+    """Multitaper spectral connectivity of one event, for all the methods and
+    bands from a single estimate. With a cache, all the methods are computed
+    and stored on a miss, so that later requests for any method, e.g.
+    switching between coherence and wPLI, reuse the estimate.
+    Parameters
+    ----------
+    data : np.array
+        Array of shape (n_epochs,n_chans,n_times).
+    sfreq : float
+        Sampling frequency, in Hz.
+    fmins, fmaxs : tuple
+        Limits of the frequency bands, in Hz.
+    methods : list
+        Measures to compute (keys of spectral_signs).
+    n_jobs : int
+        Number of jobs passed to mne_connectivity.
+    event : str, None
+        Name of the event (part of the cache key).
+    cache : dict, None
+        Cache settings (see spectral_cache), None to disable the cache.
+    Returns
+    -------
+    con : dict
+        For each method, array of shape (n_bands,n_chans,n_chans).
+    """
+    key=None
+    if (cache is not None) and (cache.get('dir') is not None):
+        key=spectral_cache_key(data,sfreq,event,fmins,fmaxs)
+        con=spectral_cache_load(key,cache)
+        if (con is not None) and all([method in con for method in methods]):
+            return {method:con[method] for method in methods}
+        requested=methods
+        methods=list(spectral_signs)
+    n_chans=data.shape[1]
+    res=mne_connectivity.spectral_connectivity_epochs(data,indices=None,method=list(methods),mode='multitaper',sfreq=sfreq,
+                                                       fmin=tuple(fmins),fmax=tuple(fmaxs),faverage=True,mt_adaptive=False,n_jobs=n_jobs,verbose='ERROR')
+    if not isinstance(res,list):
+        res=[res]
+    con={}
+    for method,c in zip(methods,res):
+        c=np.moveaxis(np.reshape(c.get_data(),(n_chans,n_chans,len(fmins))),-1,0)
+        con[method]=c+spectral_signs[method]*np.swapaxes(c,-1,-2)
+    if key is not None:
+        spectral_cache_store(key,con,cache)
+        con={method:con[method] for method in requested}
+    return con
+
+#process pool worker: spectral connectivity bundle of one condition/event
+def spectral_worker(spec,sfreq,fmins,fmaxs,methods,n_jobs,event,cache):
+    shm,data=attach_array(spec)
+    try:
+        out=spectral_event(data,sfreq,fmins,fmaxs,methods,n_jobs,event,cache)
+    finally:
+        del data
+        shm.close()
+    return out
+
+#headless spectral connectivity of several conditions, using a process pool
+def parallel_spectral(epochs_list,event_names,fmin,fmax,methods=('coh','imcoh','wpli','pli','plv'),n_jobs=1,progress=None,cache=spectral_cache,symmetric=False):
+    """Spectral connectivity bundle of every (condition,event) pair. The pairs
+    are scheduled concurrently over a pool of processes and the remaining
+    workers are passed down to mne_connectivity, so that no more than n_jobs
+    cores are used in total. All the methods of one pair come from a single
+    multitaper estimate, so the pairs (not the methods) are the parallel tasks.
+    Parameters
+    ----------
+    epochs_list : list
+        List of mne.Epochs, one per condition.
+    event_names : list
+        Names of the events to analyse.
+    fmin, fmax : float, tuple
+        Limits of the frequency band, in Hz, or tuples with the limits of
+        several bands (e.g. from band_ranges).
+    methods : tuple
+        Measures to compute, among 'coh', 'imcoh', 'wpli', 'pli' and 'plv'.
+    n_jobs : int, None
+        Total number of processes (None for all cores, 1 to run in this process).
+    progress : function, None
+        Called as progress(done,total) after each (condition,event) pair.
+    cache : dict, None
+        On-disk cache of the estimates (spectral_cache by default, None to
+        always recompute).
+    symmetric : bool
+        Store only the upper triangles, packed as in pack_triangle (expand
+        with unpack_triangle and the sign of spectral_signs).
+    Returns
+    -------
+    results : list
+        One dict per condition with, for each method, an array of shape
+        (n_events,n_chans,n_chans), or (n_bands,n_events,n_chans,n_chans)
+        when several bands are given, with the full matrices (antisymmetric
+        for 'imcoh', symmetric otherwise); the last two axes are replaced by
+        one of size n_chans*(n_chans+1)//2 in symmetric mode.
+    """
+    methods=list(methods)
+    for method in methods:
+        if method not in spectral_signs:
+            raise ValueError(f"Unknown spectral connectivity method '{method}'")
+    fmins=tuple(np.atleast_1d(np.asarray(fmin,dtype=float)))
+    fmaxs=tuple(np.atleast_1d(np.asarray(fmax,dtype=float)))
+    if (len(fmins)!=len(fmaxs)) or not np.all((np.array(fmins)>0) & (np.array(fmaxs)>=np.array(fmins))):
+        raise ValueError("Frequencies must be positive, with fmax>=fmin for every band")
+    if n_jobs is None:
+        n_jobs=os.cpu_count()
+    def shape(n_chans):
+        return (n_chans*(n_chans+1)//2,) if symmetric else (n_chans,n_chans)
+    results=[{method:np.empty((len(fmins),len(event_names))+shape(len(ep.ch_names)),dtype=float_dtype) for method in methods} for ep in epochs_list]
+    def store(key,out):
+        n,k=key
+        for method in methods:
+            results[n][method][:,k]=pack_triangle(out[method]) if symmetric else out[method]
+    pairs=[(n,k) for n in range(len(epochs_list)) for k in range(len(event_names))]
+    #outer workers over the pairs, inner mne_connectivity jobs with the rest of the cores
+    outer=max(1,min(n_jobs,len(pairs)))
+    inner=max(1,n_jobs//outer)
+    if outer==1:
+        for done,(n,k) in enumerate(pairs):
+            ep=epochs_list[n]
+            store((n,k),spectral_event(event_data(ep,event_names[k]),ep.info['sfreq'],fmins,fmaxs,methods,inner,event_names[k],cache))
+            if progress is not None:
+                progress(done+1,len(pairs))
+    else:
+        shms=[]
+        tasks=[]
+        try:
+            for n,k in pairs:
+                ep=epochs_list[n]
+                shm,spec=share_array(event_data(ep,event_names[k]))
+                shms.append(shm)
+                tasks.append(((n,k),(spec,ep.info['sfreq'],fmins,fmaxs,methods,inner,event_names[k],cache)))
+            run_pool(spectral_worker,tasks,outer,store,progress)
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+    if np.ndim(fmin)==0:
+        results=[{method:val[0] for method,val in con.items()} for con in results]
+    return results
+
+#headless spectral connectivity bundle from a single multitaper estimate
+def compute_spectral_bundle(epochs,event_names,fmin,fmax,methods=('coh','imcoh','wpli','pli','plv'),n_jobs=1,progress=None,symmetric=False):
+    """Multitaper spectral connectivity between all pairs of channels,
+    averaged over the frequency band(s), for every event, without any user
+    interface. The tapered spectra of each event are computed once and all
+    the requested measures and bands are obtained from that single estimate.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    (other parameters as in parallel_spectral)
+    Returns
+    -------
+    con : dict
+        For each method, array of shape (n_events,n_chans,n_chans), or
+        (n_bands,n_events,n_chans,n_chans) when several bands are given
+        (packed triangles in symmetric mode).
+    """
+    return parallel_spectral([epochs],event_names,fmin,fmax,methods,n_jobs,progress,symmetric=symmetric)[0]
+
+#headless spectral connectivity in all the standard frequency bands
+def compute_multiband(epochs,event_names,bands=None,methods=('coh','imcoh','wpli','pli','plv'),n_jobs=1,progress=None,symmetric=False):
+    """Spectral connectivity bundle in several frequency bands from one
+    multitaper pass over the range that covers all the bands.
+    Parameters
+    ----------
+    bands : list, None
+        List of (fmin,fmax) pairs (None for band_ranges, the bands of the
+        frequency band list).
+    (other parameters as in compute_spectral_bundle)
+    Returns
+    -------
+    con : dict
+        For each method, array of shape (n_bands,n_events,n_chans,n_chans).
+    """
+    if bands is None:
+        bands=band_ranges
+    return compute_spectral_bundle(epochs,event_names,tuple(b[0] for b in bands),tuple(b[1] for b in bands),methods,n_jobs,progress,symmetric)
+
+#headless frequency-averaged spectral connectivity of every event
+def compute_spectral(epochs,event_names,fmin,fmax,method='coh',n_jobs=1,progress=None):
+    """Single measure version of compute_spectral_bundle.
+    Returns
+    -------
+    con : np.array
+        Array of shape (n_events,n_chans,n_chans).
+    """
+    return compute_spectral_bundle(epochs,event_names,fmin,fmax,(method,),n_jobs,progress)[method]
 
 #spectral coherence and comparison between conditions
 def coherence():
@@ -2507,72 +4025,34 @@ def coherence():
     fmax.set("12")
     fmin=StringVar()
     fmin.set("10")
+    n_proc=StringVar()
+    n_proc.set(str(os.cpu_count()))
     error=make_x()
     if error==1:
         Label(win,text="ERROR\nIt is required at least\n1 preprocessed data",justify=CENTER).grid(row=0,column=0,padx=10,pady=10)        
         Button(win,text="OK",command=win.destroy).grid(row=1,column=0,padx=10)
     else:
-        n_chans=len(eeg1.ch_names)
         Label(win,text="Calculate correlations").grid(row=0,column=0,columnspan=3,padx=10,pady=10)
         Label(win,text="Minimum frequency (Hz):").grid(row=1,column=0,padx=10,sticky=W)
         Entry(win,textvariable=fmin,width=4).grid(row=1,column=1,sticky=W)
         Label(win,text="Maximum frequency (Hz):").grid(row=2,column=0,padx=10,sticky=W)
         Entry(win,textvariable=fmax,width=4).grid(row=2,column=1,sticky=W)
+        Label(win,text="Number of processes:").grid(row=1,column=2,sticky=W)
+        Entry(win,textvariable=n_proc,width=3).grid(row=1,column=3,sticky=W)
         pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
         pbar['value']=0.0
         pbtxt=Label(win,text="--")
         def step():
             if (float(fmin.get())>0) and (float(fmax.get())>=float(fmin.get())):
-                n_cond=1
-                if x2 is not None:
-                    n_cond=2
-                pbar['value']=0.0
-                k=0
-                key_idx=0
-                coh1=[0 for i in event_dict.keys()]
-                imcoh1=[0 for i in event_dict.keys()]
+                event_names=list(event_dict.keys())
+                conditions=[x1] if x2 is None else [x1,x2]
+                results=run_task(win,pbar,pbtxt,[partial(parallel_spectral,conditions,event_names,float(fmin.get()),float(fmax.get()),('coh','imcoh'),n_jobs=int(n_proc.get()))])
+                if results is None:
+                    return
+                results=results[0]
+                coh1,imcoh1=results[0]['coh'],results[0]['imcoh']
                 if x2 is not None:
-                    coh2=[0 for i in event_dict.keys()]
-                    imcoh2=[0 for i in event_dict.keys()]
-                for key in event_dict.keys(): 
-                    win.update_idletasks()
-                    win.update()
-                    k+=1
-                    pbar['value'] += 100/(2*len(event_dict.keys())*n_cond)
-                    pbtxt['text']=f"{k:d}/{2*len(event_dict.keys())*n_cond:d}"
-                    a=mne_connectivity.spectral_connectivity_epochs(x1[key],indices=None,method='coh',mode='multitaper',sfreq=x1.info['sfreq'],
-                                                                     fmin=float(fmin.get()),fmax=float(fmax.get()),faverage=True,mt_adaptive=False,n_jobs=1,verbose='ERROR')
-                    coh1[key_idx]=np.reshape(a.get_data(),(n_chans,n_chans))
-                    coh1[key_idx][:,:]=coh1[key_idx][:,:]+coh1[key_idx][:,:].T
-                    win.update_idletasks()
-                    win.update()
-                    k+=1
-                    pbar['value'] += 100/(2*len(event_dict.keys())*n_cond)
-                    pbtxt['text']=f"{k:d}/{2*len(event_dict.keys())*n_cond:d}"
-                    b=mne_connectivity.spectral_connectivity_epochs(x1[key],indices=None,method='imcoh',mode='multitaper',sfreq=x1.info['sfreq'],
-                                                                     fmin=float(fmin.get()),fmax=float(fmax.get()),faverage=True,mt_adaptive=False,n_jobs=1,verbose='ERROR')
-                    imcoh1[key_idx]=np.reshape(b.get_data(),(n_chans,n_chans))
-                    imcoh1[key_idx][:,:]=imcoh1[key_idx][:,:]-imcoh1[key_idx][:,:].T
-                    if x2 is not None:
-                        win.update_idletasks()
-                        win.update()
-                        k+=1
-                        pbar['value'] += 100/(2*len(event_dict.keys())*n_cond)
-                        pbtxt['text']=f"{k:d}/{2*len(event_dict.keys())*n_cond:d}"
-                        c=mne_connectivity.spectral_connectivity_epochs(x2[key],indices=None,method='coh',mode='multitaper',sfreq=x2.info['sfreq'],
-                                                                     fmin=float(fmin.get()),fmax=float(fmax.get()),faverage=True,mt_adaptive=False,n_jobs=1,verbose='ERROR')
-                        coh2[key_idx]=np.reshape(c.get_data(),(n_chans,n_chans))
-                        coh2[key_idx][:,:]=coh2[key_idx][:,:]+coh2[key_idx][:,:].T
-                        win.update_idletasks()
-                        win.update()
-                        k+=1
-                        pbar['value'] += 100/(2*len(event_dict.keys())*n_cond)
-                        pbtxt['text']=f"{k:d}/{2*len(event_dict.keys())*n_cond:d}"
-                        d=mne_connectivity.spectral_connectivity_epochs(x2[key],indices=None,method='imcoh',mode='multitaper',sfreq=x2.info['sfreq'],
-                                                                     fmin=float(fmin.get()),fmax=float(fmax.get()),faverage=True,mt_adaptive=False,n_jobs=1,verbose='ERROR')
-                        imcoh2[key_idx]=np.reshape(d.get_data(),(n_chans,n_chans))
-                        imcoh2[key_idx][:,:]=imcoh2[key_idx][:,:]-imcoh2[key_idx][:,:].T
-                    key_idx+=1
+                    coh2,imcoh2=results[1]['coh'],results[1]['imcoh']
                 coh1=[pd.DataFrame(coh1[key_idx][:,:],columns=x1.ch_names,index=x1.ch_names) for key_idx in range(len(event_dict.keys()))]
                 imcoh1=[pd.DataFrame(imcoh1[key_idx][:,:],columns=x1.ch_names,index=x1.ch_names) for key_idx in range(len(event_dict.keys()))]
                 if x2 is not None:
@@ -2847,10 +4327,26 @@ def coherence():
                 Button(win,text="Close",command=win.destroy).grid(row=7,column=0,padx=10,pady=10,columnspan=3)
             else:
                 showinfo(title="Error",message="Frequency must be a positive number greater than zero\n and maximum frequency must be greater than minumum frequency")
+        def step_bands():
+            event_names=list(event_dict.keys())
+            conditions=[x1] if x2 is None else [x1,x2]
+            bands=tuple(b[0] for b in band_ranges),tuple(b[1] for b in band_ranges)
+            results=run_task(win,pbar,pbtxt,[partial(parallel_spectral,conditions,event_names,*bands,('coh','imcoh'),n_jobs=int(n_proc.get()))])
+            if results is None:
+                return
+            results=results[0]
+            showinfo(title="Info",message="The results will be saved as Numpy arrays\nof size (n_bands,n_events,n_chans,n_chans),\nwith the bands in the order:\n"+"\n".join(band_options))
+            for method,lbl in (('coh','Coherence'),('imcoh','Imaginary coherence')):
+                fname1 = fd.asksaveasfilename(title=lbl+" (all bands) condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                np.save(fname1,results[0][method])
+                if x2 is not None:
+                    fname2 = fd.asksaveasfilename(title=lbl+" (all bands) condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                    np.save(fname2,results[1][method])
         btn=Button(win, text='Start calculation', command=step)
         btn.grid(row=3,column=0,sticky=W,padx=10)
         pbar.grid(row=3,column=1,sticky=W)
         pbtxt.grid(row=3,column=2,sticky=W)
+        Button(win,text="Calculate all frequency bands",command=step_bands).grid(row=8,column=0,padx=10,pady=(10,0),sticky=W)
 
 #weighted phase lag index and comparison between conditions
 def wpli():
@@ -2861,52 +4357,34 @@ def wpli():
     fmax.set("12")
     fmin=StringVar()
     fmin.set("10")
+    n_proc=StringVar()
+    n_proc.set(str(os.cpu_count()))
     error=make_x()
     if error==1:
         Label(win,text="ERROR\nIt is required at least\n1 preprocessed data",justify=CENTER).grid(row=0,column=0,padx=10,pady=10)        
         Button(win,text="OK",command=win.destroy).grid(row=1,column=0,padx=10)
     else:
-        n_chans=len(eeg1.ch_names)
         Label(win,text="Calculate correlations").grid(row=0,column=0,columnspan=3,padx=10,pady=10)
         Label(win,text="Minimum frequency (Hz):").grid(row=1,column=0,padx=10,sticky=W)
         Entry(win,textvariable=fmin,width=4).grid(row=1,column=1,sticky=W)
         Label(win,text="Maximum frequency (Hz):").grid(row=2,column=0,padx=10,sticky=W)
         Entry(win,textvariable=fmax,width=4).grid(row=2,column=1,sticky=W)
+        Label(win,text="Number of processes:").grid(row=1,column=2,sticky=W)
+        Entry(win,textvariable=n_proc,width=3).grid(row=1,column=3,sticky=W)
         pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
         pbar['value']=0.0
         pbtxt=Label(win,text="--")
         def step():
             if (float(fmin.get())>0) and (float(fmax.get())>=float(fmin.get())):
-                n_cond=1
+                event_names=list(event_dict.keys())
+                conditions=[x1] if x2 is None else [x1,x2]
+                results=run_task(win,pbar,pbtxt,[partial(parallel_spectral,conditions,event_names,float(fmin.get()),float(fmax.get()),('wpli',),n_jobs=int(n_proc.get()))])
+                if results is None:
+                    return
+                results=results[0]
+                pli1=results[0]['wpli']
                 if x2 is not None:
-                    n_cond=2
-                pbar['value']=0.0
-                k=0
-                key_idx=0
-                pli1=[0 for i in event_dict.keys()]
-                if x2 is not None:
-                    pli2=[0 for i in event_dict.keys()]
-                for key in event_dict.keys(): 
-                    win.update_idletasks()
-                    win.update()
-                    k+=1
-                    pbar['value'] += 100/(len(event_dict.keys())*n_cond)
-                    pbtxt['text']=f"{k:d}/{len(event_dict.keys())*n_cond:d}"
-                    a=mne_connectivity.spectral_connectivity_epochs(x1[key],indices=None,method='wpli',mode='multitaper',sfreq=x1.info['sfreq'],
-                                                                     fmin=float(fmin.get()),fmax=float(fmax.get()),faverage=True,mt_adaptive=False,n_jobs=1,verbose='ERROR')
-                    pli1[key_idx]=np.reshape(a.get_data(),(n_chans,n_chans))
-                    pli1[key_idx][:,:]=pli1[key_idx][:,:]+pli1[key_idx][:,:].T
-                    if x2 is not None:
-                        win.update_idletasks()
-                        win.update()
-                        k+=1
-                        pbar['value'] += 100/(len(event_dict.keys())*n_cond)
-                        pbtxt['text']=f"{k:d}/{len(event_dict.keys())*n_cond:d}"
-                        b=mne_connectivity.spectral_connectivity_epochs(x2[key],indices=None,method='wpli',mode='multitaper',sfreq=x2.info['sfreq'],
-                                                                     fmin=float(fmin.get()),fmax=float(fmax.get()),faverage=True,mt_adaptive=False,n_jobs=1,verbose='ERROR')
-                        pli2[key_idx]=np.reshape(b.get_data(),(n_chans,n_chans))
-                        pli2[key_idx][:,:]=pli2[key_idx][:,:]+pli2[key_idx][:,:].T
-                    key_idx+=1
+                    pli2=results[1]['wpli']
                 pli1=[pd.DataFrame(pli1[key_idx][:,:],columns=x1.ch_names,index=x1.ch_names) for key_idx in range(len(event_dict.keys()))]
                 if x2 is not None:
                     pli2=[pd.DataFrame(pli2[key_idx][:,:],columns=x2.ch_names,index=x2.ch_names) for key_idx in range(len(event_dict.keys()))]                
@@ -3047,13 +4525,258 @@ def wpli():
                 Button(win,text="Close",command=win.destroy).grid(row=7,column=0,padx=10,pady=10,columnspan=3)
             else:
                 showinfo(title="Error",message="Frequency must be a positive number greater than zero\n and maximum frequency must be greater than minimum frequency")
+        def step_bands():
+            event_names=list(event_dict.keys())
+            conditions=[x1] if x2 is None else [x1,x2]
+            bands=tuple(b[0] for b in band_ranges),tuple(b[1] for b in band_ranges)
+            results=run_task(win,pbar,pbtxt,[partial(parallel_spectral,conditions,event_names,*bands,('wpli',),n_jobs=int(n_proc.get()))])
+            if results is None:
+                return
+            results=results[0]
+            showinfo(title="Info",message="The results will be saved as Numpy arrays\nof size (n_bands,n_events,n_chans,n_chans),\nwith the bands in the order:\n"+"\n".join(band_options))
+            fname1 = fd.asksaveasfilename(title="Weighted PLI (all bands) condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+            np.save(fname1,results[0]['wpli'])
+            if x2 is not None:
+                fname2 = fd.asksaveasfilename(title="Weighted PLI (all bands) condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                np.save(fname2,results[1]['wpli'])
         btn=Button(win, text='Start calculation', command=step)
         btn.grid(row=3,column=0,sticky=W,padx=10)
         pbar.grid(row=3,column=1,sticky=W)
         pbtxt.grid(row=3,column=2,sticky=W)
+        Button(win,text="Calculate all frequency bands",command=step_bands).grid(row=8,column=0,padx=10,pady=(10,0),sticky=W)
+
+#opens a video file that receives the frames through a pipe to ffmpeg
+def open_video(fname,fps=5,dpi=300,codec_args=('-pix_fmt','yuv420p')):
+    """Video written by streaming raw frames to an ffmpeg subprocess.
+    The frames are never written to disk: each figure is rendered in memory
+    and its RGBA buffer is piped to ffmpeg. The encoder is started with the
+    first frame, when the frame size is known.
+    Parameters
+    ----------
+    fname : str
+        Output video file (overwritten if it exists).
+    fps : int
+        Frame rate.
+    dpi : int
+        Resolution of the rendered figures.
+    codec_args : tuple
+        ffmpeg output options.
+    Returns
+    -------
+    video : dict
+        Writer state, used by write_video_frame and close_video.
+    """
+    return {'fname':fname,'fps':fps,'dpi':dpi,'codec_args':list(codec_args),'proc':None,'size':None,'log':None,'n_frames':0}
+
+#starts the ffmpeg subprocess of a video
+def start_video(video,width,height):
+    video['size']=(width,height)
+    video['log']=tempfile.TemporaryFile()
+    #the padding makes the frame size even, as required by yuv420p
+    command=['ffmpeg','-y','-loglevel','error','-f','rawvideo','-pix_fmt','rgba','-s',f'{width}x{height}',
+             '-framerate',str(video['fps']),'-i','-','-vf','pad=ceil(iw/2)*2:ceil(ih/2)*2']+video['codec_args']+[video['fname']]
+    try:
+        video['proc']=subprocess.Popen(command,stdin=subprocess.PIPE,stdout=subprocess.DEVNULL,stderr=video['log'])
+    except FileNotFoundError:
+        raise RuntimeError("ffmpeg was not found. Please install it (see https://www.ffmpeg.org/download.html)")
+
+#error message of a failed ffmpeg subprocess
+def video_error(video):
+    video['proc'].wait()
+    video['log'].seek(0)
+    return RuntimeError(f"ffmpeg failed writing {video['fname']}:\n"+video['log'].read().decode(errors='replace'))
+
+#renders a figure and sends it to the video
+def write_video_frame(video,fig):
+    """Renders fig with the Agg renderer and pipes its pixels to the video.
+    Parameters
+    ----------
+    video : dict
+        Video opened by open_video.
+    fig : matplotlib.figure.Figure
+        Frame. All the frames of a video must have the same size.
+    """
+    canvas=fig.canvas if type(fig.canvas) is FigureCanvasAgg else FigureCanvasAgg(fig)
+    if fig.dpi!=video['dpi']:
+        fig.set_dpi(video['dpi'])
+    canvas.draw()
+    write_video_buffer(video,canvas.buffer_rgba(),*canvas.get_width_height())
+
+#sends the pixels of a rendered frame to the video
+def write_video_buffer(video,buf,width,height):
+    if video['proc'] is None:
+        start_video(video,width,height)
+    elif video['size']!=(width,height):
+        raise ValueError(f"Frame size {width}x{height} differs from the video size {video['size'][0]}x{video['size'][1]}")
+    try:
+        video['proc'].stdin.write(buf)
+    except BrokenPipeError:
+        raise video_error(video)
+    video['n_frames']+=1
+
+#finishes the encoding of a video
+def close_video(video):
+    if video['proc'] is None:
+        return
+    try:
+        video['proc'].stdin.close()
+    except BrokenPipeError:
+        pass
+    if video['proc'].wait()!=0:
+        raise video_error(video)
+    video['log'].close()
+    video['proc']=None
+
+#stops the encoding of a video and removes the incomplete file
+def abort_video(video):
+    if video['proc'] is None:
+        return
+    video['proc'].kill()
+    video['proc'].wait()
+    video['log'].close()
+    video['proc']=None
+    if os.path.exists(video['fname']):
+        os.remove(video['fname'])
+
+#saves a DFC frame as an image, or streams it to a video
+def save_frame(fig,frttl,video=None):
+    if video is None:
+        fig.savefig(frttl,dpi=300)
+    else:
+        write_video_frame(video,fig)
+
+#figure of the DFC frames, laid out once and then updated frame by frame
+def frame_renderer(ch_names,event_names,cond_names=None,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',dpi=300):
+    """Builds the figure, heatmaps, colorbars and labels of the DFC frames.
+    The layouts are those of the plots of the connectivity windows: one
+    heatmap per event (plus the difference of the events when there are 2),
+    and, for two conditions, a column per condition and a column with the
+    difference of the conditions. Each frame only replaces the data of the
+    heatmaps (see render_frame), which avoids rebuilding the figure.
+    Parameters
+    ----------
+    ch_names : list
+        Channel names.
+    event_names : list
+        Event names, one heatmap row per event.
+    cond_names : list, None
+        Names of the two conditions, or None for a single condition.
+    vmin, vmax : float
+        Colorbar limits of the connectivity values. If vmax is None, it is
+        the maximum value of each frame. The differences use symmetric
+        limits, given by the largest absolute difference of each frame.
+    color : str
+        Colormap of the connectivity values.
+    lblttl : str
+        Colorbar label (the connectivity measure used).
+    dpi : int
+        Resolution of the figure.
+    Returns
+    -------
+    renderer : dict
+        Figure and heatmaps, used by render_frame.
+    """
+    n_events=len(event_names)
+    n_chans=len(ch_names)
+    #each panel is (kind,condition,event): a value, the difference of the 2 events, or the difference of the conditions
+    if cond_names is None:
+        grid=[[('value',0,ev)] for ev in range(n_events)]
+        if n_events==2:
+            grid.append([('events',0,None)])
+    else:
+        grid=[[('value',0,ev),('value',1,ev),('conditions',None,ev)] for ev in range(n_events)]
+        if n_events==2:
+            grid.append([('events',0,None),('events',1,None),None])
+    small=(cond_names is not None) and (n_events==2)
+    label_kw={'fontsize':4} if small else {}
+    fig=Figure(dpi=dpi)
+    FigureCanvasAgg(fig)
+    axes=fig.subplots(nrows=len(grid),ncols=len(grid[0]),squeeze=False)
+    if small:
+        fig.subplots_adjust(left=0.18,wspace=0.6,hspace=0.4)
+    meshes=[]
+    panels=[]
+    for i in range(len(grid)):
+        for j in range(len(grid[0])):
+            ax=axes[i,j]
+            panel=grid[i][j]
+            if panel is None:
+                fig.delaxes(ax)
+                continue
+            if panel[0]=='value':
+                sns.heatmap(np.zeros((n_chans,n_chans)),xticklabels=ch_names,yticklabels=ch_names,cmap=color,ax=ax,vmin=vmin,vmax=1 if vmax is None else vmax)
+                cbar_label=lblttl
+            else:
+                sns.heatmap(np.zeros((n_chans,n_chans)),xticklabels=ch_names,yticklabels=ch_names,cmap='bwr',ax=ax,vmin=-1,vmax=1)
+                cbar_label=f'Difference of\n{lblttl} values'
+            ax.set_ylabel('Electrodes',**label_kw)
+            ax.set_xlabel('Electrodes',**label_kw)
+            mesh=ax.collections[0]
+            mesh.colorbar.ax.set_ylabel(cbar_label,**label_kw)
+            if small:
+                ax.tick_params(axis='both', which='major', labelsize=4)
+                mesh.colorbar.ax.tick_params(labelsize=4)
+            meshes.append(mesh)
+            panels.append(panel)
+    pad=5
+    if n_events>1:
+        rows=list(event_names)
+        if n_events==2:
+            rows.append('Difference\n'+event_names[1]+'\n'+event_names[0])
+        row_kw={'fontsize':6} if small else ({'size':17} if cond_names is not None else {})
+        for ax, row in zip(axes[:,0], rows):
+            ax.annotate(row,xy=(0, 0.5),xytext=(-ax.yaxis.labelpad - pad, 0),xycoords=ax.yaxis.label,textcoords='offset points',ha='right',va='center',**row_kw)
+    if cond_names is not None:
+        cols=list(cond_names)+['Difference\n'+cond_names[1]+'\n'+cond_names[0]]
+        for ax, col in zip(axes[0,:], cols):
+            ax.annotate(col,xy=(0.5,1),xytext=(0,pad),xycoords='axes fraction',textcoords='offset points',ha='center',va='baseline',**({'fontsize':6} if small else {}))
+    return {'fig':fig,'meshes':meshes,'panels':panels,'vmin':vmin,'vmax':vmax}
+
+#updates the heatmaps of the DFC figure with the values of one frame
+def render_frame(renderer,y1,y2=None):
+    """Replaces the data of the heatmaps of a frame_renderer figure.
+    Parameters
+    ----------
+    renderer : dict
+        Figure built by frame_renderer.
+    y1 : np.array
+        Connectivity of condition 1 in the frame, of shape (n_events,n_chans,n_chans).
+    y2 : np.array, None
+        Idem, for condition 2.
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+        Updated figure, which can be saved or written to a video.
+    """
+    y=(y1,y2)
+    values=[]
+    diffs=[]
+    for mesh,(kind,cond,ev) in zip(renderer['meshes'],renderer['panels']):
+        if kind=='value':
+            d=y[cond][ev]
+        elif kind=='events':
+            d=y[cond][1]-y[cond][0]
+        else:
+            d=y2[ev]-y1[ev]
+        d=np.ma.masked_invalid(d)
+        mesh.set_array(d if mesh.get_array().ndim==2 else d.ravel())
+        if kind=='value':
+            values.append((mesh,d))
+        else:
+            diffs.append((mesh,d))
+    if renderer['vmax'] is None:
+        vmax=max((d.max() for mesh,d in values if d.count()>0),default=None)
+        if (vmax is not None) and (vmax>renderer['vmin']):
+            for mesh,d in values:
+                mesh.set_clim(renderer['vmin'],vmax)
+    lim=max((abs(d).max() for mesh,d in diffs if d.count()>0),default=None)
+    if (lim is not None) and (lim>0):
+        for mesh,d in diffs:
+            mesh.set_clim(-lim,lim)
+    return renderer['fig']
 
 #makes the frames for the videos of dynamic functional connectivity (comparative case when calculation based on average of epochs)
-def make_frame(y1,y2=None,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',frttl='my_frame.png'):
+def make_frame(y1,y2=None,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',frttl='my_frame.png',video=None):
     ''' y1    = list of dataframes for condition 1.
                 Each list index correponds to an event.
                 Each dataframe has dimensions of (n_chans,n_chans),
@@ -3065,178 +4788,16 @@ def make_frame(y1,y2=None,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation
         vmax  = maximum value for colorbar
         color = color scheme for colorbar
         lblttl= colorbar label title (the connectivity measure used)
-        frttl = frame title'''
-    if y2 is None:
-        if len(event_dict.keys())==1:
-            fig, axes = plt.subplots(nrows=1, ncols=1)
-            sns.heatmap(y1[0],xticklabels=y1[0].index,yticklabels=y1[0].columns,mask=y1[0].isnull(),cmap=color,ax=axes,vmin=vmin,vmax=vmax)
-            plt.xlabel("Electrodes")
-            plt.ylabel("Electrodes")
-            axes.figure.axes[-1].set_ylabel(lblttl)
-            fig.savefig(frttl,dpi=300)
-            fig.clf()
-            plt.close()
-        elif len(event_dict.keys())>2:
-            fig,axes = plt.subplots(nrows=len(event_dict.keys()))
-            rows=list(event_dict.keys())
-            pad=5
-            for ax, row in zip(axes[:], rows):
-                ax.annotate(row,xy=(0, 0.5),xytext=(-ax.yaxis.labelpad - pad, 0),xycoords=ax.yaxis.label,textcoords='offset points',ha='right',va='center')
-            for i in range(len(event_dict.keys())):
-                sns.heatmap(y1[i],xticklabels=y1[i].index,yticklabels=y1[i].columns,mask=y1[i].isnull(),cmap=color,ax=axes[i],vmin=vmin,vmax=vmax)
-                axes[i].set_ylabel('Electrodes')
-                axes[i].set_xlabel('Electrodes')
-                axes[i].figure.axes[-1].set_ylabel(lblttl)
-            fig.savefig(frttl,dpi=300)
-            fig.clf()
-            plt.close()
-        elif len(event_dict.keys())==2:
-            fig,axes = plt.subplots(nrows=3)
-            rows=list(event_dict.keys())+['Difference\n'+list(event_dict.keys())[1]+'\n'+list(event_dict.keys())[0]]
-            pad=5
-            for ax, row in zip(axes[:], rows):
-                ax.annotate(row,xy=(0, 0.5),xytext=(-ax.yaxis.labelpad - pad, 0),xycoords=ax.yaxis.label,textcoords='offset points',ha='right',va='center')
-            for i in range(len(rows)):
-                if i==len(rows)-1:
-                    diff=y1[1]-y1[0]
-                    minbar=min[diff.min().min(),-diff.max().max()]
-                    maxbar=max[diff.max().max(),-diff.min().min()]
-                    sns.heatmap(diff,xticklabels=diff.index,yticklabels=diff.columns,mask=diff.isnull(),cmap='bwr',ax=axes[i],vmin=minbar,vmax=maxbar)
-                else:
-                    sns.heatmap(y1[i],xticklabels=y1[i].index,yticklabels=y1[i].columns,mask=y1[i].isnull(),cmap=color,ax=axes[i],vmin=vmin,vmax=vmax)
-                axes[i].set_ylabel('Electrodes')
-                axes[i].set_xlabel('Electrodes')
-                if i==len(rows)-1:
-                    axes[i].figure.axes[-1].set_ylabel(f'Difference of\n{lblttl} values')
-                else:
-                    axes[i].figure.axes[-1].set_ylabel(lblttl)
-            fig.savefig(frttl,dpi=300)
-            fig.clf()
-            plt.close()
-    else:
-        if len(event_dict.keys())==1:
-            fig, axes = plt.subplots(nrows=1, ncols=3)
-            cols=[cond1_name.get(),cond2_name.get()]+['Difference\n'+cond2_name.get()+'\n'+cond1_name.get()]
-            pad=5
-            for ax, col in zip(axes[:], cols):
-                ax.annotate(col,xy=(0.5,1),xytext=(0,pad),xycoords='axes fraction',textcoords='offset points',ha='center',va='baseline')
-            sns.heatmap(y1[0],xticklabels=y1[0].index,yticklabels=y1[0].columns,mask=y1[0].isnull(),cmap=color,ax=axes[0],vmin=vmin,vmax=vmax)
-            axes[0].set_ylabel('Electrodes')
-            axes[0].set_xlabel('Electrodes')
-            axes[0].figure.axes[-1].set_ylabel(lblttl)
-            sns.heatmap(y2[0],xticklabels=y2[0].index,yticklabels=y2[0].columns,mask=y2[0].isnull(),cmap=color,ax=axes[1],vmin=vmin,vmax=vmax)
-            axes[1].set_ylabel('Electrodes')
-            axes[1].set_xlabel('Electrodes')
-            axes[1].figure.axes[-1].set_ylabel(lblttl)
-            diff=y2[0]-y1[0]
-            minbar=min[diff.min().min(),-diff.max().max()]
-            maxbar=max[diff.max().max(),-diff.min().min()]
-            sns.heatmap(diff,xticklabels=diff.index,yticklabels=diff.columns,mask=diff.isnull(),cmap='bwr',ax=axes[2],vmin=minbar,vmax=maxbar)
-            axes[2].set_ylabel('Electrodes')
-            axes[2].set_xlabel('Electrodes')
-            axes[2].figure.axes[-1].set_ylabel(f'Difference of\n{lblttl} values')
-            fig.savefig(frttl,dpi=300)
-            fig.clf()
-            plt.close()
-        elif len(event_dict.keys())>2:
-            fig,axes = plt.subplots(nrows=len(event_dict.keys()),ncols=3)
-            rows=list(event_dict.keys())
-            cols=[cond1_name.get(),cond2_name.get()]+['Difference\n'+cond2_name.get()+'\n'+cond1_name.get()]
-            pad=5
-            for ax, row in zip(axes[:,0], rows):
-                ax.annotate(row,xy=(0, 0.5),xytext=(-ax.yaxis.labelpad - pad, 0),xycoords=ax.yaxis.label,textcoords='offset points',size=17,ha='right',va='center')
-            for ax, col in zip(axes[0,:], cols):
-                ax.annotate(col,xy=(0.5,1),xytext=(0,pad),xycoords='axes fraction',textcoords='offset points',ha='center',va='baseline')
-            tempmin=[]
-            tempmax=[]
-            for i in range(len(event_dict.keys())):
-                tempdiff=y2[i]-y1[i]
-                tempmin.append(tempdiff.min().min())
-                tempmax.append(tempmax.max().max())
-            minbar=min(min(tempmin),-max(tempmax))
-            maxbar=max(max(tempmax),-min(tempmin))
-            for i in range(len(event_dict.keys())):
-                sns.heatmap(y1[i],xticklabels=y1[i].index,yticklabels=y1[i].columns,mask=y1[i].isnull(),cmap=color,ax=axes[i,0],vmin=vmin,vmax=vmax)
-                axes[i,0].set_ylabel('Electrodes')
-                axes[i,0].set_xlabel('Electrodes')
-                axes[i,0].figure.axes[-1].set_ylabel(lblttl)
-                sns.heatmap(y2[i],xticklabels=y2[i].index,yticklabels=y2[i].columns,mask=y2[i].isnull(),cmap=color,ax=axes[i,1],vmin=vmin,vmax=vmax)
-                axes[i,1].set_ylabel('Electrodes')
-                axes[i,1].set_xlabel('Electrodes')
-                axes[i,1].figure.axes[-1].set_ylabel(lblttl)
-                sns.heatmap(y2[i]-y1[i],xticklabels=y1[i].index,yticklabels=y1[i].columns,mask=y1[i].isnull(),cmap='bwr',ax=axes[i,2],vmin=minbar,vmax=maxbar)
-                axes[i,2].set_ylabel('Electrodes')
-                axes[i,2].set_xlabel('Electrodes')
-                axes[i,2].figure.axes[-1].set_ylabel(f'Difference of\n{lblttl} values')
-            fig.savefig(frttl,dpi=300)
-            fig.clf()
-            plt.close()
-        elif len(event_dict.keys())==2:
-            fig,axes = plt.subplots(nrows=3,ncols=3)
-            plt.subplots_adjust(left=0.18,wspace=0.6,hspace=0.4)
-            rows=list(event_dict.keys())+['Difference\n'+list(event_dict.keys())[1]+'\n'+list(event_dict.keys())[0]]
-            cols=[cond1_name.get(),cond2_name.get()]+['Difference\n'+cond2_name.get()+'\n'+cond1_name.get()]
-            pad=5
-            for ax, row in zip(axes[:,0], rows):
-                ax.annotate(row,xy=(0, 0.5),xytext=(-ax.yaxis.labelpad - pad, 0),xycoords=ax.yaxis.label,textcoords='offset points',ha='right',va='center',fontsize=6)
-            for ax, col in zip(axes[0,:], cols):
-                ax.annotate(col,xy=(0.5,1),xytext=(0,pad),xycoords='axes fraction',textcoords='offset points',ha='center',va='baseline',fontsize=6)
-            tempmax=[]
-            tempmin=[]
-            tempdiff1=y1[1]-y1[0]
-            tempdiff2=y2[1]-y2[0]
-            tempmax.append(tempdiff1.max().max())
-            tempmin.append(tempdiff1.min().min())
-            tempmax.append(tempdiff2.max().max())
-            tempmin.append(tempdiff2.min().min())
-            for i in range(2):
-                tempdiff3=y2[i]-y1[i]
-                tempmax.append(tempdiff3.max().max())
-                tempmin.append(tempdiff3.min().min())
-            minbar=min(min(tempmin),-max(tempmax))
-            maxbar=max(max(tempmax),-min(tempmin))                
-            for i in range(3):
-                if i<2:
-                    sns.heatmap(y1[i],xticklabels=y1[i].index,yticklabels=y1[i].columns,mask=y1[i].isnull(),cmap=color,ax=axes[i,0],vmin=vmin,vmax=vmax)
-                else:
-                    sns.heatmap(y1[1]-y1[0],xticklabels=y1[0].index,yticklabels=y1[0].columns,mask=y1[0].isnull(),cmap='bwr',ax=axes[i,0],vmin=minbar,vmax=maxbar)
-                axes[i,0].set_ylabel('Electrodes',fontsize=4)
-                axes[i,0].set_xlabel('Electrodes',fontsize=4)
-                axes[i,0].tick_params(axis='both', which='major', labelsize=4)
-                cbar = axes[i,0].collections[0].colorbar
-                cbar.ax.tick_params(labelsize=4)
-                if i<2:
-                    axes[i,0].figure.axes[-1].set_ylabel(lblttl,fontsize=4)
-                else:
-                    axes[i,0].figure.axes[-1].set_ylabel(f'Difference of\n{lblttl} values',fontsize=4)
-                if i<2:
-                    sns.heatmap(y2[i],xticklabels=y2[i].index,yticklabels=y2[i].columns,mask=y2[i].isnull(),cmap=color,ax=axes[i,1],vmin=vmin,vmax=vmax)
-                else:
-                    sns.heatmap(y2[1]-y2[0],xticklabels=y2[0].index,yticklabels=y2[0].columns,mask=y2[0].isnull(),cmap='bwr',ax=axes[i,1],vmin=minbar,vmax=maxbar)
-                axes[i,1].set_ylabel('Electrodes',fontsize=4)
-                axes[i,1].set_xlabel('Electrodes',fontsize=4)
-                axes[i,1].tick_params(axis='both', which='major', labelsize=4)
-                cbar = axes[i,1].collections[0].colorbar
-                cbar.ax.tick_params(labelsize=4)
-                if i<2:
-                    axes[i,1].figure.axes[-1].set_ylabel(lblttl,fontsize=4)
-                else:
-                    axes[i,1].figure.axes[-1].set_ylabel(f'Difference of\n{lblttl} values',fontsize=4)
-                if i<2:
-                    sns.heatmap(y2[i]-y1[i],xticklabels=y1[i].index,yticklabels=y1[i].columns,mask=y1[i].isnull(),cmap='bwr',ax=axes[i,2],vmin=minbar,vmax=maxbar)
-                    axes[i,2].set_ylabel('Electrodes',fontsize=4)
-                    axes[i,2].set_xlabel('Electrodes',fontsize=4)
-                    axes[i,2].tick_params(axis='both', which='major', labelsize=4)
-                    axes[i,2].figure.axes[-1].set_ylabel(f'Difference of\n{lblttl} values',fontsize=4)
-                    cbar = axes[i,2].collections[0].colorbar
-                    cbar.ax.tick_params(labelsize=4)
-            fig.delaxes(axes[2,2])
-            fig.savefig(frttl,dpi=300)
-            fig.clf()
-            plt.close()
+        frttl = frame title
+        video = video opened by open_video; when given, the frame
+                is streamed to it instead of saved as frttl'''
+    cond_names=None if y2 is None else [cond1_name.get(),cond2_name.get()]
+    renderer=frame_renderer(list(y1[0].index),list(event_dict.keys()),cond_names,vmin,vmax,color,lblttl)
+    fig=render_frame(renderer,np.stack([y.values for y in y1]),None if y2 is None else np.stack([y.values for y in y2]))
+    save_frame(fig,frttl,video)
 
 #makes the frames for the videos of dynamic functional connectivity (simpler case when calculation based on raw or just 1 epoch)
-def make_frame2(y,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',frttl='my_frame.png'):
+def make_frame2(y,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',frttl='my_frame.png',video=None):
     ''' y     = dataframe for eeg data
                 dimensions of (n_chans,n_chans),
                 with cell values corresponding to instant
@@ -3246,16 +4807,1103 @@ def make_frame2(y,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',frttl=
         vmax  = maximum value for colorbar
         color = color scheme for colorbar
         lblttl= colorbar label title (the connectivity measure used)
-        frttl = frame title'''
-    fig, axes = plt.subplots(nrows=1, ncols=1)
-    sns.heatmap(y,xticklabels=y.index,yticklabels=y.columns,mask=y.isnull(),cmap=color,ax=axes,vmin=vmin,vmax=vmax)
-    plt.xlabel("Electrodes")
-    plt.ylabel("Electrodes")
-    axes.figure.axes[-1].set_ylabel(lblttl)
-    fig.savefig(frttl,dpi=300)
-    fig.clf()
-    plt.close()
+        frttl = frame title
+        video = video opened by open_video; when given, the frame
+                is streamed to it instead of saved as frttl'''
+    renderer=frame_renderer(list(y.index),[''],None,vmin,vmax,color,lblttl)
+    save_frame(render_frame(renderer,y.values[None]),frttl,video)
     
+#renderers of the frame_worker processes, by renderer arguments
+renderer_cache={}
+
+#frames start to stop-1 of a DFC array or store, as (n_events,n_frames,n_chans,n_chans)
+def dfc_frames(dfc,start,stop):
+    if isinstance(dfc,dict):
+        y=dfc_store_windows(dfc,start,stop)
+    else:
+        y=dfc[...,start:stop,:,:]
+    return y if y.ndim==4 else y[None]
+
+#process pool worker: renders a block of consecutive DFC frames
+def frame_worker(src1,src2,renderer_args,frames):
+    #the sources are DFC stores (read here, frames start to stop-1), the frames
+    #of the block already read by the caller (n_events,n_block,n_chans,n_chans), or None
+    y1,y2=[src if not isinstance(src,dict) else dfc_frames(src,*frames) for src in (src1,src2)]
+    if renderer_args not in renderer_cache:
+        renderer_cache.clear()
+        renderer_cache[renderer_args]=frame_renderer(*renderer_args)
+    renderer=renderer_cache[renderer_args]
+    out=[]
+    for frame in range(y1.shape[1]):
+        fig=render_frame(renderer,y1[:,frame],None if y2 is None else y2[:,frame])
+        fig.canvas.draw()
+        out.append(bytes(fig.canvas.buffer_rgba()))
+    width,height=renderer['fig'].canvas.get_width_height()
+    return width,height,out
+
+#renders the DFC frames in a process pool and streams them in order to a video
+def render_dfc_video(fname,dfc1,dfc2=None,ch_names=None,event_names=('',),cond_names=None,fps=5,vmin=-1,vmax=1,color='bwr',
+                     lblttl='Pearson correlation',dpi=300,n_jobs=None,block=4,max_in_flight=None,progress=None):
+    """Video of the dynamic functional connectivity.
+    The frames are rendered in blocks of consecutive frames by a process
+    pool, each process with its own frame_renderer figure. The blocks are
+    written to the video in order as they arrive, and new blocks are only
+    submitted while at most max_in_flight blocks are rendering or waiting to
+    be written, which bounds the memory held by the frames (about 11 MB per
+    frame at 300 dpi). If the rendering fails or is cancelled, the
+    incomplete video is removed.
+    Parameters
+    ----------
+    fname : str
+        Output video file.
+    dfc1 : np.array, dict
+        DFC of condition 1, of shape (n_events,n_frames,n_chans,n_chans) or
+        (n_frames,n_chans,n_chans), or a DFC store (read block by block).
+    dfc2 : np.array, dict, None
+        Idem, for condition 2 (only the common frames are rendered).
+    ch_names, event_names, cond_names, vmin, vmax, color, lblttl, dpi :
+        Layout of the frames (see frame_renderer).
+    fps : int
+        Frame rate.
+    n_jobs : int, None
+        Number of rendering processes (None for one per CPU; 1 renders in
+        the calling thread).
+    block : int
+        Number of frames rendered per task.
+    max_in_flight : int, None
+        Maximum number of blocks not yet written (default 2*n_jobs).
+    progress : function, None
+        Called as progress(done,total) with the number of frames written.
+    Returns
+    -------
+    n_frames : int
+        Number of frames of the video.
+    """
+    if n_jobs is None:
+        n_jobs=os.cpu_count()
+    if max_in_flight is None:
+        max_in_flight=2*n_jobs
+    if ch_names is None:
+        ch_names=[str(i) for i in range((dfc1['shape'] if isinstance(dfc1,dict) else dfc1.shape)[-1])]
+    n_frames=min([(dfc['shape'] if isinstance(dfc,dict) else dfc.shape)[-3] for dfc in (dfc1,dfc2) if dfc is not None])
+    args=(tuple(ch_names),tuple(event_names),None if cond_names is None else tuple(cond_names),vmin,vmax,color,lblttl,dpi)
+    video=open_video(fname,fps,dpi)
+    try:
+        blocks=[(b,min(b+block,n_frames)) for b in range(0,n_frames,block)]
+        if n_jobs==1:
+            renderer=frame_renderer(*args)
+            for a,z in blocks:
+                y1=dfc_frames(dfc1,a,z)
+                y2=None if dfc2 is None else dfc_frames(dfc2,a,z)
+                for frame in range(z-a):
+                    write_video_frame(video,render_frame(renderer,y1[:,frame],None if y2 is None else y2[:,frame]))
+                if progress is not None:
+                    progress(z,n_frames)
+        else:
+            #stores are read by the workers; in-memory results are sent one
+            #block of frames at a time, so they are never copied as a whole
+            def block_source(dfc,a,z):
+                if (dfc is None) or isinstance(dfc,dict):
+                    return dfc
+                return dfc_frames(dfc,a,z)
+            executor=process_pool(n_jobs)
+            try:
+                futures={}
+                submitted=0
+                for b in range(len(blocks)):
+                    while (submitted<len(blocks)) and (submitted<b+max_in_flight):
+                        a,z=blocks[submitted]
+                        futures[submitted]=executor.submit(frame_worker,block_source(dfc1,a,z),block_source(dfc2,a,z),args,(a,z))
+                        submitted+=1
+                    width,height,frames=futures.pop(b).result()
+                    for buf in frames:
+                        write_video_buffer(video,buf,width,height)
+                    del frames
+                    if progress is not None:
+                        progress(blocks[b][1],n_frames)
+            finally:
+                executor.shutdown(wait=True,cancel_futures=True)
+        close_video(video)
+    except BaseException:
+        abort_video(video)
+        raise
+    return n_frames
+
+#animated topoplot of one item (epoch or average) of a shared array
+def topomap_worker(spec,item,info,times,frame_rate,fname):
+    #the workers never show figures, and must not use the GUI backend
+    plt.switch_backend('Agg')
+    shm,data=attach_array(spec)
+    try:
+        evoked=mne.EvokedArray(np.array(data[item]),info)
+        fig,anim=evoked.animate_topomap(blit=False,show=False,frame_rate=frame_rate,times=times)
+        anim.save(fname)
+        plt.close(fig)
+    finally:
+        del data
+        shm.close()
+    return fname
+
+#animated topoplots of many epochs, using a process pool
+def parallel_topomaps(items,info,times,frame_rate,fnames,n_jobs=None,progress=None):
+    """Saves one animated topoplot video per item, each made by a process
+    of the pool (the figures are never created in the calling process).
+    Parameters
+    ----------
+    items : np.array
+        Array of shape (n_items,n_chans,n_times), e.g. the epochs of an event
+        or their average (with n_items=1).
+    info : mne.Info
+        Measurement info of the channels.
+    times : np.array
+        Times of the frames, in s.
+    frame_rate : int
+        Frame rate.
+    fnames : list
+        Output video file of each item.
+    n_jobs : int, None
+        Number of processes (None for one per CPU).
+    progress : function, None
+        Called as progress(done,total) with the number of videos saved.
+    Returns
+    -------
+    fnames : list
+        The saved video files.
+    """
+    if n_jobs is None:
+        n_jobs=os.cpu_count()
+    shm,spec=share_array(items)
+    try:
+        tasks=[(item,(spec,item,info,times,frame_rate,fnames[item])) for item in range(len(fnames))]
+        run_pool(topomap_worker,tasks,min(n_jobs,max(len(tasks),1)),lambda key,out:None,progress)
+    finally:
+        shm.close()
+        shm.unlink()
+    return fnames
+
+#pearson correlation of every moving window, from cumulative sums
+def windowed_pearson(vals,starttimes,wlenval,delayval,max_block_bytes=2**28):
+    """Pearson-based dynamic functional connectivity of one recording.
+    Uses cumulative sums of x, y, x^2 and y^2, and of the lagged cross-product
+    x*y, so that each window costs O(1) per channel pair regardless of the
+    window length and overlap. The cross-product sums are accumulated over
+    segments of gcd(window length, hop) samples, which keeps the cumulative
+    array small; windows are processed in blocks of at most max_block_bytes.
+    Parameters
+    ----------
+    vals : np.array
+        Array of shape (n_chans,n_times).
+    starttimes : np.array
+        First sample of each moving window.
+    wlenval : int
+        Window length, in samples.
+    delayval : int
+        Transmission delay, in samples.
+    max_block_bytes : int
+        Memory budget for the cumulative cross-product array of a block.
+    Returns
+    -------
+    dfc : np.array
+        Array of shape (len(starttimes),n_chans,n_chans), where dfc[m,i,j] is
+        the correlation between vals[i,s:s+wlenval] and
+        vals[j,s+delayval:s+delayval+wlenval], with s=starttimes[m].
+    """
+    starttimes=np.asarray(starttimes,dtype=int)
+    n_chans=vals.shape[0]
+    dfc=np.empty((len(starttimes),n_chans,n_chans),dtype=np.result_type(vals.dtype,np.float32))
+    if len(starttimes)==0:
+        return dfc
+    #centering does not change the correlation, but avoids loss of precision
+    vals=vals-vals.mean(axis=1,keepdims=True)
+    x,y=lagged_slices(vals,delayval)
+    #the cumulative sums stay in double precision (differences of large sums)
+    cx=np.zeros((n_chans,x.shape[1]+1))
+    cy=np.zeros((n_chans,x.shape[1]+1))
+    cxx=np.zeros((n_chans,x.shape[1]+1))
+    cyy=np.zeros((n_chans,x.shape[1]+1))
+    np.cumsum(x,axis=1,dtype=np.float64,out=cx[:,1:])
+    np.cumsum(y,axis=1,dtype=np.float64,out=cy[:,1:])
+    np.cumsum(np.square(x,dtype=np.float64),axis=1,out=cxx[:,1:])
+    np.cumsum(np.square(y,dtype=np.float64),axis=1,out=cyy[:,1:])
+    #cross-products are accumulated per segment of seglen samples
+    seglen=int(np.gcd.reduce(np.append(starttimes,wlenval)))
+    hop=max(int(starttimes[1]-starttimes[0]),1) if len(starttimes)>1 else wlenval
+    segs_per_window=max(int(max_block_bytes//(8*n_chans*n_chans)),wlenval//seglen+1)
+    block=max(int((segs_per_window*seglen-wlenval)//hop),1)
+    for b in range(0,len(starttimes),block):
+        st=starttimes[b:b+block]
+        en=st+wlenval
+        a=st[0]//seglen
+        z=en[-1]//seglen
+        xs=x[:,a*seglen:z*seglen].reshape(n_chans,z-a,seglen).transpose(1,0,2)
+        ys=y[:,a*seglen:z*seglen].reshape(n_chans,z-a,seglen).transpose(1,2,0)
+        cxy=np.zeros((z-a+1,n_chans,n_chans))
+        np.cumsum(np.matmul(xs,ys),axis=0,dtype=np.float64,out=cxy[1:])
+        sxy=cxy[en//seglen-a]-cxy[st//seglen-a]
+        sx=(cx[:,en]-cx[:,st]).T
+        sy=(cy[:,en]-cy[:,st]).T
+        sxx=(cxx[:,en]-cxx[:,st]).T
+        syy=(cyy[:,en]-cyy[:,st]).T
+        with np.errstate(divide='ignore',invalid='ignore'):
+            num=wlenval*sxy-sx[:,:,None]*sy[:,None,:]
+            den=np.sqrt((wlenval*sxx-sx*sx)[:,:,None]*(wlenval*syy-sy*sy)[:,None,:])
+            dfc[b:b+block]=np.clip(num/den,-1,1)
+    return dfc
+
+#moving windows of the dynamic functional connectivity
+def dfc_windows(n_times,sfreq,delay=10,wlen=500,woverlap=250):
+    """Converts the DFC parameters from ms to samples.
+    Parameters
+    ----------
+    n_times : int
+        Number of samples of the series.
+    sfreq : float
+        Sampling frequency, in Hz.
+    delay, wlen, woverlap : float
+        Transmission delay, window length and window overlap, in ms.
+    Returns
+    -------
+    starttimes : np.array
+        First sample of each moving window.
+    wlenval, delayval : int
+        Window length and delay, in samples.
+    """
+    delayval=int(float(delay)*sfreq/1000)
+    wlenval=int(float(wlen)*sfreq/1000)
+    woverlapval=int(float(woverlap)*sfreq/1000)
+    if delayval<0:
+        raise ValueError("Delay must be a non-negative number")
+    if (wlenval<=0) or (woverlapval>=wlenval):
+        raise ValueError("The window length must be positive and longer than the overlap")
+    starttimes=np.arange(0,n_times-wlenval-delayval,wlenval-woverlapval)
+    return starttimes,wlenval,delayval
+
+#chunked on-disk store of a DFC result
+def create_dfc_store(path,shape,starttimes,sfreq,wlenval,delayval,dtype=None,chunk_bytes=None,**meta):
+    """Creates a chunked, memory-mapped store for a DFC result, so that the
+    windows can be written block by block and read back by time range
+    without holding the whole result in memory.
+    The windows axis (third from last) is split into chunks of consecutive
+    windows, each one a .npy file that is memory-mapped only while it is
+    written or read.
+    Parameters
+    ----------
+    path : str
+        Directory of the store (created if needed).
+    shape : tuple
+        Shape of the result, e.g. (n_windows,n_chans,n_chans) or
+        (n_events,n_windows,n_chans,n_chans).
+    starttimes : np.array
+        First sample of each window.
+    sfreq : float
+        Sampling frequency, in Hz.
+    wlenval, delayval : int
+        Window length and delay, in samples.
+    dtype : type, None
+        Type of the values (float_dtype by default).
+    chunk_bytes : int, None
+        Approximate size of each chunk file (dfc_storage['chunk_bytes'] by default).
+    **meta :
+        Other JSON-serializable information kept with the store (e.g. measure).
+    Returns
+    -------
+    store : dict
+        Description of the store, used by write_dfc_store, dfc_store_windows,
+        read_dfc_store and export_dfc_store (see also open_dfc_store).
+    """
+    if dtype is None:
+        dtype=float_dtype
+    if chunk_bytes is None:
+        chunk_bytes=dfc_storage['chunk_bytes']
+    shape=tuple(int(i) for i in shape)
+    window_bytes=np.dtype(dtype).itemsize*int(np.prod(shape[:-3]+shape[-2:]))
+    store={'path':path,'shape':shape,'dtype':np.dtype(dtype).str,'chunk':max(1,int(chunk_bytes//window_bytes)),
+           'sfreq':float(sfreq),'wlenval':int(wlenval),'delayval':int(delayval),'meta':meta}
+    os.makedirs(path,exist_ok=True)
+    np.save(os.path.join(path,'starttimes.npy'),np.asarray(starttimes,dtype=np.int64))
+    n_windows=shape[-3]
+    for c in range(int(np.ceil(n_windows/store['chunk']))):
+        m=min(store['chunk'],n_windows-c*store['chunk'])
+        mm=np.lib.format.open_memmap(dfc_chunk_file(store,c),mode='w+',dtype=np.dtype(dtype),shape=shape[:-3]+(m,)+shape[-2:])
+        del mm
+    with open(os.path.join(path,'dfc_store.json'),'w') as f:
+        json.dump(store,f,indent=2)
+    return store
+
+#opens a store made by create_dfc_store
+def open_dfc_store(path):
+    with open(os.path.join(path,'dfc_store.json')) as f:
+        store=json.load(f)
+    store['path']=path
+    store['shape']=tuple(store['shape'])
+    return store
+
+#file of one chunk of a DFC store
+def dfc_chunk_file(store,c):
+    return os.path.join(store['path'],f'chunk{c:05d}.npy')
+
+#temporary DFC store of the GUI, or None if the results are kept in memory
+def temp_dfc_store(force=False):
+    """Returns a new directory for a DFC store when dfc_storage['on_disk']
+    is set or force is True (removed when the program exits), otherwise None."""
+    if not (dfc_storage['on_disk'] or force):
+        return None
+    os.makedirs(dfc_storage['dir'],exist_ok=True)
+    path=tempfile.mkdtemp(dir=dfc_storage['dir'])
+    atexit.register(shutil.rmtree,path,True)
+    return path
+
+#writes a block of windows to a DFC store
+def write_dfc_store(store,index,start,values):
+    """Writes values to the windows start, start+1, ... of the store.
+    Parameters
+    ----------
+    store : dict
+        Store made by create_dfc_store.
+    index : tuple
+        Leading indices (e.g. (event,)), () to write all of them.
+    start : int
+        First window.
+    values : np.array
+        Values of shape shape[len(index):-3]+(n,n_chans,n_chans).
+    """
+    chunk=store['chunk']
+    m=values.shape[-3]
+    for c in range(start//chunk,(start+m-1)//chunk+1):
+        a=max(start,c*chunk)
+        z=min(start+m,(c+1)*chunk)
+        mm=np.load(dfc_chunk_file(store,c),mmap_mode='r+')
+        mm[index][...,a-c*chunk:z-c*chunk,:,:]=values[...,a-start:z-start,:,:]
+        mm.flush()
+        del mm
+
+#writes a block of windows to a DFC array or store
+def write_dfc(target,index,start,values):
+    if isinstance(target,dict):
+        write_dfc_store(target,index,start,values)
+    else:
+        target[index][...,start:start+values.shape[-3],:,:]=values
+
+#reads a range of windows of a DFC store
+def dfc_store_windows(store,start,stop,index=()):
+    """Returns the windows start to stop-1 of the store (of shape
+    shape[len(index):-3]+(stop-start,n_chans,n_chans)), reading only the
+    chunks that contain them."""
+    chunk=store['chunk']
+    stop=min(stop,store['shape'][-3])
+    parts=[]
+    for c in range(start//chunk,(stop-1)//chunk+1):
+        a=max(start,c*chunk)
+        z=min(stop,(c+1)*chunk)
+        mm=np.load(dfc_chunk_file(store,c),mmap_mode='r')
+        parts.append(np.array(mm[index][...,a-c*chunk:z-c*chunk,:,:]))
+        del mm
+    if len(parts)==0:
+        shape=store['shape'][len(index):]
+        return np.empty(shape[:-3]+(0,)+shape[-2:],dtype=np.dtype(store['dtype']))
+    return np.concatenate(parts,axis=-3)
+
+#reads the windows of a DFC store that start within a time range
+def read_dfc_store(store,tmin=None,tmax=None,index=()):
+    """Partial read of a DFC store by time range.
+    Parameters
+    ----------
+    store : dict
+        Store made by create_dfc_store or open_dfc_store.
+    tmin, tmax : float, None
+        Time range, in s from the beginning of the series; a window belongs to
+        it if its first sample does. None for no limit.
+    index : tuple
+        Leading indices to read (e.g. (event,)).
+    Returns
+    -------
+    dfc : np.array
+        Values of the windows, of shape shape[len(index):-3]+(n,n_chans,n_chans).
+    times : np.array
+        Start time of each window, in s.
+    """
+    times=np.load(os.path.join(store['path'],'starttimes.npy'))/store['sfreq']
+    start=0 if tmin is None else int(np.searchsorted(times,tmin,'left'))
+    stop=len(times) if tmax is None else int(np.searchsorted(times,tmax,'right'))
+    return dfc_store_windows(store,start,stop,index),times[start:stop]
+
+#exports a DFC store (or a time range of it) to a Numpy file
+def export_dfc_store(store,fname,tmin=None,tmax=None):
+    """Writes the windows of the time range (see read_dfc_store) to a single
+    .npy file, copying one chunk at a time."""
+    times=np.load(os.path.join(store['path'],'starttimes.npy'))/store['sfreq']
+    start=0 if tmin is None else int(np.searchsorted(times,tmin,'left'))
+    stop=len(times) if tmax is None else int(np.searchsorted(times,tmax,'right'))
+    shape=store['shape'][:-3]+(stop-start,)+store['shape'][-2:]
+    out=np.lib.format.open_memmap(fname,mode='w+',dtype=np.dtype(store['dtype']),shape=shape)
+    for a in range(start,stop,store['chunk']):
+        z=min(a+store['chunk'],stop)
+        out[...,a-start:z-start,:,:]=dfc_store_windows(store,a,z)
+    out.flush()
+    del out
+
+#saves a DFC result, kept in memory or in a store
+def save_dfc(fname,dfc):
+    if isinstance(dfc,dict):
+        export_dfc_store(dfc,fname)
+    else:
+        np.save(fname,dfc)
+
+#connectivity in moving windows for any of the DFC measures
+def windowed_measure(vals,starttimes,wlenval,delayval,measure='pearson',symb_type='equal-divs',n_symbols=2,x_divs=None,y_divs=None,
+                     n_jobs=None,progress=None,out=None,average=False,block=None,**kwargs):
+    """Dispatches the moving-window computation to the engine of each measure.
+    Parameters
+    ----------
+    vals : list
+        List of arrays of shape (n_items,n_chans,n_times).
+    starttimes : list
+        First sample of each moving window, one array per entry of vals.
+    measure : str
+        'pearson', 'spearman', 'te' or 'mi'.
+    symb_type, n_symbols, x_divs, y_divs, n_jobs, **kwargs :
+        Only used by 'te' and 'mi' (see parallel_windowed_info).
+    progress : function, None
+        Called as progress(done,total).
+    out : list, None
+        Destination of the results, one (target,index) pair per entry of
+        vals, where target is an array or a DFC store (see create_dfc_store)
+        and index the leading indices of the entry in it. The results are
+        written window block by window block. If None, arrays are allocated.
+    average : bool
+        Average over the items (ignoring NaN, as np.nanmean) as the blocks
+        arrive, so that the results of the single items are never kept.
+    block : int, None
+        Number of windows computed at a time by 'pearson' and 'spearman'
+        (default: about 64 MB of results).
+    Returns
+    -------
+    results : list
+        The targets, one per entry of vals; by default arrays of shape
+        (n_items,n_windows,n_chans,n_chans), or (n_windows,n_chans,n_chans)
+        if average.
+    """
+    if out is None:
+        out=[(np.empty(((len(st),) if average else (v.shape[0],len(st)))+(v.shape[1],v.shape[1]),dtype=float_dtype),()) for v,st in zip(vals,starttimes)]
+    sums={}
+    def emit(n,item,b,values):
+        target,index=out[n]
+        if not average:
+            write_dfc(target,index+(item,),b,values)
+            return
+        #nan-aware sums of the window block, written when all the items arrived
+        if (n,b) not in sums:
+            sums[(n,b)]=[np.zeros(values.shape),np.zeros(values.shape,dtype=np.int64),0]
+        acc=sums[(n,b)]
+        valid=~np.isnan(values)
+        acc[0]+=np.where(valid,values,0)
+        acc[1]+=valid
+        acc[2]+=1
+        if acc[2]==vals[n].shape[0]:
+            del sums[(n,b)]
+            with np.errstate(divide='ignore',invalid='ignore'):
+                write_dfc(target,index,b,(acc[0]/acc[1]).astype(float_dtype))
+    if measure in ('te','mi'):
+        kernel={'te':te_matrix,'mi':mi_matrix}[measure]
+        n_symb=alphabet_size(symb_type,n_symbols,x_divs,y_divs)
+        parallel_windowed_info(kernel,vals,starttimes,wlenval,delayval,symb_type,n_symb,x_divs,y_divs,n_jobs=n_jobs,progress=progress,emit=emit,**kwargs)
+        return [target for target,index in out]
+    engines={'pearson':windowed_pearson,'spearman':windowed_spearman}
+    if measure not in engines:
+        raise ValueError(f"Unknown DFC measure '{measure}'")
+    if block is None:
+        block=max(1,2**26//(8*vals[0].shape[1]**2))
+    total=sum([v.shape[0]*int(np.ceil(len(st)/block)) for v,st in zip(vals,starttimes)])
+    k=0
+    for n in range(len(vals)):
+        for b in range(0,len(starttimes[n]),block):
+            st=starttimes[n][b:b+block]
+            #only the samples spanned by the windows of the block
+            span=slice(st[0],st[-1]+wlenval+delayval)
+            for item in range(vals[n].shape[0]):
+                emit(n,item,b,engines[measure](vals[n][item][:,span],st-st[0],wlenval,delayval))
+                k+=1
+                if progress is not None:
+                    progress(k,total)
+    return [target for target,index in out]
+
+#headless dynamic functional connectivity of a continuous series
+def compute_dfc(vals,sfreq,delay=10,wlen=500,woverlap=250,measure='pearson',n_jobs=None,progress=None,store=None,**kwargs):
+    """Dynamic functional connectivity of a raw recording or of single epochs,
+    without any user interface.
+    Parameters
+    ----------
+    vals : np.array
+        Array of shape (n_chans,n_times), or (n_items,n_chans,n_times) to
+        process several series with the same windows.
+    sfreq : float
+        Sampling frequency, in Hz.
+    delay, wlen, woverlap : float
+        Transmission delay, window length and window overlap, in ms.
+    measure : str
+        'pearson', 'spearman', 'te' or 'mi'.
+    n_jobs : int, None
+        Number of processes for 'te' and 'mi'.
+    progress : function, None
+        Called as progress(done,total).
+    store : str, None
+        If given, the results are written block by block to a DFC store in
+        this directory (see create_dfc_store), which is returned instead of
+        an array.
+    **kwargs :
+        Symbolization and word parameters for 'te' and 'mi' (symb_type,
+        n_symbols, x_divs, y_divs, symbolic_length, tau, units).
+    Returns
+    -------
+    dfc : np.array, dict
+        Array (or store) of shape (n_windows,n_chans,n_chans), or
+        (n_items,n_windows,n_chans,n_chans) for 3D input.
+    """
+    vals=np.asarray(vals,dtype=float_dtype)
+    starttimes,wlenval,delayval=dfc_windows(vals.shape[-1],sfreq,delay,wlen,woverlap)
+    shape=vals.shape[:-2]+(len(starttimes),vals.shape[-2],vals.shape[-2])
+    if store is None:
+        dfc=np.empty(shape,dtype=float_dtype)
+    else:
+        dfc=create_dfc_store(store,shape,starttimes,sfreq,wlenval,delayval,measure=measure)
+    #a single series is written as the average of its only item
+    windowed_measure([vals.reshape((-1,)+vals.shape[-2:])],[starttimes],wlenval,delayval,measure,n_jobs=n_jobs,progress=progress,
+                     out=[(dfc,())],average=vals.ndim==2,**kwargs)
+    return dfc
+
+#headless dynamic functional connectivity averaged over the epochs of each event
+def compute_epochs_dfc(epochs,event_names,delay=10,wlen=500,woverlap=250,measure='pearson',n_jobs=None,progress=None,store=None,**kwargs):
+    """Dynamic functional connectivity of every epoch of every event,
+    averaged over the epochs of each event, without any user interface.
+    The average is accumulated as the window blocks are computed, so the
+    DFC of the single epochs is never kept.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    event_names : list
+        Names of the events to analyse.
+    (other parameters as in compute_dfc)
+    Returns
+    -------
+    dfc : np.array, dict
+        Array (or store) of shape (n_events,n_windows,n_chans,n_chans).
+    """
+    vals=[event_data(epochs,key) for key in event_names]
+    sfreq=epochs.info['sfreq']
+    starttimes,wlenval,delayval=dfc_windows(vals[0].shape[-1],sfreq,delay,wlen,woverlap)
+    shape=(len(vals),len(starttimes),vals[0].shape[1],vals[0].shape[1])
+    if store is None:
+        dfc=np.empty(shape,dtype=float_dtype)
+    else:
+        dfc=create_dfc_store(store,shape,starttimes,sfreq,wlenval,delayval,measure=measure,event_names=list(event_names))
+    windowed_measure(vals,[starttimes]*len(vals),wlenval,delayval,measure,n_jobs=n_jobs,progress=progress,
+                     out=[(dfc,(k,)) for k in range(len(vals))],average=True,**kwargs)
+    return dfc
+
+#recording opened without loading its samples, for the streaming DFC
+def open_raw_stream(fname):
+    """Opens an EDF (or FIF) recording without preloading it, so that only the
+    samples requested by get_data(start=...,stop=...) are read from disk."""
+    if fname.lower().endswith('.fif'):
+        return mne.io.read_raw_fif(fname,preload=False,verbose='ERROR')
+    return mne.io.read_raw_edf(fname,preload=False,verbose='ERROR')
+
+#record of the preprocessing of one condition, replayed by read_preprocessed
+def new_raw_steps(fname,sfreq,start,stop):
+    """Returns the record of a condition made of the samples start..stop of
+    the file fname: 'origin' is that segment, 'start'/'stop' the samples
+    left after cropping, and 'ops' the preprocessing steps, in order:
+        ('pick',names): channels kept, in that order;
+        ('rename',mapping): new channel names;
+        ('filter',info,l_freq,h_freq,segment,pad): Raw.filter;
+        ('notch',freqs,widths,segment,pad): mne.filter.notch_filter;
+        ('affine',matrix,offset): any change of every sample on its own
+        (re-referencing, ICA), see record_affine.
+    segment is the (start,stop) of the condition when the filter was applied
+    and pad the length of the filter, in samples."""
+    return {'fname':fname,'sfreq':sfreq,'origin':(start,stop),'start':start,'stop':stop,'ops':[]}
+
+#preprocessing steps of the conditions loaded from EDF files (see new_raw_steps)
+raw_steps=[None,None]
+
+#adds a step to the preprocessing record of condition n
+def record_step(n,*op):
+    if raw_steps[n] is not None:
+        raw_steps[n]['ops'].append(op)
+
+#records the crop of condition n
+def record_crop(n,first_samp,raw):
+    """Updates the segment of condition n after raw.crop, from the first_samp
+    of raw before the crop."""
+    if raw_steps[n] is not None:
+        raw_steps[n]['start']+=raw.first_samp-first_samp
+        raw_steps[n]['stop']=raw_steps[n]['start']+raw.n_times
+
+#records the band-pass filter of condition n
+def record_filter(n,raw,l_freq,h_freq):
+    """To be called before raw.filter(l_freq,h_freq)."""
+    steps=raw_steps[n]
+    if steps is not None:
+        pad=len(mne.filter.create_filter(None,raw.info['sfreq'],l_freq,h_freq,verbose='ERROR'))
+        record_step(n,'filter',raw.info.copy(),l_freq,h_freq,(steps['start'],steps['stop']),pad)
+
+#records the notch filter of condition n
+def record_notch(n,freqs,widths):
+    """To be called with the freqs and notch_widths of the 'hann' notch filter
+    of the preprocessing; its length is that of the 1 Hz transition band."""
+    steps=raw_steps[n]
+    if steps is not None:
+        pad=int(np.ceil(3.3*steps['sfreq']))+1
+        record_step(n,'notch',np.array(freqs),np.array(widths),(steps['start'],steps['stop']),pad)
+
+#records a change of condition n that acts on every sample on its own
+def record_affine(n,info,apply):
+    """Records apply (a function that changes a Raw in place or returns the
+    changed copy, e.g. a re-referencing or ICA.apply), which must act on
+    every sample on its own, as the matrix and offset it amounts to: these
+    are found by applying it to a recording with channels info made of a
+    null sample followed by one unit sample per channel."""
+    if raw_steps[n] is None:
+        return
+    n_chans=len(info.ch_names)
+    probe=mne.io.RawArray(np.hstack((np.zeros((n_chans,1)),np.eye(n_chans))),info,verbose='ERROR')
+    out=apply(probe).get_data()
+    record_step(n,'affine',out[:,1:]-out[:,:1],out[:,0].copy())
+
+#samples of a condition read from its file, with the recorded preprocessing
+def read_preprocessed(steps,raw,start,stop):
+    """Returns the samples start..stop of the preprocessed condition (see
+    new_raw_steps), read from raw, the file opened with open_raw_stream.
+    Every filter is applied to the chunk extended by the length of the
+    filters on each side, within the segment it was applied to, so the
+    result is that of the preprocessing of the whole recording."""
+    a=steps['start']+start
+    z=steps['start']+stop
+    pad=sum([op[-1] for op in steps['ops'] if op[0] in ('filter','notch')])
+    lo=max(a-pad,steps['origin'][0])
+    hi=min(z+pad,steps['origin'][1])
+    data=raw.get_data(start=lo,stop=hi)
+    names=list(raw.ch_names)
+    for op in steps['ops']:
+        if op[0]=='pick':
+            data=data[[names.index(name) for name in op[1]]]
+            names=list(op[1])
+        elif op[0]=='rename':
+            names=[op[1].get(name,name) for name in names]
+        elif op[0]=='affine':
+            data=op[1]@data+op[2][:,None]
+        else:
+            seg_start,seg_stop=op[-2]
+            data=data[:,max(lo,seg_start)-lo:min(hi,seg_stop)-lo]
+            lo,hi=max(lo,seg_start),min(hi,seg_stop)
+            if op[0]=='filter':
+                data=mne.io.RawArray(data,op[1],verbose='ERROR').filter(op[2],op[3],verbose='ERROR').get_data()
+            else:
+                data=mne.filter.notch_filter(data,steps['sfreq'],op[1],fir_window='hann',notch_widths=op[2],verbose='ERROR')
+    return data[:,a-lo:z-lo]
+
+#condition streamed from its file with the recorded preprocessing
+def open_preprocessed_stream(steps):
+    """Returns the stream (see stream_source) of a condition recorded by
+    new_raw_steps, read from its file without loading it."""
+    raw=open_raw_stream(steps['fname'])
+    names=list(raw.ch_names)
+    for op in steps['ops']:
+        if op[0]=='pick':
+            names=list(op[1])
+        elif op[0]=='rename':
+            names=[op[1].get(name,name) for name in names]
+    return {'sfreq':steps['sfreq'],'ch_names':names,'n_times':steps['stop']-steps['start'],'read':partial(read_preprocessed,steps,raw)}
+
+#recording read chunk by chunk by the streaming DFC
+def stream_source(raw):
+    """Returns the recording to stream as a dict with its 'sfreq', 'ch_names',
+    'n_times' and 'read' function (read(start,stop) returns the samples
+    start..stop), from a file name (opened with open_raw_stream), an
+    mne.io.Raw or such a dict (e.g. from open_preprocessed_stream)."""
+    if isinstance(raw,dict):
+        return raw
+    if isinstance(raw,str):
+        raw=open_raw_stream(raw)
+    return {'sfreq':raw.info['sfreq'],'ch_names':list(raw.ch_names),'n_times':raw.n_times,
+            'read':lambda start,stop: raw.get_data(start=start,stop=stop)}
+
+#dynamic functional connectivity of a recording read chunk by chunk
+def stream_dfc(raw,delay=10,wlen=500,woverlap=250,measure='pearson',energy=False,block=None,n_jobs=None,**kwargs):
+    """Streaming dynamic functional connectivity of a continuous recording.
+    The recording is read in overlapping chunks, each one spanning a block of
+    consecutive windows (from the first sample of the first window to the
+    last delayed sample of the last one), so the memory used depends on the
+    window parameters and not on the length of the recording.
+    Parameters
+    ----------
+    raw : str, mne.io.Raw, dict
+        File name (opened with open_raw_stream), recording (preloaded or
+        not) or stream (see stream_source).
+    delay, wlen, woverlap : float
+        Transmission delay, window length and window overlap, in ms.
+    measure : str
+        'pearson', 'spearman', 'te' or 'mi'.
+    energy : bool
+        Use the squared values (energy) instead of the raw values; only the
+        chunks are squared.
+    block : int, None
+        Number of windows read and computed at a time (default: about 64 MB
+        of samples and of results).
+    n_jobs : int, None
+        Number of processes for 'te' and 'mi' (None for all cores, 1 to run
+        in this process). The chunks are read here and computed by the pool,
+        at most 2*n_jobs chunks at a time.
+    **kwargs :
+        Symbolization and word parameters for 'te' and 'mi', as in compute_dfc.
+    Yields
+    ------
+    time : float
+        Start of the window, in s.
+    dfc : np.array
+        Connectivity of the window, array of shape (n_chans,n_chans).
+    """
+    src=stream_source(raw)
+    sfreq=src['sfreq']
+    n_chans=len(src['ch_names'])
+    starttimes,wlenval,delayval=dfc_windows(src['n_times'],sfreq,delay,wlen,woverlap)
+    if measure in ('te','mi'):
+        symb_type=kwargs.pop('symb_type','equal-divs')
+        x_divs=kwargs.pop('x_divs',None)
+        y_divs=kwargs.pop('y_divs',None)
+        n_symbols=alphabet_size(symb_type,kwargs.pop('n_symbols',2),x_divs,y_divs)
+        engine=partial(windowed_info,{'te':te_matrix,'mi':mi_matrix}[measure],symb_type=symb_type,n_symbols=n_symbols,x_divs=x_divs,y_divs=y_divs,**kwargs)
+    elif measure in ('pearson','spearman'):
+        engine={'pearson':windowed_pearson,'spearman':windowed_spearman}[measure]
+    else:
+        raise ValueError(f"Unknown DFC measure '{measure}'")
+    if n_jobs is None:
+        n_jobs=os.cpu_count()
+    parallel=(measure in ('te','mi')) and (n_jobs>1)
+    if block is None:
+        hop=int(starttimes[1]-starttimes[0]) if len(starttimes)>1 else wlenval
+        block=max(1,min(2**26//(8*n_chans*n_chans),(2**26//(8*n_chans)-wlenval-delayval)//hop))
+        if parallel:
+            #enough chunks to keep all the processes busy
+            block=max(1,min(block,-(-len(starttimes)//(4*n_jobs))))
+    def chunks():
+        for b in range(0,len(starttimes),block):
+            st=starttimes[b:b+block]
+            chunk=src['read'](int(st[0]),int(st[-1])+wlenval+delayval)
+            if energy:
+                chunk=np.square(chunk)
+            yield st,np.asarray(chunk,dtype=float_dtype)
+    if not parallel:
+        for st,chunk in chunks():
+            values=engine(chunk,st-st[0],wlenval,delayval)
+            for m in range(len(st)):
+                yield st[m]/sfreq,values[m]
+        return
+    def ready(task):
+        st,future=task
+        values=future.result()
+        for m in range(len(st)):
+            yield st[m]/sfreq,values[m]
+    pending=[]
+    with process_pool(n_jobs) as executor:
+        try:
+            for st,chunk in chunks():
+                pending.append((st,executor.submit(engine,chunk,st-st[0],wlenval,delayval)))
+                if len(pending)>=2*n_jobs:
+                    yield from ready(pending.pop(0))
+            while len(pending)>0:
+                yield from ready(pending.pop(0))
+        finally:
+            #stopped early (e.g. cancelled): drop the chunks that did not start
+            for st,future in pending:
+                future.cancel()
+
+#headless streaming dynamic functional connectivity of a continuous recording
+def compute_stream_dfc(raw,delay=10,wlen=500,woverlap=250,measure='pearson',energy=False,progress=None,store=None,n_jobs=None,**kwargs):
+    """Dynamic functional connectivity of a continuous recording read chunk
+    by chunk (see stream_dfc), so that the whole recording is never copied
+    (nor squared, for the energy) in memory. With a store, the results are
+    also written to disk as they are computed, so neither the samples nor
+    the results of the whole recording are kept in memory.
+    Parameters
+    ----------
+    raw : str, mne.io.Raw, dict
+        EDF/FIF file name, recording or stream (see stream_source).
+    progress : function, None
+        Called as progress(done,total), in windows.
+    store : str, None
+        Directory of the DFC store (see create_dfc_store) that receives the
+        results; the channel names are kept in its meta['ch_names'].
+    (other parameters as in stream_dfc)
+    Returns
+    -------
+    dfc : np.array, dict
+        Array (or store) of shape (n_windows,n_chans,n_chans).
+    """
+    src=stream_source(raw)
+    sfreq=src['sfreq']
+    starttimes,wlenval,delayval=dfc_windows(src['n_times'],sfreq,delay,wlen,woverlap)
+    shape=(len(starttimes),len(src['ch_names']),len(src['ch_names']))
+    if store is None:
+        dfc=np.empty(shape,dtype=float_dtype)
+        flush=256
+    else:
+        dfc=create_dfc_store(store,shape,starttimes,sfreq,wlenval,delayval,measure=measure,ch_names=list(src['ch_names']),energy=bool(energy))
+        flush=dfc['chunk']
+    buf=[]
+    done=0
+    for t,values in stream_dfc(src,delay,wlen,woverlap,measure,energy,n_jobs=n_jobs,**kwargs):
+        buf.append(values)
+        if (len(buf)==flush) or (done+len(buf)==len(starttimes)):
+            write_dfc(dfc,(),done,np.stack(buf).astype(float_dtype))
+            done+=len(buf)
+            buf=[]
+            if progress is not None:
+                progress(done,len(starttimes))
+    return dfc
+
+#state of the online dynamic functional connectivity
+def online_dfc(n_chans,sfreq,delay=10,wlen=500,woverlap=250,measure='pearson',refresh=1000,**kwargs):
+    """Online (real-time) dynamic functional connectivity, e.g. for
+    closed-loop experiments. The incoming samples are kept in a ring buffer
+    of one window plus the delay plus one hop, and push_online_dfc emits a
+    connectivity matrix every hop (window length minus overlap), for the
+    windows of compute_dfc.
+    'pearson' keeps the sums of the current window and, at every hop, only
+    adds the samples that enter the window and removes the ones that leave
+    it (the sums are recomputed from the buffer every refresh hops, so that
+    rounding errors do not accumulate). With user-given partition divisions
+    (symb_type None), 'te' and 'mi' update the joint histograms of the
+    current window in the same way. The ranks of 'spearman' and the
+    'equal-divs'/'equal-points' partitions depend on the whole window, so
+    these are computed from the buffer at every hop.
+    Parameters
+    ----------
+    n_chans : int
+        Number of channels of the incoming blocks.
+    sfreq : float
+        Sampling frequency, in Hz.
+    delay, wlen, woverlap : float
+        Transmission delay, window length and window overlap, in ms.
+    measure : str
+        'pearson', 'spearman', 'te' or 'mi'.
+    refresh : int
+        Number of hops between full recomputations of the window sums.
+    **kwargs :
+        Symbolization and word parameters for 'te' and 'mi' (symb_type,
+        n_symbols, x_divs, y_divs, symbolic_length, tau, units).
+    Returns
+    -------
+    state : dict
+        State of the online DFC, updated by push_online_dfc.
+    """
+    starttimes,wlenval,delayval=dfc_windows(0,sfreq,delay,wlen,woverlap)
+    hop=wlenval-int(float(woverlap)*sfreq/1000)
+    if measure not in ('pearson','spearman','te','mi'):
+        raise ValueError(f"Unknown DFC measure '{measure}'")
+    state={'n_chans':int(n_chans),'sfreq':float(sfreq),'wlenval':wlenval,'delayval':delayval,'hop':hop,'measure':measure,
+           'ring':np.zeros((n_chans,wlenval+delayval+hop)),'n_samples':0,'next':0,'prev':None,'hops':0,'refresh':refresh,
+           'offset':None,'sums':None,'symb':None}
+    if measure in ('te','mi'):
+        symb={'symb_type':kwargs.pop('symb_type','equal-divs'),'x_divs':kwargs.pop('x_divs',None),'y_divs':kwargs.pop('y_divs',None)}
+        symb['n_symbols']=alphabet_size(symb['symb_type'],kwargs.pop('n_symbols',2),symb['x_divs'],symb['y_divs'])
+        symb['kwargs']=kwargs
+        lengths=kwargs.get('symbolic_length',(1,1,1) if measure=='te' else (1,1))
+        tau=kwargs.get('tau',1)
+        #word times of a window, relative to its first sample
+        symb['start']=(max(lengths[0],lengths[1])-1)*tau
+        symb['future']=lengths[2]*tau if measure=='te' else 0
+        state['symb']=symb
+    return state
+
+#samples start to stop-1 of the ring buffer of the online DFC
+def ring_slice(state,start,stop):
+    ring=state['ring']
+    return ring[:,np.arange(start,stop)%ring.shape[1]]
+
+#sums of the (source, delayed target) pairs start to stop-1, for the online pearson
+def online_pearson_sums(state,start,stop):
+    d=state['delayval']
+    x=ring_slice(state,start,stop)-state['offset']
+    y=ring_slice(state,start+d,stop+d)-state['offset']
+    return [x.sum(axis=1),y.sum(axis=1),np.square(x).sum(axis=1),np.square(y).sum(axis=1),x@y.T]
+
+#joint histograms of the words at times start to stop-1, for the online te and mi
+def online_info_counts(state,start,stop):
+    symb=state['symb']
+    d=state['delayval']
+    n_symbols=symb['n_symbols']
+    tau=symb['kwargs'].get('tau',1)
+    a=start-symb['start']
+    z=stop+symb['future']
+    sx=symbolize(ring_slice(state,a,z),None,divs=symb['x_divs'])
+    sy=symbolize(ring_slice(state,a+d,z+d),None,divs=symb['y_divs'])
+    if state['measure']=='te':
+        lxp,lyp,lyf=symb['kwargs'].get('symbolic_length',(1,1,1))
+        xp=symbol_words(sx,lxp,tau,n_symbols,symb['start'],symb['start']+stop-start)
+        yp=symbol_words(sy,lyp,tau,n_symbols,symb['start'],symb['start']+stop-start)
+        yf=symbol_words(sy,lyf,tau,n_symbols,symb['start'],symb['start']+stop-start,future=True)
+        n_xp,n_yp,n_yf=n_symbols**lxp,n_symbols**lyp,n_symbols**lyf
+        return [pair_counts(xp,(yf*n_yp+yp)*n_xp,n_yf*n_yp*n_xp)]
+    lx,ly=symb['kwargs'].get('symbolic_length',(1,1))
+    xw=symbol_words(sx,lx,tau,n_symbols,symb['start'],symb['start']+stop-start)
+    yw=symbol_words(sy,ly,tau,n_symbols,symb['start'],symb['start']+stop-start)
+    return [pair_counts(xw,yw*n_symbols**lx,n_symbols**(lx+ly))]
+
+#connectivity of the window starting at sample s, from the ring buffer
+def online_window(state,s):
+    """Connectivity matrix of the window that starts at sample s (see
+    online_dfc), updating the running sums or histograms of the state."""
+    measure=state['measure']
+    wlenval,delayval=state['wlenval'],state['delayval']
+    symb=state['symb']
+    if measure=='spearman':
+        return lagged_spearman(ring_slice(state,s,s+wlenval),ring_slice(state,s+delayval,s+delayval+wlenval))
+    if (symb is not None) and (symb['symb_type'] is not None):
+        kernel={'te':te_matrix,'mi':mi_matrix}[measure]
+        return windowed_info(kernel,ring_slice(state,s,s+wlenval+delayval),np.zeros(1,dtype=int),wlenval,delayval,
+                             symb['symb_type'],symb['n_symbols'],**symb['kwargs'])[0]
+    if measure=='pearson':
+        if state['offset'] is None:
+            #centering does not change the correlation, but avoids loss of precision
+            state['offset']=ring_slice(state,s,s+wlenval+delayval).mean(axis=1,keepdims=True)
+        a,z=s,s+wlenval
+        sums=online_pearson_sums
+    else:
+        a,z=s+symb['start'],s+wlenval-symb['future']
+        sums=online_info_counts
+    prev=state['prev']
+    if (prev is None) or (s-prev>=z-a) or (state['hops']%state['refresh']==0):
+        state['sums']=sums(state,a,z)
+    else:
+        #only the samples that enter and leave the window
+        step=s-prev
+        enter=sums(state,z-step,z)
+        leave=sums(state,a-step,a)
+        state['sums']=[t+e-l for t,e,l in zip(state['sums'],enter,leave)]
+    if measure=='pearson':
+        sx,sy,sxx,syy,sxy=state['sums']
+        with np.errstate(divide='ignore',invalid='ignore'):
+            num=wlenval*sxy-sx[:,None]*sy[None,:]
+            den=np.sqrt((wlenval*sxx-sx*sx)[:,None]*(wlenval*syy-sy*sy)[None,:])
+            return np.clip(num/den,-1,1)
+    n_chans=state['n_chans']
+    lengths=symb['kwargs'].get('symbolic_length',(1,1,1) if measure=='te' else (1,1))
+    units=symb['kwargs'].get('units','bits')
+    n_symbols=symb['n_symbols']
+    if measure=='te':
+        lxp,lyp,lyf=lengths
+        return te_from_counts(state['sums'][0].reshape(n_chans,n_chans,n_symbols**lyf,n_symbols**lyp,n_symbols**lxp),units)
+    lx,ly=lengths
+    return mi_from_counts(state['sums'][0].reshape(n_chans,n_chans,n_symbols**ly,n_symbols**lx),units)
+
+#adds a block of samples to the online DFC
+def push_online_dfc(state,values):
+    """Adds the incoming samples to the ring buffer of the online DFC and
+    computes the windows completed by them.
+    Parameters
+    ----------
+    state : dict
+        State made by online_dfc.
+    values : np.array
+        Block of samples, array of shape (n_chans,n_samples) of any length.
+    Returns
+    -------
+    results : list
+        (time,dfc) of every completed window, where time is the start of the
+        window in s from the first sample and dfc its (n_chans,n_chans)
+        connectivity matrix.
+    """
+    values=np.asarray(values,dtype=np.float64)
+    if (values.ndim!=2) or (values.shape[0]!=state['n_chans']):
+        raise ValueError(f"Expected blocks of shape ({state['n_chans']},n_samples), got {values.shape}")
+    ring=state['ring']
+    span=state['wlenval']+state['delayval']
+    results=[]
+    pos=0
+    while pos<values.shape[1]:
+        #samples before the previous window are no longer needed
+        oldest=state['next'] if state['prev'] is None else state['prev']
+        m=min(oldest+ring.shape[1]-state['n_samples'],values.shape[1]-pos)
+        ring[:,np.arange(state['n_samples'],state['n_samples']+m)%ring.shape[1]]=values[:,pos:pos+m]
+        state['n_samples']+=m
+        pos+=m
+        while state['n_samples']>=state['next']+span:
+            s=state['next']
+            results.append((s/state['sfreq'],online_window(state,s).astype(float_dtype)))
+            state['prev']=s
+            state['next']=s+state['hop']
+            state['hops']+=1
+    return results
+
+#real-time replay of a recording, in place of the acquisition hardware
+def replay_edf(fname,block=20,speed=1.0):
+    """Feeds a recording block by block at real-time speed, to test the
+    online DFC without acquisition hardware. The file is not preloaded: each
+    block is read from disk before it is due.
+    Parameters
+    ----------
+    fname : str, mne.io.Raw
+        EDF/FIF file name or recording.
+    block : float
+        Length of the blocks, in ms.
+    speed : float
+        Replay speed (1 for real time).
+    Yields
+    ------
+    due : float
+        time.perf_counter() at which the last sample of the block is acquired.
+    values : np.array
+        Block of samples, array of shape (n_chans,n_samples).
+    """
+    raw=open_raw_stream(fname) if isinstance(fname,str) else fname
+    sfreq=raw.info['sfreq']
+    n_block=max(1,int(float(block)*sfreq/1000))
+    t0=time.perf_counter()
+    for a in range(0,raw.n_times,n_block):
+        z=min(a+n_block,raw.n_times)
+        values=raw.get_data(start=a,stop=z)
+        due=t0+z/sfreq/speed
+        wait=due-time.perf_counter()
+        if wait>0:
+            time.sleep(wait)
+        yield due,values
+
+#online DFC of a replayed recording, with the latency of every hop
+def replay_online_dfc(fname,delay=10,wlen=500,woverlap=250,measure='pearson',block=20,speed=1.0,callback=None,**kwargs):
+    """Runs the online DFC (see online_dfc) on a recording replayed at
+    real-time speed by replay_edf, and measures the latency of every hop.
+    Parameters
+    ----------
+    fname : str, mne.io.Raw
+        EDF/FIF file name or recording.
+    block, speed :
+        Block length (ms) and speed of the replay.
+    callback : function, None
+        Called as callback(time,dfc) for every emitted matrix (e.g. by the
+        stimulation control); its duration is part of the latency.
+    (other parameters as in online_dfc)
+    Returns
+    -------
+    report : dict
+        'times': start of every window, in s; 'latency': time between the
+        acquisition of the block that completed each window and the emission
+        of its matrix, in s; 'hop': hop length, in s (for closed-loop use the
+        latency must stay below it).
+    """
+    raw=open_raw_stream(fname) if isinstance(fname,str) else fname
+    state=online_dfc(len(raw.ch_names),raw.info['sfreq'],delay,wlen,woverlap,measure,**kwargs)
+    times=[]
+    latency=[]
+    for due,values in replay_edf(raw,block,speed):
+        for t,dfc in push_online_dfc(state,values):
+            if callback is not None:
+                callback(t,dfc)
+            times.append(t)
+            latency.append(time.perf_counter()-due)
+    return {'times':np.array(times),'latency':np.array(latency),'hop':state['hop']/state['sfreq']}
+
 #pearson correlation based dynamic functional connectivity
 def pearson_dfc():
     win=Toplevel(main)
@@ -3274,309 +5922,157 @@ def pearson_dfc():
     fr=StringVar()
     fr.set("5")
     error=make_x()
-    if (error==1) and (raw1 is None):
-        Label(win,text="ERROR\nIt is required at least\n1 preprocessed or raw data",justify=CENTER).grid(row=0,column=0,padx=10,pady=10)        
-        Button(win,text="OK",command=win.destroy).grid(row=1,column=0,padx=10)
-    else:
-        def step():
-            if (int(delay.get())>=0) and (int(wlen.get())>0) and (int(fr.get())>0):
-                error2=0
-                if (raw_or_epoch.get()==2) and (error==1):
-                    showinfo(title="Error",message="To work with epochs it is\nnecessary to have at\nleast 1 preprocessed data")
-                    error2=1
-                elif (raw_or_epoch.get()==1) and (raw1 is None):
-                    showinfo(title="Error",message="To work with raw it is\nnecessary to have loaded at\nleast 1 raw EDF file")
-                    error2=1
-                elif raw_or_epoch.get()==1:
-                    n_chans=len(xraw1.ch_names)
-                    delayval=int(float(delay.get())*xraw1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*xraw1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*xraw1.info['sfreq']/1000)
-                    vals1=xraw1.get_data()
-                    starttimes1=np.arange(0,vals1.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    dfc1=np.empty((len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if xraw2 is not None:
-                        vals2=xraw2.get_data()
-                        starttimes2=np.arange(0,vals2.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        dfc2=np.empty((len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                maxrounds+=1
-                            if xraw2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    maxrounds+=1
-                    k=0                
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/maxrounds
-                                pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                key_idx=0
-                                dfc1[m1,i,j]=np.corrcoef(vals1[i,starttimes1[m1]:endtimes1[m1]],vals1[j,starttimes1[m1]+delayval:endtimes1[m1]+delayval])[0,1]
-                            if xraw2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/maxrounds
-                                    pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                    key_idx=0
-                                    dfc2[m2,i,j]=np.corrcoef(vals2[i,starttimes2[m2]:endtimes2[m2]],vals2[j,starttimes2[m2]+delayval:endtimes2[m2]+delayval])[0,1]                                    
-                elif raw_or_epoch.get()==2:
-                    n_chans=len(x1.ch_names)
-                    delayval=int(float(delay.get())*x1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*x1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*x1.info['sfreq']/1000)
-                    vals1=x1.get_data()[int(sel_epoch1.get()),:,:]
-                    starttimes1=np.arange(0,vals1.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    dfc1=np.empty((len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if x2 is not None:
-                        vals2=x2.get_data()[int(sel_epoch2.get()),:,:]
-                        starttimes2=np.arange(0,vals2.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        dfc2=np.empty((len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                maxrounds+=1
-                            if x2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    maxrounds+=1
-                    k=0                
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/maxrounds
-                                pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                key_idx=0
-                                dfc1[m1,i,j]=np.corrcoef(vals1[i,starttimes1[m1]:endtimes1[m1]],vals1[j,starttimes1[m1]+delayval:endtimes1[m1]+delayval])[0,1]
-                            if x2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/maxrounds
-                                    pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                    key_idx=0
-                                    dfc2[m2,i,j]=np.corrcoef(vals2[i,starttimes2[m2]:endtimes2[m2]],vals2[j,starttimes2[m2]+delayval:endtimes2[m2]+delayval])[0,1]                                    
-                elif raw_or_epoch.get()==3:
-                    event_names=list(event_dict.keys())
-                    n_chans=len(x1.ch_names)
-                    delayval=int(float(delay.get())*x1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*x1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*x1.info['sfreq']/1000)
-                    vals1=[]
-                    n_epochs1=[]
-                    for i in range(len(event_names)):
-                        vals1.append(x1[event_names[i]].get_data())
-                        n_epochs1.append(vals1[i].shape[0])
-                    starttimes1=np.arange(0,vals1[0].shape[2]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    tdfc1=[]
-                    for i in range(len(event_names)):
-                        tdfc1.append(np.empty((n_epochs1[i],len(starttimes1),n_chans,n_chans)))
-                        tdfc1[i].fill(np.nan)
-                    dfc1=np.empty((len(event_names),len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if x2 is not None:
-                        vals2=[]
-                        n_epochs2=[]
-                        for i in range(len(event_names)):
-                            vals2.append(x2[event_names[i]].get_data())
-                            n_epochs2.append(vals2[i].shape[0])
-                        starttimes2=np.arange(0,vals2[0].shape[2]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        tdfc2=[]
-                        for i in range(len(event_names)):
-                            tdfc2.append(np.empty((n_epochs2[i],len(starttimes1),n_chans,n_chans)))
-                            tdfc2[i].fill(np.nan)
-                        dfc2=np.empty((len(event_names),len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    for e1 in range(n_epochs1[ev]):
-                                        maxrounds+=1
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        for e2 in range(n_epochs2[ev]):
-                                            maxrounds+=1
-                    k=0                
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    for e1 in range(n_epochs1[ev]):
-                                        win.update_idletasks()
-                                        win.update()
-                                        k+=1
-                                        pbar['value'] += 100/maxrounds
-                                        pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                        key_idx=0
-                                        tdfc1[ev][e1,m1,i,j]=np.corrcoef(vals1[ev][e1,i,int(starttimes1[m1]):int(endtimes1[m1])],vals1[ev][e1,j,int(starttimes1[m1])+delayval:int(endtimes1[m1])+delayval])[0,1]
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        for e2 in range(n_epochs2[ev]):
-                                            win.update_idletasks()
-                                            win.update()
-                                            k+=1
-                                            pbar['value'] += 100/maxrounds
-                                            pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                            key_idx=0
-                                            tdfc2[ev][e2,m2,i,j]=np.corrcoef(vals2[ev][e2,i,starttimes2[m2]:endtimes2[m2]],vals2[ev][e2,j,starttimes2[m2]+delayval:endtimes2[m2]+delayval])[0,1]
-                    pbtxt['text']="finishing, please wait"
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    dfc1[ev,m1,i,j]=np.nanmean(tdfc1[ev][:,m1,i,j])
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        dfc2[ev,m2,i,j]=np.nanmean(tdfc2[ev][:,m2,i,j])        
-                    pbtxt['text']="done!"
-                if error2==0:
-                    def make_film():
-                        winfilm=Toplevel(win)
-                        Label(winfilm,text="Make Dynamic Functional Connectivity animation").grid(row=0,column=0,padx=10,pady=10,columnspan=3)
-                        pbar2=Progressbar(winfilm,orient=HORIZONTAL,length=100,mode='determinate')
-                        pbar2['value']=0.0
-                        pbtxt2=Label(winfilm,text="--")
-                        def process_frames():
-                            if raw_or_epoch.get()==3:
-                                nocond2=0
-                                try:
-                                    n_frames=min(len(dfc1[0,:,0,0]),len(dfc2[0,:,0,0]))
-                                except:
-                                    n_frames=len(dfc1[0,:,0,0])
-                                    nocond2=1
-                                k=0
-                                os.mkdir('temp_DFC_frames')
-                                for frame in range(n_frames):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar2['value'] += 100/n_frames
-                                    pbtxt2['text']=f"{k:d}/{n_frames:d}"
-                                    y1=[]
-                                    if nocond2==1:
-                                        y2=None
-                                    else:
-                                        y2=[]
-                                    for ev in range(len(event_names)):
-                                        y1.append(pd.DataFrame(dfc1[ev,frame,:,:],index=x1.ch_names,columns=x1.ch_names))
-                                        if nocond2==0:
-                                            y2.append(pd.DataFrame(dfc2[ev,frame,:,:],index=x2.ch_names,columns=x2.ch_names))
-                                    make_frame(y1,y2,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',frttl=f'temp_DFC_frames/DFC_frame{frame:05d}.png')
-                                pbtxt2['text']="Finishing up"
-                                command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_frame%05d.png -pix_fmt yuv420p DFC_Pearson.mp4'
-                                os.system(command)
-                                shutil.rmtree('temp_DFC_frames')
-                                showinfo(title="Info",message="Video of DFC was saved as DFC_Pearson.mp4 at\n"+os.getcwd())
+    def step():
+        if (int(delay.get())>=0) and (int(wlen.get())>0) and (int(fr.get())>0):
+            error2=0
+            if (raw_or_epoch.get() in (2,3)) and (error==1):
+                showinfo(title="Error",message="To work with epochs it is\nnecessary to have at\nleast 1 preprocessed data")
+                error2=1
+            elif (raw_or_epoch.get() in (1,4)) and (raw1 is None):
+                showinfo(title="Error",message="To work with raw it is\nnecessary to have loaded at\nleast 1 raw EDF file")
+                error2=1
+            elif raw_or_epoch.get() in (1,4):
+                #chunk by chunk from the loaded recordings, or from their files with the same preprocessing
+                sources=[xraw1,xraw2] if raw_or_epoch.get()==1 else [open_preprocessed_stream(steps) for steps in raw_steps if steps is not None]
+                jobs=[partial(compute_stream_dfc,src,float(delay.get()),float(wlen.get()),float(woverlap.get()),'pearson',energy=raw_or_energy.get()==2,
+                              store=temp_dfc_store(raw_or_epoch.get()==4)) for src in sources if src is not None]
+            elif raw_or_epoch.get()==2:
+                jobs=[partial(compute_dfc,epoch_data(x1,int(sel_epoch1.get())),x1.info['sfreq'],float(delay.get()),float(wlen.get()),float(woverlap.get()),'pearson',store=temp_dfc_store())]
+                if x2 is not None:
+                    jobs.append(partial(compute_dfc,epoch_data(x2,int(sel_epoch2.get())),x2.info['sfreq'],float(delay.get()),float(wlen.get()),float(woverlap.get()),'pearson',store=temp_dfc_store()))
+            elif raw_or_epoch.get()==3:
+                event_names=list(event_dict.keys())
+                jobs=[partial(compute_epochs_dfc,x1,event_names,float(delay.get()),float(wlen.get()),float(woverlap.get()),'pearson',store=temp_dfc_store())]
+                if x2 is not None:
+                    jobs.append(partial(compute_epochs_dfc,x2,event_names,float(delay.get()),float(wlen.get()),float(woverlap.get()),'pearson',store=temp_dfc_store()))
+            if error2==0:
+                results=run_task(win,pbar,pbtxt,jobs)
+                if results is None:
+                    return
+                dfc1=results[0]
+                if len(results)>1:
+                    dfc2=results[1]
+                def make_film():
+                    winfilm=Toplevel(win)
+                    Label(winfilm,text="Make Dynamic Functional Connectivity animation").grid(row=0,column=0,padx=10,pady=10,columnspan=3)
+                    pbar2=Progressbar(winfilm,orient=HORIZONTAL,length=100,mode='determinate')
+                    pbar2['value']=0.0
+                    pbtxt2=Label(winfilm,text="--")
+                    n_render=StringVar()
+                    n_render.set(str(os.cpu_count()))
+                    def process_frames():
+                        y2=results[1] if len(results)>1 else None
+                        if raw_or_epoch.get()==3:
+                            fname=fd.asksaveasfilename(title="Video of DFC",initialfile="DFC_Pearson.mp4",defaultextension=".mp4",filetypes=(("MP4 video", "*.mp4"),("All Files", "*.*")))
+                            if not fname:
+                                return
+                            fnames=[fname]
+                            jobs=[partial(render_dfc_video,fname,dfc1,y2,x1.ch_names,event_names,None if y2 is None else [cond1_name.get(),cond2_name.get()],fps=int(fr.get()),
+                                          vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',n_jobs=int(n_render.get()))]
+                        else:
+                            if raw_or_epoch.get()==4:
+                                ch_names=dfc1['meta']['ch_names']
                             else:
-                                nocond2=0
-                                n_frames1=len(dfc1[:,0,0])
-                                total_frames=n_frames1
-                                if raw_or_epoch.get()==2:
-                                    ch_names=x1.ch_names
-                                else:
-                                    ch_names=xraw1.ch_names
-                                try:
-                                    n_frames2=len(dfc2[:,0,0])
-                                    total_frames+=n_frames2
-                                except:
-                                    nocond2=1
-                                k=0
-                                os.mkdir('temp_DFC_frames')
-                                for frame in range(n_frames1):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar2['value'] += 100/total_frames
-                                    pbtxt2['text']=f"{k:d}/{total_frames:d}"
-                                    y1=pd.DataFrame(dfc1[frame,:,:],index=ch_names,columns=ch_names)
-                                    make_frame2(y1,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',frttl=f'temp_DFC_frames/DFC_{cond1_name.get()}_frame{frame:05d}.png')
-                                if nocond==0:
-                                    for frame in range(n_frames2):
-                                        win.update_idletasks()
-                                        win.update()
-                                        k+=1
-                                        pbar2['value'] += 100/total_frames
-                                        pbtxt2['text']=f"{k:d}/{total_frames:d}"
-                                        y2=pd.DataFrame(dfc2[frame,:,:],index=ch_names,columns=ch_names)
-                                        make_frame2(y2,vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',frttl=f'temp_DFC_frames/DFC_{cond2_name.get()}_frame{frame:05d}.png')
-                                pbtxt2['text']="Finishing up"
-                                command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_{cond1_name.get()}_frame%05d.png -pix_fmt yuv420p DFC_{cond1_name.get()}_Pearson.mp4'
-                                os.system(command)
-                                if nocond==0:
-                                    command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_{cond2_name.get()}_frame%05d.png -pix_fmt yuv420p DFC_{cond2_name.get()}_Pearson.mp4'
-                                    os.system(command)
-                                shutil.rmtree('temp_DFC_frames')
-                                if nocond==0:
-                                    showinfo(title="Info",message="Videos of DFC were saved as\nDFC_{cond1_name.get()}_Pearson.mp4 and DFC_{cond1_name.get()}_Pearson.mp4 at\n"+os.getcwd())
-                                else:
-                                    showinfo(title="Info",message="Video of DFC were saved as\nDFC_{cond1_name.get()}_Pearson.mp4 at\n"+os.getcwd())
-                            winfilm.destroy()
-                        btn2=Button(winfilm, text='Create video', command=process_frames)
-                        btn2.grid(row=1,column=0,sticky=W,padx=10)
-                        pbar2.grid(row=1,column=1,sticky=W)
-                        pbtxt2.grid(row=1,column=2,sticky=W)
-                    def save_corr():
-                        showinfo(title="Info",message="The full results will be saved as a\nNumpy array of size (n_times,n_chans,n_chans))")
-                        fname1 = fd.asksaveasfilename(title="Correlation DFC condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
-                        np.save(fname1,dfc1)
-                        if (x2 is not None) or (raw2 is not None):
-                            fname2 = fd.asksaveasfilename(title="Correlation DFC condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
-                            np.save(fname2,dfc2)
-                    Button(win,text="Save results",command=save_corr).grid(row=10,column=0,padx=10,sticky=W)
-                    Button(win,text="Make DFC animations",command=make_film).grid(row=11,column=0,padx=10,sticky=W)
-                    Button(win,text="Close",command=win.destroy).grid(row=12,column=0,padx=10,pady=10,columnspan=5)
-            else:
-                showinfo(title="Error",message="Delay, window length and frame rate must be positive numbers")
-        Label(win,text="Calculate correlations").grid(row=0,column=0,columnspan=4,padx=10,pady=10)
-        Label(win,text="Calculate from:").grid(row=1,column=0,padx=10,sticky=W)
-        Radiobutton(win,text="From raw EEG",variable=raw_or_epoch,value=1).grid(row=1,column=1,sticky=W)
-        Radiobutton(win,text="From epoch:",variable=raw_or_epoch,value=2).grid(row=2,column=1,sticky=W)
-        Entry(win,textvariable=sel_epoch1,width=2).grid(row=2,column=2,sticky=W)
-        Label(win,text=f"for {cond1_name.get()}").grid(row=2,column=3,sticky=W)
-        Entry(win,textvariable=sel_epoch2,width=2).grid(row=3,column=2,sticky=W)
-        Label(win,text=f"for {cond2_name.get()}").grid(row=3,column=3,sticky=W)
-        Radiobutton(win,text="Average of results of all epochs",variable=raw_or_epoch,value=3).grid(row=4,column=1,sticky=W,columnspan=3)
-        Label(win,text="Transmission delay between brain regions (ms):").grid(row=5,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=delay,width=4).grid(row=5,column=1,sticky=W)
-        Label(win,text="Moving window length (ms):").grid(row=6,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=wlen,width=6).grid(row=6,column=1,sticky=W)
-        Label(win,text="Moving window overlap (ms):").grid(row=7,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=woverlap,width=6).grid(row=7,column=1,sticky=W)
-        Label(win,text="Frame rate:").grid(row=8,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=fr,width=6).grid(row=8,column=1,sticky=W)
-        pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
-        pbar['value']=0.0
-        pbtxt=Label(win,text="--")
-        btn=Button(win, text='Start calculation', command=step)
-        btn.grid(row=9,column=0,sticky=W,padx=10)
-        pbar.grid(row=9,column=1,sticky=W)
-        pbtxt.grid(row=9,column=2,sticky=W,columnspan=3)
+                                ch_names=x1.ch_names if raw_or_epoch.get()==2 else xraw1.ch_names
+                            fnames=[]
+                            jobs=[]
+                            for y,cond in ((dfc1,cond1_name.get()),(y2,cond2_name.get())):
+                                if y is None:
+                                    continue
+                                fname=fd.asksaveasfilename(title="Video of DFC condition "+cond,initialfile=f"DFC_{cond}_Pearson.mp4",defaultextension=".mp4",filetypes=(("MP4 video", "*.mp4"),("All Files", "*.*")))
+                                if not fname:
+                                    return
+                                fnames.append(fname)
+                                jobs.append(partial(render_dfc_video,fname,y,None,ch_names,fps=int(fr.get()),vmin=-1,vmax=1,color='bwr',lblttl='Pearson correlation',n_jobs=int(n_render.get())))
+                        if run_task(winfilm,pbar2,pbtxt2,jobs,title="Rendering frames") is None:
+                            return
+                        if len(fnames)>1:
+                            showinfo(title="Info",message="Videos of DFC were saved as\n"+"\nand\n".join(fnames))
+                        else:
+                            showinfo(title="Info",message="Video of DFC was saved as\n"+fnames[0])
+                        winfilm.destroy()
+                    btn2=Button(winfilm, text='Create video', command=process_frames)
+                    btn2.grid(row=1,column=0,sticky=W,padx=10)
+                    pbar2.grid(row=1,column=1,sticky=W)
+                    pbtxt2.grid(row=1,column=2,sticky=W)
+                    Label(winfilm,text="Number of processes:").grid(row=2,column=0,padx=10,pady=(0,10),sticky=W)
+                    Entry(winfilm,textvariable=n_render,width=3).grid(row=2,column=1,pady=(0,10),sticky=W)
+                def save_corr():
+                    showinfo(title="Info",message="The full results will be saved as a\nNumpy array of size (n_times,n_chans,n_chans))")
+                    fname1 = fd.asksaveasfilename(title="Correlation DFC condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                    save_dfc(fname1,dfc1)
+                    if len(results)>1:
+                        fname2 = fd.asksaveasfilename(title="Correlation DFC condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                        save_dfc(fname2,dfc2)
+                Button(win,text="Save results",command=save_corr).grid(row=10,column=0,padx=10,sticky=W)
+                Button(win,text="Make DFC animations",command=make_film).grid(row=11,column=0,padx=10,sticky=W)
+                Button(win,text="Close",command=win.destroy).grid(row=12,column=0,padx=10,pady=10,columnspan=5)
+        else:
+            showinfo(title="Error",message="Delay, window length and frame rate must be positive numbers")
+    Label(win,text="Calculate correlations").grid(row=0,column=0,columnspan=4,padx=10,pady=10)
+    Label(win,text="Calculate from:").grid(row=1,column=0,padx=10,sticky=W)
+    Radiobutton(win,text="From raw EEG",variable=raw_or_epoch,value=1).grid(row=1,column=1,sticky=W)
+    Radiobutton(win,text="Stream raw EEG from its EDF file on disk\n(same preprocessing, long recordings)",variable=raw_or_epoch,value=4).grid(row=1,column=2,sticky=W,columnspan=3)
+    Radiobutton(win,text="From epoch:",variable=raw_or_epoch,value=2).grid(row=2,column=1,sticky=W)
+    Entry(win,textvariable=sel_epoch1,width=2).grid(row=2,column=2,sticky=W)
+    Label(win,text=f"for {cond1_name.get()}").grid(row=2,column=3,sticky=W)
+    Entry(win,textvariable=sel_epoch2,width=2).grid(row=3,column=2,sticky=W)
+    Label(win,text=f"for {cond2_name.get()}").grid(row=3,column=3,sticky=W)
+    Radiobutton(win,text="Average of results of all epochs",variable=raw_or_epoch,value=3).grid(row=4,column=1,sticky=W,columnspan=3)
+    Label(win,text="Transmission delay between brain regions (ms):").grid(row=5,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=delay,width=4).grid(row=5,column=1,sticky=W)
+    Label(win,text="Moving window length (ms):").grid(row=6,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=wlen,width=6).grid(row=6,column=1,sticky=W)
+    Label(win,text="Moving window overlap (ms):").grid(row=7,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=woverlap,width=6).grid(row=7,column=1,sticky=W)
+    Label(win,text="Frame rate:").grid(row=8,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=fr,width=6).grid(row=8,column=1,sticky=W)
+    pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
+    pbar['value']=0.0
+    pbtxt=Label(win,text="--")
+    btn=Button(win, text='Start calculation', command=step)
+    btn.grid(row=9,column=0,sticky=W,padx=10)
+    pbar.grid(row=9,column=1,sticky=W)
+    pbtxt.grid(row=9,column=2,sticky=W,columnspan=3)
+
+#extracts the moving windows of the source and delayed target series
+def window_stack(vals,starttimes,wlenval,delayval):
+    """Stacks the moving windows of a (n_chans,n_times) recording.
+    Returns the source windows vals[:,s:s+wlenval] and the target windows
+    vals[:,s+delayval:s+delayval+wlenval] for every s in starttimes, each as an
+    array of shape (len(starttimes),n_chans,wlenval)."""
+    idx=np.asarray(starttimes,dtype=int)[:,None]+np.arange(wlenval)
+    x=np.transpose(vals[:,idx],(1,0,2))
+    y=np.transpose(vals[:,idx+delayval],(1,0,2))
+    return x,y
+
+#spearman correlation of every moving window
+def windowed_spearman(vals,starttimes,wlenval,delayval,block=64):
+    """Spearman-based dynamic functional connectivity of one recording.
+    Every window is ranked once per channel (source and delayed target
+    separately), and windows are processed in blocks to bound memory.
+    Parameters
+    ----------
+    vals : np.array
+        Array of shape (n_chans,n_times).
+    starttimes : np.array
+        First sample of each moving window.
+    wlenval : int
+        Window length, in samples.
+    delayval : int
+        Transmission delay, in samples.
+    block : int
+        Number of windows ranked together.
+    Returns
+    -------
+    dfc : np.array
+        Array of shape (len(starttimes),n_chans,n_chans).
+    """
+    dfc=np.empty((len(starttimes),vals.shape[0],vals.shape[0]),dtype=np.result_type(vals.dtype,np.float32))
+    for b in range(0,len(starttimes),block):
+        x,y=window_stack(vals,starttimes[b:b+block],wlenval,delayval)
+        dfc[b:b+block]=lagged_spearman(x,y)
+    return dfc
 
 #spearman correlation based dynamic functional connectivity
 def spearman_dfc():
@@ -3596,309 +6092,118 @@ def spearman_dfc():
     fr=StringVar()
     fr.set("5")
     error=make_x()
-    if (error==1) and (raw1 is None):
-        Label(win,text="ERROR\nIt is required at least\n1 preprocessed or raw data",justify=CENTER).grid(row=0,column=0,padx=10,pady=10)        
-        Button(win,text="OK",command=win.destroy).grid(row=1,column=0,padx=10)
-    else:
-        def step():
-            if (int(delay.get())>=0) and (int(wlen.get())>0) and (int(fr.get())>0):
-                error2=0
-                if (raw_or_epoch.get()==2) and (error==1):
-                    showinfo(title="Error",message="To work with epochs it is\nnecessary to have at\nleast 1 preprocessed data")
-                    error2=1
-                elif (raw_or_epoch.get()==1) and (raw1 is None):
-                    showinfo(title="Error",message="To work with raw it is\nnecessary to have loaded at\nleast 1 raw EDF file")
-                    error2=1
-                elif raw_or_epoch.get()==1:
-                    n_chans=len(xraw1.ch_names)
-                    delayval=int(float(delay.get())*xraw1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*xraw1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*xraw1.info['sfreq']/1000)
-                    vals1=xraw1.get_data()
-                    starttimes1=np.arange(0,vals1.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    dfc1=np.empty((len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if xraw2 is not None:
-                        vals2=xraw2.get_data()
-                        starttimes2=np.arange(0,vals2.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        dfc2=np.empty((len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                maxrounds+=1
-                            if xraw2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    maxrounds+=1
-                    k=0                
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/maxrounds
-                                pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                key_idx=0
-                                dfc1[m1,i,j]=spearmanr(vals1[i,starttimes1[m1]:endtimes1[m1]],vals1[j,starttimes1[m1]+delayval:endtimes1[m1]+delayval]).correlation
-                            if xraw2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/maxrounds
-                                    pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                    key_idx=0
-                                    dfc2[m2,i,j]=spearmanr(vals2[i,starttimes2[m2]:endtimes2[m2]],vals2[j,starttimes2[m2]+delayval:endtimes2[m2]+delayval]).correlation                                   
-                elif raw_or_epoch.get()==2:
-                    n_chans=len(x1.ch_names)
-                    delayval=int(float(delay.get())*x1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*x1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*x1.info['sfreq']/1000)
-                    vals1=x1.get_data()[int(sel_epoch1.get()),:,:]
-                    starttimes1=np.arange(0,vals1.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    dfc1=np.empty((len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if x2 is not None:
-                        vals2=x2.get_data()[int(sel_epoch2.get()),:,:]
-                        starttimes2=np.arange(0,vals2.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        dfc2=np.empty((len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                maxrounds+=1
-                            if x2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    maxrounds+=1
-                    k=0                
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/maxrounds
-                                pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                key_idx=0
-                                dfc1[m1,i,j]=spearmanr(vals1[i,starttimes1[m1]:endtimes1[m1]],vals1[j,starttimes1[m1]+delayval:endtimes1[m1]+delayval]).correlation
-                            if x2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/maxrounds
-                                    pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                    key_idx=0
-                                    dfc2[m2,i,j]=spearmanr(vals2[i,starttimes2[m2]:endtimes2[m2]],vals2[j,starttimes2[m2]+delayval:endtimes2[m2]+delayval]).correlation                                    
-                elif raw_or_epoch.get()==3:
-                    event_names=list(event_dict.keys())
-                    n_chans=len(x1.ch_names)
-                    delayval=int(float(delay.get())*x1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*x1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*x1.info['sfreq']/1000)
-                    vals1=[]
-                    n_epochs1=[]
-                    for i in range(len(event_names)):
-                        vals1.append(x1[event_names[i]].get_data())
-                        n_epochs1.append(vals1[i].shape[0])
-                    starttimes1=np.arange(0,vals1[0].shape[2]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    tdfc1=[]
-                    for i in range(len(event_names)):
-                        tdfc1.append(np.empty((n_epochs1[i],len(starttimes1),n_chans,n_chans)))
-                        tdfc1[i].fill(np.nan)
-                    dfc1=np.empty((len(event_names),len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if x2 is not None:
-                        vals2=[]
-                        n_epochs2=[]
-                        for i in range(len(event_names)):
-                            vals2.append(x2[event_names[i]].get_data())
-                            n_epochs2.append(vals2[i].shape[0])
-                        starttimes2=np.arange(0,vals2[0].shape[2]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        tdfc2=[]
-                        for i in range(len(event_names)):
-                            tdfc2.append(np.empty((n_epochs2[i],len(starttimes1),n_chans,n_chans)))
-                            tdfc2[i].fill(np.nan)
-                        dfc2=np.empty((len(event_names),len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    for e1 in range(n_epochs1[ev]):
-                                        maxrounds+=1
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        for e2 in range(n_epochs2[ev]):
-                                            maxrounds+=1
-                    k=0                
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    for e1 in range(n_epochs1[ev]):
-                                        win.update_idletasks()
-                                        win.update()
-                                        k+=1
-                                        pbar['value'] += 100/maxrounds
-                                        pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                        key_idx=0
-                                        tdfc1[ev][e1,m1,i,j]=spearmanr(vals1[ev][e1,i,int(starttimes1[m1]):int(endtimes1[m1])],vals1[ev][e1,j,int(starttimes1[m1])+delayval:int(endtimes1[m1])+delayval]).correlation
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        for e2 in range(n_epochs2[ev]):
-                                            win.update_idletasks()
-                                            win.update()
-                                            k+=1
-                                            pbar['value'] += 100/maxrounds
-                                            pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                            key_idx=0
-                                            tdfc2[ev][e2,m2,i,j]=spearmanr(vals2[ev][e2,i,starttimes2[m2]:endtimes2[m2]],vals2[ev][e2,j,starttimes2[m2]+delayval:endtimes2[m2]+delayval]).correlation
-                    pbtxt['text']="finishing, please wait"
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    dfc1[ev,m1,i,j]=np.nanmean(tdfc1[ev][:,m1,i,j])
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        dfc2[ev,m2,i,j]=np.nanmean(tdfc2[ev][:,m2,i,j])        
-                    pbtxt['text']="done!"
-                if error2==0:
-                    def make_film():
-                        winfilm=Toplevel(win)
-                        Label(winfilm,text="Make Dynamic Functional Connectivity animation").grid(row=0,column=0,padx=10,pady=10,columnspan=3)
-                        pbar2=Progressbar(winfilm,orient=HORIZONTAL,length=100,mode='determinate')
-                        pbar2['value']=0.0
-                        pbtxt2=Label(winfilm,text="--")
-                        def process_frames():
-                            if raw_or_epoch.get()==3:
-                                nocond2=0
-                                try:
-                                    n_frames=min(len(dfc1[0,:,0,0]),len(dfc2[0,:,0,0]))
-                                except:
-                                    n_frames=len(dfc1[0,:,0,0])
-                                    nocond2=1
-                                k=0
-                                os.mkdir('temp_DFC_frames')
-                                for frame in range(n_frames):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar2['value'] += 100/n_frames
-                                    pbtxt2['text']=f"{k:d}/{n_frames:d}"
-                                    y1=[]
-                                    if nocond2==1:
-                                        y2=None
-                                    else:
-                                        y2=[]
-                                    for ev in range(len(event_names)):
-                                        y1.append(pd.DataFrame(dfc1[ev,frame,:,:],index=x1.ch_names,columns=x1.ch_names))
-                                        if nocond2==0:
-                                            y2.append(pd.DataFrame(dfc2[ev,frame,:,:],index=x2.ch_names,columns=x2.ch_names))
-                                    make_frame(y1,y2,vmin=-1,vmax=1,color='bwr',lblttl='Spearman correlation',frttl=f'temp_DFC_frames/DFC_frame{frame:05d}.png')
-                                pbtxt2['text']="Finishing up"
-                                command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_frame%05d.png -pix_fmt yuv420p DFC_Spearman.mp4'
-                                os.system(command)
-                                shutil.rmtree('temp_DFC_frames')
-                                showinfo(title="Info",message="Video of DFC was saved as DFC_Spearman.mp4 at\n"+os.getcwd())
+    def step():
+        if (int(delay.get())>=0) and (int(wlen.get())>0) and (int(fr.get())>0):
+            error2=0
+            if (raw_or_epoch.get() in (2,3)) and (error==1):
+                showinfo(title="Error",message="To work with epochs it is\nnecessary to have at\nleast 1 preprocessed data")
+                error2=1
+            elif (raw_or_epoch.get() in (1,4)) and (raw1 is None):
+                showinfo(title="Error",message="To work with raw it is\nnecessary to have loaded at\nleast 1 raw EDF file")
+                error2=1
+            elif raw_or_epoch.get() in (1,4):
+                #chunk by chunk from the loaded recordings, or from their files with the same preprocessing
+                sources=[xraw1,xraw2] if raw_or_epoch.get()==1 else [open_preprocessed_stream(steps) for steps in raw_steps if steps is not None]
+                jobs=[partial(compute_stream_dfc,src,float(delay.get()),float(wlen.get()),float(woverlap.get()),'spearman',energy=raw_or_energy.get()==2,
+                              store=temp_dfc_store(raw_or_epoch.get()==4)) for src in sources if src is not None]
+            elif raw_or_epoch.get()==2:
+                jobs=[partial(compute_dfc,epoch_data(x1,int(sel_epoch1.get())),x1.info['sfreq'],float(delay.get()),float(wlen.get()),float(woverlap.get()),'spearman',store=temp_dfc_store())]
+                if x2 is not None:
+                    jobs.append(partial(compute_dfc,epoch_data(x2,int(sel_epoch2.get())),x2.info['sfreq'],float(delay.get()),float(wlen.get()),float(woverlap.get()),'spearman',store=temp_dfc_store()))
+            elif raw_or_epoch.get()==3:
+                event_names=list(event_dict.keys())
+                jobs=[partial(compute_epochs_dfc,x1,event_names,float(delay.get()),float(wlen.get()),float(woverlap.get()),'spearman',store=temp_dfc_store())]
+                if x2 is not None:
+                    jobs.append(partial(compute_epochs_dfc,x2,event_names,float(delay.get()),float(wlen.get()),float(woverlap.get()),'spearman',store=temp_dfc_store()))
+            if error2==0:
+                results=run_task(win,pbar,pbtxt,jobs)
+                if results is None:
+                    return
+                dfc1=results[0]
+                if len(results)>1:
+                    dfc2=results[1]
+                def make_film():
+                    winfilm=Toplevel(win)
+                    Label(winfilm,text="Make Dynamic Functional Connectivity animation").grid(row=0,column=0,padx=10,pady=10,columnspan=3)
+                    pbar2=Progressbar(winfilm,orient=HORIZONTAL,length=100,mode='determinate')
+                    pbar2['value']=0.0
+                    pbtxt2=Label(winfilm,text="--")
+                    n_render=StringVar()
+                    n_render.set(str(os.cpu_count()))
+                    def process_frames():
+                        y2=results[1] if len(results)>1 else None
+                        if raw_or_epoch.get()==3:
+                            fname=fd.asksaveasfilename(title="Video of DFC",initialfile="DFC_Spearman.mp4",defaultextension=".mp4",filetypes=(("MP4 video", "*.mp4"),("All Files", "*.*")))
+                            if not fname:
+                                return
+                            fnames=[fname]
+                            jobs=[partial(render_dfc_video,fname,dfc1,y2,x1.ch_names,event_names,None if y2 is None else [cond1_name.get(),cond2_name.get()],fps=int(fr.get()),
+                                          vmin=-1,vmax=1,color='bwr',lblttl='Spearman correlation',n_jobs=int(n_render.get()))]
+                        else:
+                            if raw_or_epoch.get()==4:
+                                ch_names=dfc1['meta']['ch_names']
                             else:
-                                nocond2=0
-                                n_frames1=len(dfc1[:,0,0])
-                                total_frames=n_frames1
-                                if raw_or_epoch.get()==2:
-                                    ch_names=x1.ch_names
-                                else:
-                                    ch_names=xraw1.ch_names
-                                try:
-                                    n_frames2=len(dfc2[:,0,0])
-                                    total_frames+=n_frames2
-                                except:
-                                    nocond2=1
-                                k=0
-                                os.mkdir('temp_DFC_frames')
-                                for frame in range(n_frames1):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar2['value'] += 100/total_frames
-                                    pbtxt2['text']=f"{k:d}/{total_frames:d}"
-                                    y1=pd.DataFrame(dfc1[frame,:,:],index=ch_names,columns=ch_names)
-                                    make_frame2(y1,vmin=-1,vmax=1,color='bwr',lblttl='Spearman correlation',frttl=f'temp_DFC_frames/DFC_{cond1_name.get()}_frame{frame:05d}.png')
-                                if nocond==0:
-                                    for frame in range(n_frames2):
-                                        win.update_idletasks()
-                                        win.update()
-                                        k+=1
-                                        pbar2['value'] += 100/total_frames
-                                        pbtxt2['text']=f"{k:d}/{total_frames:d}"
-                                        y2=pd.DataFrame(dfc2[frame,:,:],index=ch_names,columns=ch_names)
-                                        make_frame2(y2,vmin=-1,vmax=1,color='bwr',lblttl='Spearman correlation',frttl=f'temp_DFC_frames/DFC_{cond2_name.get()}_frame{frame:05d}.png')
-                                pbtxt2['text']="Finishing up"
-                                command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_{cond1_name.get()}_frame%05d.png -pix_fmt yuv420p DFC_{cond1_name.get()}_Spearman.mp4'
-                                os.system(command)
-                                if nocond==0:
-                                    command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_{cond2_name.get()}_frame%05d.png -pix_fmt yuv420p DFC_{cond2_name.get()}_Spearman.mp4'
-                                    os.system(command)
-                                shutil.rmtree('temp_DFC_frames')
-                                if nocond==0:
-                                    showinfo(title="Info",message="Videos of DFC were saved as\nDFC_{cond1_name.get()}_Spearman.mp4 and DFC_{cond1_name.get()}_Spearman.mp4 at\n"+os.getcwd())
-                                else:
-                                    showinfo(title="Info",message="Video of DFC were saved as\nDFC_{cond1_name.get()}_Spearman.mp4 at\n"+os.getcwd())
-                            winfilm.destroy()
-                        btn2=Button(winfilm, text='Create video', command=process_frames)
-                        btn2.grid(row=1,column=0,sticky=W,padx=10)
-                        pbar2.grid(row=1,column=1,sticky=W)
-                        pbtxt2.grid(row=1,column=2,sticky=W)
-                    def save_corr():
-                        showinfo(title="Info",message="The full results will be saved as a\nNumpy array of size (n_times,n_chans,n_chans))")
-                        fname1 = fd.asksaveasfilename(title="Spearman correlation DFC condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
-                        np.save(fname1,dfc1)
-                        if (x2 is not None) or (raw2 is not None):
-                            fname2 = fd.asksaveasfilename(title="Spearman correlation DFC condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
-                            np.save(fname2,dfc2)
-                    Button(win,text="Save results",command=save_corr).grid(row=10,column=0,padx=10,sticky=W)
-                    Button(win,text="Make DFC animations",command=make_film).grid(row=11,column=0,padx=10,sticky=W)
-                    Button(win,text="Close",command=win.destroy).grid(row=12,column=0,padx=10,pady=10,columnspan=5)
-            else:
-                showinfo(title="Error",message="Delay, window length and frame rate must be positive numbers")
-        Label(win,text="Calculate correlations").grid(row=0,column=0,columnspan=4,padx=10,pady=10)
-        Label(win,text="Calculate from:").grid(row=1,column=0,padx=10,sticky=W)
-        Radiobutton(win,text="From raw EEG",variable=raw_or_epoch,value=1).grid(row=1,column=1,sticky=W)
-        Radiobutton(win,text="From epoch:",variable=raw_or_epoch,value=2).grid(row=2,column=1,sticky=W)
-        Entry(win,textvariable=sel_epoch1,width=2).grid(row=2,column=2,sticky=W)
-        Label(win,text=f"for {cond1_name.get()}").grid(row=2,column=3,sticky=W)
-        Entry(win,textvariable=sel_epoch2,width=2).grid(row=3,column=2,sticky=W)
-        Label(win,text=f"for {cond2_name.get()}").grid(row=3,column=3,sticky=W)
-        Radiobutton(win,text="Average of results of all epochs",variable=raw_or_epoch,value=3).grid(row=4,column=1,sticky=W,columnspan=3)
-        Label(win,text="Transmission delay between brain regions (ms):").grid(row=5,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=delay,width=4).grid(row=5,column=1,sticky=W)
-        Label(win,text="Moving window length (ms):").grid(row=6,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=wlen,width=6).grid(row=6,column=1,sticky=W)
-        Label(win,text="Moving window overlap (ms):").grid(row=7,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=woverlap,width=6).grid(row=7,column=1,sticky=W)
-        Label(win,text="Frame rate:").grid(row=8,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=fr,width=6).grid(row=8,column=1,sticky=W)
-        pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
-        pbar['value']=0.0
-        pbtxt=Label(win,text="--")
-        btn=Button(win, text='Start calculation', command=step)
-        btn.grid(row=9,column=0,sticky=W,padx=10)
-        pbar.grid(row=9,column=1,sticky=W)
-        pbtxt.grid(row=9,column=2,sticky=W,columnspan=3)
+                                ch_names=x1.ch_names if raw_or_epoch.get()==2 else xraw1.ch_names
+                            fnames=[]
+                            jobs=[]
+                            for y,cond in ((dfc1,cond1_name.get()),(y2,cond2_name.get())):
+                                if y is None:
+                                    continue
+                                fname=fd.asksaveasfilename(title="Video of DFC condition "+cond,initialfile=f"DFC_{cond}_Spearman.mp4",defaultextension=".mp4",filetypes=(("MP4 video", "*.mp4"),("All Files", "*.*")))
+                                if not fname:
+                                    return
+                                fnames.append(fname)
+                                jobs.append(partial(render_dfc_video,fname,y,None,ch_names,fps=int(fr.get()),vmin=-1,vmax=1,color='bwr',lblttl='Spearman correlation',n_jobs=int(n_render.get())))
+                        if run_task(winfilm,pbar2,pbtxt2,jobs,title="Rendering frames") is None:
+                            return
+                        if len(fnames)>1:
+                            showinfo(title="Info",message="Videos of DFC were saved as\n"+"\nand\n".join(fnames))
+                        else:
+                            showinfo(title="Info",message="Video of DFC was saved as\n"+fnames[0])
+                        winfilm.destroy()
+                    btn2=Button(winfilm, text='Create video', command=process_frames)
+                    btn2.grid(row=1,column=0,sticky=W,padx=10)
+                    pbar2.grid(row=1,column=1,sticky=W)
+                    pbtxt2.grid(row=1,column=2,sticky=W)
+                    Label(winfilm,text="Number of processes:").grid(row=2,column=0,padx=10,pady=(0,10),sticky=W)
+                    Entry(winfilm,textvariable=n_render,width=3).grid(row=2,column=1,pady=(0,10),sticky=W)
+                def save_corr():
+                    showinfo(title="Info",message="The full results will be saved as a\nNumpy array of size (n_times,n_chans,n_chans))")
+                    fname1 = fd.asksaveasfilename(title="Spearman correlation DFC condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                    save_dfc(fname1,dfc1)
+                    if len(results)>1:
+                        fname2 = fd.asksaveasfilename(title="Spearman correlation DFC condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                        save_dfc(fname2,dfc2)
+                Button(win,text="Save results",command=save_corr).grid(row=10,column=0,padx=10,sticky=W)
+                Button(win,text="Make DFC animations",command=make_film).grid(row=11,column=0,padx=10,sticky=W)
+                Button(win,text="Close",command=win.destroy).grid(row=12,column=0,padx=10,pady=10,columnspan=5)
+        else:
+            showinfo(title="Error",message="Delay, window length and frame rate must be positive numbers")
+    Label(win,text="Calculate correlations").grid(row=0,column=0,columnspan=4,padx=10,pady=10)
+    Label(win,text="Calculate from:").grid(row=1,column=0,padx=10,sticky=W)
+    Radiobutton(win,text="From raw EEG",variable=raw_or_epoch,value=1).grid(row=1,column=1,sticky=W)
+    Radiobutton(win,text="Stream raw EEG from its EDF file on disk\n(same preprocessing, long recordings)",variable=raw_or_epoch,value=4).grid(row=1,column=2,sticky=W,columnspan=3)
+    Radiobutton(win,text="From epoch:",variable=raw_or_epoch,value=2).grid(row=2,column=1,sticky=W)
+    Entry(win,textvariable=sel_epoch1,width=2).grid(row=2,column=2,sticky=W)
+    Label(win,text=f"for {cond1_name.get()}").grid(row=2,column=3,sticky=W)
+    Entry(win,textvariable=sel_epoch2,width=2).grid(row=3,column=2,sticky=W)
+    Label(win,text=f"for {cond2_name.get()}").grid(row=3,column=3,sticky=W)
+    Radiobutton(win,text="Average of results of all epochs",variable=raw_or_epoch,value=3).grid(row=4,column=1,sticky=W,columnspan=3)
+    Label(win,text="Transmission delay between brain regions (ms):").grid(row=5,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=delay,width=4).grid(row=5,column=1,sticky=W)
+    Label(win,text="Moving window length (ms):").grid(row=6,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=wlen,width=6).grid(row=6,column=1,sticky=W)
+    Label(win,text="Moving window overlap (ms):").grid(row=7,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=woverlap,width=6).grid(row=7,column=1,sticky=W)
+    Label(win,text="Frame rate:").grid(row=8,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=fr,width=6).grid(row=8,column=1,sticky=W)
+    pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
+    pbar['value']=0.0
+    pbtxt=Label(win,text="--")
+    btn=Button(win, text='Start calculation', command=step)
+    btn.grid(row=9,column=0,sticky=W,padx=10)
+    pbar.grid(row=9,column=1,sticky=W)
+    pbtxt.grid(row=9,column=2,sticky=W,columnspan=3)
 
 #transfer entropy based dynamic functional connectivity
 def te_dfc():
@@ -3933,366 +6238,155 @@ def te_dfc():
     tau.set('1')
     unit=StringVar()
     optionlist=['bits','nat','ban']
+    n_proc=StringVar()
+    n_proc.set(str(os.cpu_count()))
     fr=StringVar()
     fr.set("5")
     error=make_x()
-    if (error==1) and (raw1 is None):
-        Label(win,text="ERROR\nIt is required at least\n1 preprocessed or raw data",justify=CENTER).grid(row=0,column=0,padx=10,pady=10)        
-        Button(win,text="OK",command=win.destroy).grid(row=1,column=0,padx=10)
-    else:
+    if eeg1 is not None:
         xdiv_vals.set(f'{np.quantile(eeg1.get_data(),0.2)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.4)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.6)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.8)*10**6:.2f}')
         ydiv_vals.set(f'{np.quantile(eeg1.get_data(),0.2)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.4)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.6)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.8)*10**6:.2f}')
-        def step():
-            if (int(delay.get())>=0) and (int(wlen.get())>0) and (int(fr.get())>0):
-                error2=0
-                if div_type.get()==1:
-                    symb_type='equal-divs'
-                    x_divs,y_divs=None,None
-                elif div_type.get()==2:
-                    symb_type='equal-points'
-                    x_divs,y_divs=None,None
-                elif div_type.get()==3:
-                    x_divs=[float(i)*10**-6 for i in xdiv_vals.get().split(sep=',')]
-                    y_divs=[float(i)*10**-6 for i in ydiv_vals.get().split(sep=',')]
-                    symb_type=None
-                if (raw_or_epoch.get()==2) and (error==1):
-                    showinfo(title="Error",message="To work with epochs it is\nnecessary to have at\nleast 1 preprocessed data")
-                    error2=1
-                elif (raw_or_epoch.get()==1) and (raw1 is None):
-                    showinfo(title="Error",message="To work with raw it is\nnecessary to have loaded at\nleast 1 raw EDF file")
-                    error2=1
-                elif raw_or_epoch.get()==1:
-                    n_chans=len(xraw1.ch_names)
-                    delayval=int(float(delay.get())*xraw1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*xraw1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*xraw1.info['sfreq']/1000)
-                    vals1=xraw1.get_data()
-                    starttimes1=np.arange(0,vals1.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    dfc1=np.empty((len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if xraw2 is not None:
-                        vals2=xraw2.get_data()
-                        starttimes2=np.arange(0,vals2.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        dfc2=np.empty((len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                maxrounds+=1
-                            if xraw2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    maxrounds+=1
-                    k=0                
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/maxrounds
-                                pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                key_idx=0
-                                dfc1[m1,i,j]=transfer_entropy(vals1[i,starttimes1[m1]:endtimes1[m1]],vals1[j,starttimes1[m1]+delayval:endtimes1[m1]+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                            if xraw2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/maxrounds
-                                    pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                    key_idx=0
-                                    dfc2[m2,i,j]=transfer_entropy(vals2[i,starttimes2[m2]:endtimes2[m2]],vals2[j,starttimes2[m2]+delayval:endtimes2[m2]+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())                                   
-                elif raw_or_epoch.get()==2:
-                    n_chans=len(x1.ch_names)
-                    delayval=int(float(delay.get())*x1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*x1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*x1.info['sfreq']/1000)
-                    vals1=x1.get_data()[int(sel_epoch1.get()),:,:]
-                    starttimes1=np.arange(0,vals1.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    dfc1=np.empty((len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if x2 is not None:
-                        vals2=x2.get_data()[int(sel_epoch2.get()),:,:]
-                        starttimes2=np.arange(0,vals2.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        dfc2=np.empty((len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                maxrounds+=1
-                            if x2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    maxrounds+=1
-                    k=0                
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/maxrounds
-                                pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                key_idx=0
-                                dfc1[m1,i,j]=transfer_entropy(vals1[i,starttimes1[m1]:endtimes1[m1]],vals1[j,starttimes1[m1]+delayval:endtimes1[m1]+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                            if x2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/maxrounds
-                                    pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                    key_idx=0
-                                    dfc2[m2,i,j]=transfer_entropy(vals2[i,starttimes2[m2]:endtimes2[m2]],vals2[j,starttimes2[m2]+delayval:endtimes2[m2]+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())                                    
-                elif raw_or_epoch.get()==3:
-                    event_names=list(event_dict.keys())
-                    n_chans=len(x1.ch_names)
-                    delayval=int(float(delay.get())*x1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*x1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*x1.info['sfreq']/1000)
-                    vals1=[]
-                    n_epochs1=[]
-                    for i in range(len(event_names)):
-                        vals1.append(x1[event_names[i]].get_data())
-                        n_epochs1.append(vals1[i].shape[0])
-                    starttimes1=np.arange(0,vals1[0].shape[2]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    tdfc1=[]
-                    for i in range(len(event_names)):
-                        tdfc1.append(np.empty((n_epochs1[i],len(starttimes1),n_chans,n_chans)))
-                        tdfc1[i].fill(np.nan)
-                    dfc1=np.empty((len(event_names),len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if x2 is not None:
-                        vals2=[]
-                        n_epochs2=[]
-                        for i in range(len(event_names)):
-                            vals2.append(x2[event_names[i]].get_data())
-                            n_epochs2.append(vals2[i].shape[0])
-                        starttimes2=np.arange(0,vals2[0].shape[2]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        tdfc2=[]
-                        for i in range(len(event_names)):
-                            tdfc2.append(np.empty((n_epochs2[i],len(starttimes1),n_chans,n_chans)))
-                            tdfc2[i].fill(np.nan)
-                        dfc2=np.empty((len(event_names),len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    for e1 in range(n_epochs1[ev]):
-                                        maxrounds+=1
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        for e2 in range(n_epochs2[ev]):
-                                            maxrounds+=1
-                    k=0                
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    for e1 in range(n_epochs1[ev]):
-                                        win.update_idletasks()
-                                        win.update()
-                                        k+=1
-                                        pbar['value'] += 100/maxrounds
-                                        pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                        key_idx=0
-                                        tdfc1[ev][e1,m1,i,j]=transfer_entropy(vals1[ev][e1,i,int(starttimes1[m1]):int(endtimes1[m1])],vals1[ev][e1,j,int(starttimes1[m1])+delayval:int(endtimes1[m1])+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        for e2 in range(n_epochs2[ev]):
-                                            win.update_idletasks()
-                                            win.update()
-                                            k+=1
-                                            pbar['value'] += 100/maxrounds
-                                            pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                            key_idx=0
-                                            tdfc2[ev][e2,m2,i,j]=transfer_entropy(vals2[ev][e2,i,int(starttimes2[m2]):int(endtimes2[m2])],vals2[ev][e2,j,int(starttimes2[m2])+delayval:int(endtimes2[m2])+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                    pbtxt['text']="finishing, please wait"
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    dfc1[ev,m1,i,j]=np.nanmean(tdfc1[ev][:,m1,i,j])
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        dfc2[ev,m2,i,j]=np.nanmean(tdfc2[ev][:,m2,i,j])        
-                    pbtxt['text']="done!"
-                if error2==0:
-                    def make_film():
-                        winfilm=Toplevel(win)
-                        Label(winfilm,text="Make Dynamic Functional Connectivity animation").grid(row=0,column=0,padx=10,pady=10,columnspan=3)
-                        pbar2=Progressbar(winfilm,orient=HORIZONTAL,length=100,mode='determinate')
-                        pbar2['value']=0.0
-                        pbtxt2=Label(winfilm,text="--")
-                        def process_frames():
-                            if raw_or_epoch.get()==3:
-                                nocond2=0
-                                try:
-                                    n_frames=min(len(dfc1[0,:,0,0]),len(dfc2[0,:,0,0]))
-                                except:
-                                    n_frames=len(dfc1[0,:,0,0])
-                                    nocond2=1
-                                k=0
-                                os.mkdir('temp_DFC_frames')
-                                for frame in range(n_frames):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar2['value'] += 100/n_frames
-                                    pbtxt2['text']=f"{k:d}/{n_frames:d}"
-                                    y1=[]
-                                    if nocond2==1:
-                                        y2=None
-                                    else:
-                                        y2=[]
-                                    maxte=0
-                                    for ev in range(len(event_names)):
-                                        y1.append(pd.DataFrame(dfc1[ev,frame,:,:],index=x1.ch_names,columns=x1.ch_names))
-                                        maxte=max(maxte,y1[ev].max().max())
-                                        if nocond2==0:
-                                            y2.append(pd.DataFrame(dfc2[ev,frame,:,:],index=x2.ch_names,columns=x2.ch_names))
-                                            maxte=max(maxte,y2[ev].max().max())
-                                    make_frame(y1,y2,vmin=0,vmax=maxte,color='Reds',lblttl='Transfer entropy',frttl=f'temp_DFC_frames/DFC_frame{frame:05d}.png')
-                                pbtxt2['text']="Finishing up"
-                                command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_frame%05d.png -pix_fmt yuv420p DFC_Transfer_Entropy.mp4'
-                                os.system(command)
-                                shutil.rmtree('temp_DFC_frames')
-                                showinfo(title="Info",message="Video of DFC was saved as DFC_Transfer_Entropy.mp4 at\n"+os.getcwd())
+    def step():
+        if (int(delay.get())>=0) and (int(wlen.get())>0) and (int(fr.get())>0):
+            error2=0
+            symb_type,x_divs,y_divs=symbolization_args(div_type.get(),xdiv_vals.get(),ydiv_vals.get())
+            if (raw_or_epoch.get() in (2,3)) and (error==1):
+                showinfo(title="Error",message="To work with epochs it is\nnecessary to have at\nleast 1 preprocessed data")
+                error2=1
+            elif (raw_or_epoch.get() in (1,4)) and (raw1 is None):
+                showinfo(title="Error",message="To work with raw it is\nnecessary to have loaded at\nleast 1 raw EDF file")
+                error2=1
+            elif raw_or_epoch.get() in (1,4):
+                #chunk by chunk from the loaded recordings, or from their files with the same preprocessing
+                sources=[xraw1,xraw2] if raw_or_epoch.get()==1 else [open_preprocessed_stream(steps) for steps in raw_steps if steps is not None]
+                jobs=[partial(compute_stream_dfc,src,float(delay.get()),float(wlen.get()),float(woverlap.get()),'te',energy=raw_or_energy.get()==2,n_jobs=int(n_proc.get()),
+                              store=temp_dfc_store(raw_or_epoch.get()==4),symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,
+                              symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),tau=int(tau.get()),units=unit.get()) for src in sources if src is not None]
+            elif raw_or_epoch.get()==2:
+                jobs=[partial(compute_dfc,epoch_data(x1,int(sel_epoch1.get())),x1.info['sfreq'],float(delay.get()),float(wlen.get()),float(woverlap.get()),'te',n_jobs=int(n_proc.get()),store=temp_dfc_store(),
+                      symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),tau=int(tau.get()),units=unit.get())]
+                if x2 is not None:
+                    jobs.append(partial(compute_dfc,epoch_data(x2,int(sel_epoch2.get())),x2.info['sfreq'],float(delay.get()),float(wlen.get()),float(woverlap.get()),'te',n_jobs=int(n_proc.get()),store=temp_dfc_store(),
+                                symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),tau=int(tau.get()),units=unit.get()))
+            elif raw_or_epoch.get()==3:
+                event_names=list(event_dict.keys())
+                jobs=[partial(compute_epochs_dfc,x1,event_names,float(delay.get()),float(wlen.get()),float(woverlap.get()),'te',n_jobs=int(n_proc.get()),store=temp_dfc_store(),
+                      symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),tau=int(tau.get()),units=unit.get())]
+                if x2 is not None:
+                    jobs.append(partial(compute_epochs_dfc,x2,event_names,float(delay.get()),float(wlen.get()),float(woverlap.get()),'te',n_jobs=int(n_proc.get()),store=temp_dfc_store(),
+                                symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,symbolic_length=(int(lxp.get()),int(lyp.get()),int(lyf.get())),tau=int(tau.get()),units=unit.get()))
+            if error2==0:
+                results=run_task(win,pbar,pbtxt,jobs)
+                if results is None:
+                    return
+                dfc1=results[0]
+                if len(results)>1:
+                    dfc2=results[1]
+                def make_film():
+                    winfilm=Toplevel(win)
+                    Label(winfilm,text="Make Dynamic Functional Connectivity animation").grid(row=0,column=0,padx=10,pady=10,columnspan=3)
+                    pbar2=Progressbar(winfilm,orient=HORIZONTAL,length=100,mode='determinate')
+                    pbar2['value']=0.0
+                    pbtxt2=Label(winfilm,text="--")
+                    n_render=StringVar()
+                    n_render.set(str(os.cpu_count()))
+                    def process_frames():
+                        y2=results[1] if len(results)>1 else None
+                        if raw_or_epoch.get()==3:
+                            fname=fd.asksaveasfilename(title="Video of DFC",initialfile="DFC_Transfer_Entropy.mp4",defaultextension=".mp4",filetypes=(("MP4 video", "*.mp4"),("All Files", "*.*")))
+                            if not fname:
+                                return
+                            fnames=[fname]
+                            jobs=[partial(render_dfc_video,fname,dfc1,y2,x1.ch_names,event_names,None if y2 is None else [cond1_name.get(),cond2_name.get()],fps=int(fr.get()),
+                                          vmin=0,vmax=None,color='Reds',lblttl='Transfer entropy',n_jobs=int(n_render.get()))]
+                        else:
+                            if raw_or_epoch.get()==4:
+                                ch_names=dfc1['meta']['ch_names']
                             else:
-                                nocond2=0
-                                n_frames1=len(dfc1[:,0,0])
-                                total_frames=n_frames1
-                                if raw_or_epoch.get()==2:
-                                    ch_names=x1.ch_names
-                                else:
-                                    ch_names=xraw1.ch_names
-                                try:
-                                    n_frames2=len(dfc2[:,0,0])
-                                    total_frames+=n_frames2
-                                except:
-                                    nocond2=1
-                                k=0
-                                os.mkdir('temp_DFC_frames')
-                                for frame in range(n_frames1):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar2['value'] += 100/total_frames
-                                    pbtxt2['text']=f"{k:d}/{total_frames:d}"
-                                    y1=pd.DataFrame(dfc1[frame,:,:],index=ch_names,columns=ch_names)
-                                    make_frame2(y1,vmin=0,vmax=y1.max().max(),color='Reds',lblttl='Transfer Entropy',frttl=f'temp_DFC_frames/DFC_{cond1_name.get()}_frame{frame:05d}.png')
-                                if nocond==0:
-                                    for frame in range(n_frames2):
-                                        win.update_idletasks()
-                                        win.update()
-                                        k+=1
-                                        pbar2['value'] += 100/total_frames
-                                        pbtxt2['text']=f"{k:d}/{total_frames:d}"
-                                        y2=pd.DataFrame(dfc2[frame,:,:],index=ch_names,columns=ch_names)
-                                        make_frame2(y2,vmin=0,vmax=y2.max().max(),color='Reds',lblttl='Transfer Entropy',frttl=f'temp_DFC_frames/DFC_{cond2_name.get()}_frame{frame:05d}.png')
-                                pbtxt2['text']="Finishing up"
-                                command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_{cond1_name.get()}_frame%05d.png -pix_fmt yuv420p DFC_{cond1_name.get()}_Transfer_Entropy.mp4'
-                                os.system(command)
-                                if nocond==0:
-                                    command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_{cond2_name.get()}_frame%05d.png -pix_fmt yuv420p DFC_{cond2_name.get()}_Transfer_Entropy.mp4'
-                                    os.system(command)
-                                shutil.rmtree('temp_DFC_frames')
-                                if nocond==0:
-                                    showinfo(title="Info",message="Videos of DFC were saved as\nDFC_{cond1_name.get()}_Transfer_Entropy.mp4 and DFC_{cond1_name.get()}_Transfer_Entropy.mp4 at\n"+os.getcwd())
-                                else:
-                                    showinfo(title="Info",message="Video of DFC were saved as\nDFC_{cond1_name.get()}_Transfer_Entropy.mp4 at\n"+os.getcwd())
-                            winfilm.destroy()
-                        btn2=Button(winfilm, text='Create video', command=process_frames)
-                        btn2.grid(row=1,column=0,sticky=W,padx=10)
-                        pbar2.grid(row=1,column=1,sticky=W)
-                        pbtxt2.grid(row=1,column=2,sticky=W)
-                    def save_corr():
-                        showinfo(title="Info",message="The full results will be saved as a\nNumpy array of size (n_times,n_chans,n_chans))")
-                        fname1 = fd.asksaveasfilename(title="Transfer Entropy DFC condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
-                        np.save(fname1,dfc1)
-                        if (x2 is not None) or (raw2 is not None):
-                            fname2 = fd.asksaveasfilename(title="Transfer Entropy DFC condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
-                            np.save(fname2,dfc2)
-                    Button(win,text="Save results",command=save_corr).grid(row=20,column=0,padx=10,sticky=W)
-                    Button(win,text="Make DFC animations",command=make_film).grid(row=21,column=0,padx=10,sticky=W)
-                    Button(win,text="Close",command=win.destroy).grid(row=22,column=0,padx=10,pady=10,columnspan=5)
-            else:
-                showinfo(title="Error",message="Delay, window length and frame rate must be positive numbers")
-        Label(win,text="Calculate transfer entropy").grid(row=0,column=0,columnspan=4,padx=10,pady=10)
-        Label(win,text="Calculate from:").grid(row=1,column=0,padx=10,sticky=W)
-        Radiobutton(win,text="From raw EEG",variable=raw_or_epoch,value=1).grid(row=1,column=1,sticky=W)
-        Radiobutton(win,text="From epoch:",variable=raw_or_epoch,value=2).grid(row=2,column=1,sticky=W)
-        Entry(win,textvariable=sel_epoch1,width=2).grid(row=2,column=2,sticky=W)
-        Label(win,text=f"for {cond1_name.get()}").grid(row=2,column=3,sticky=W)
-        Entry(win,textvariable=sel_epoch2,width=2).grid(row=3,column=2,sticky=W)
-        Label(win,text=f"for {cond2_name.get()}").grid(row=3,column=3,sticky=W)
-        Radiobutton(win,text="Average of results of all epochs",variable=raw_or_epoch,value=3).grid(row=4,column=1,sticky=W,columnspan=3)
-        Label(win,text="Transmission delay between brain regions (ms):").grid(row=5,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=delay,width=4).grid(row=5,column=1,sticky=W)
-        Label(win,text="Number of symbols (partition divisions):").grid(row=6,column=0,sticky=W,padx=10)
-        Entry(win,textvariable=ns,width=3).grid(row=6,column=1,sticky=W)
-        Label(win,text="Partition divisions:").grid(row=7,column=0,sticky=W,padx=10)
-        Radiobutton(win,text="equal-sized divisions",variable=div_type,value=1).grid(row=7,column=1,sticky=W)
-        Radiobutton(win,text="divisions with same number of points",variable=div_type,value=2).grid(row=8,column=1,columnspan=4,sticky=W)
-        Radiobutton(win,text="other (separate with commas):",variable=div_type,value=3).grid(row=9,column=1,sticky=W)
-        Label(win,text=u" X divisions (\u03bcV):").grid(row=9,column=2,sticky=W)
-        Entry(win,textvariable=xdiv_vals,width=20).grid(row=9,column=3,sticky=W)
-        Label(win,text=u" Y divisions (\u03bcV):").grid(row=10,column=2,sticky=W)
-        Entry(win,textvariable=ydiv_vals,width=20).grid(row=10,column=3,sticky=W)
-        Label(win,text="Symbolic length:").grid(row=11,column=0,sticky=W,padx=10)
-        Label(win,text="Past of X:").grid(row=11,column=1,sticky=W)
-        Entry(win,textvariable=lxp,width=3).grid(row=11,column=2,sticky=W)
-        Label(win,text="Past of Y:").grid(row=12,column=1,sticky=W)
-        Entry(win,textvariable=lyp,width=3).grid(row=12,column=2,sticky=W)
-        Label(win,text="Future of Y:").grid(row=13,column=1,sticky=W)
-        Entry(win,textvariable=lyf,width=3).grid(row=13,column=2,sticky=W)
-        Label(win,text="Tau:").grid(row=14,column=0,sticky=W,padx=10)
-        Entry(win,textvariable=tau,width=3).grid(row=14,column=1,sticky=W)
-        Label(win,text="Units:").grid(row=15,column=0,sticky=W,padx=10)
-        OptionMenu(win,unit,*optionlist).grid(row=15,column=1,sticky=W)
-        Label(win,text="Moving window length (ms):").grid(row=16,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=wlen,width=6).grid(row=16,column=1,sticky=W)
-        Label(win,text="Moving window overlap (ms):").grid(row=17,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=woverlap,width=6).grid(row=17,column=1,sticky=W)
-        Label(win,text="Frame rate:").grid(row=18,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=fr,width=6).grid(row=18,column=1,sticky=W)
-        pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
-        pbar['value']=0.0
-        pbtxt=Label(win,text="--")
-        btn=Button(win, text='Start calculation', command=step)
-        btn.grid(row=19,column=0,sticky=W,padx=10)
-        pbar.grid(row=19,column=1,sticky=W)
-        pbtxt.grid(row=19,column=2,sticky=W,columnspan=3)
+                                ch_names=x1.ch_names if raw_or_epoch.get()==2 else xraw1.ch_names
+                            fnames=[]
+                            jobs=[]
+                            for y,cond in ((dfc1,cond1_name.get()),(y2,cond2_name.get())):
+                                if y is None:
+                                    continue
+                                fname=fd.asksaveasfilename(title="Video of DFC condition "+cond,initialfile=f"DFC_{cond}_Transfer_Entropy.mp4",defaultextension=".mp4",filetypes=(("MP4 video", "*.mp4"),("All Files", "*.*")))
+                                if not fname:
+                                    return
+                                fnames.append(fname)
+                                jobs.append(partial(render_dfc_video,fname,y,None,ch_names,fps=int(fr.get()),vmin=0,vmax=None,color='Reds',lblttl='Transfer entropy',n_jobs=int(n_render.get())))
+                        if run_task(winfilm,pbar2,pbtxt2,jobs,title="Rendering frames") is None:
+                            return
+                        if len(fnames)>1:
+                            showinfo(title="Info",message="Videos of DFC were saved as\n"+"\nand\n".join(fnames))
+                        else:
+                            showinfo(title="Info",message="Video of DFC was saved as\n"+fnames[0])
+                        winfilm.destroy()
+                    btn2=Button(winfilm, text='Create video', command=process_frames)
+                    btn2.grid(row=1,column=0,sticky=W,padx=10)
+                    pbar2.grid(row=1,column=1,sticky=W)
+                    pbtxt2.grid(row=1,column=2,sticky=W)
+                    Label(winfilm,text="Number of processes:").grid(row=2,column=0,padx=10,pady=(0,10),sticky=W)
+                    Entry(winfilm,textvariable=n_render,width=3).grid(row=2,column=1,pady=(0,10),sticky=W)
+                def save_corr():
+                    showinfo(title="Info",message="The full results will be saved as a\nNumpy array of size (n_times,n_chans,n_chans))")
+                    fname1 = fd.asksaveasfilename(title="Transfer Entropy DFC condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                    save_dfc(fname1,dfc1)
+                    if len(results)>1:
+                        fname2 = fd.asksaveasfilename(title="Transfer Entropy DFC condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                        save_dfc(fname2,dfc2)
+                Button(win,text="Save results",command=save_corr).grid(row=20,column=0,padx=10,sticky=W)
+                Button(win,text="Make DFC animations",command=make_film).grid(row=21,column=0,padx=10,sticky=W)
+                Button(win,text="Close",command=win.destroy).grid(row=22,column=0,padx=10,pady=10,columnspan=5)
+        else:
+            showinfo(title="Error",message="Delay, window length and frame rate must be positive numbers")
+    Label(win,text="Calculate transfer entropy").grid(row=0,column=0,columnspan=4,padx=10,pady=10)
+    Label(win,text="Calculate from:").grid(row=1,column=0,padx=10,sticky=W)
+    Radiobutton(win,text="From raw EEG",variable=raw_or_epoch,value=1).grid(row=1,column=1,sticky=W)
+    Radiobutton(win,text="Stream raw EEG from its EDF file on disk\n(same preprocessing, long recordings)",variable=raw_or_epoch,value=4).grid(row=1,column=2,sticky=W,columnspan=3)
+    Radiobutton(win,text="From epoch:",variable=raw_or_epoch,value=2).grid(row=2,column=1,sticky=W)
+    Entry(win,textvariable=sel_epoch1,width=2).grid(row=2,column=2,sticky=W)
+    Label(win,text=f"for {cond1_name.get()}").grid(row=2,column=3,sticky=W)
+    Entry(win,textvariable=sel_epoch2,width=2).grid(row=3,column=2,sticky=W)
+    Label(win,text=f"for {cond2_name.get()}").grid(row=3,column=3,sticky=W)
+    Radiobutton(win,text="Average of results of all epochs",variable=raw_or_epoch,value=3).grid(row=4,column=1,sticky=W,columnspan=3)
+    Label(win,text="Transmission delay between brain regions (ms):").grid(row=5,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=delay,width=4).grid(row=5,column=1,sticky=W)
+    Label(win,text="Number of symbols (partition divisions):").grid(row=6,column=0,sticky=W,padx=10)
+    Entry(win,textvariable=ns,width=3).grid(row=6,column=1,sticky=W)
+    Label(win,text="Partition divisions:").grid(row=7,column=0,sticky=W,padx=10)
+    Radiobutton(win,text="equal-sized divisions",variable=div_type,value=1).grid(row=7,column=1,sticky=W)
+    Radiobutton(win,text="divisions with same number of points",variable=div_type,value=2).grid(row=8,column=1,columnspan=4,sticky=W)
+    Radiobutton(win,text="other (separate with commas):",variable=div_type,value=3).grid(row=9,column=1,sticky=W)
+    Label(win,text=u" X divisions (\u03bcV):").grid(row=9,column=2,sticky=W)
+    Entry(win,textvariable=xdiv_vals,width=20).grid(row=9,column=3,sticky=W)
+    Label(win,text=u" Y divisions (\u03bcV):").grid(row=10,column=2,sticky=W)
+    Entry(win,textvariable=ydiv_vals,width=20).grid(row=10,column=3,sticky=W)
+    Label(win,text="Symbolic length:").grid(row=11,column=0,sticky=W,padx=10)
+    Label(win,text="Past of X:").grid(row=11,column=1,sticky=W)
+    Entry(win,textvariable=lxp,width=3).grid(row=11,column=2,sticky=W)
+    Label(win,text="Past of Y:").grid(row=12,column=1,sticky=W)
+    Entry(win,textvariable=lyp,width=3).grid(row=12,column=2,sticky=W)
+    Label(win,text="Future of Y:").grid(row=13,column=1,sticky=W)
+    Entry(win,textvariable=lyf,width=3).grid(row=13,column=2,sticky=W)
+    Label(win,text="Tau:").grid(row=14,column=0,sticky=W,padx=10)
+    Entry(win,textvariable=tau,width=3).grid(row=14,column=1,sticky=W)
+    Label(win,text="Units:").grid(row=15,column=0,sticky=W,padx=10)
+    OptionMenu(win,unit,*optionlist).grid(row=15,column=1,sticky=W)
+    Label(win,text="Number of processes:").grid(row=15,column=2,sticky=W)
+    Entry(win,textvariable=n_proc,width=3).grid(row=15,column=3,sticky=W)
+    Label(win,text="Moving window length (ms):").grid(row=16,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=wlen,width=6).grid(row=16,column=1,sticky=W)
+    Label(win,text="Moving window overlap (ms):").grid(row=17,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=woverlap,width=6).grid(row=17,column=1,sticky=W)
+    Label(win,text="Frame rate:").grid(row=18,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=fr,width=6).grid(row=18,column=1,sticky=W)
+    pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
+    pbar['value']=0.0
+    pbtxt=Label(win,text="--")
+    btn=Button(win, text='Start calculation', command=step)
+    btn.grid(row=19,column=0,sticky=W,padx=10)
+    pbar.grid(row=19,column=1,sticky=W)
+    pbtxt.grid(row=19,column=2,sticky=W,columnspan=3)
 
 #mutual information based dynamic functional connectivity
 def mi_dfc():
@@ -4325,364 +6419,190 @@ def mi_dfc():
     tau.set('1')
     unit=StringVar()
     optionlist=['bits','nat','ban']
+    n_proc=StringVar()
+    n_proc.set(str(os.cpu_count()))
     fr=StringVar()
     fr.set("5")
     error=make_x()
-    if (error==1) and (raw1 is None):
-        Label(win,text="ERROR\nIt is required at least\n1 preprocessed or raw data",justify=CENTER).grid(row=0,column=0,padx=10,pady=10)        
-        Button(win,text="OK",command=win.destroy).grid(row=1,column=0,padx=10)
-    else:
+    if eeg1 is not None:
         xdiv_vals.set(f'{np.quantile(eeg1.get_data(),0.2)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.4)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.6)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.8)*10**6:.2f}')
         ydiv_vals.set(f'{np.quantile(eeg1.get_data(),0.2)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.4)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.6)*10**6:.2f}, {np.quantile(eeg1.get_data(),0.8)*10**6:.2f}')
-        def step():
-            if (int(delay.get())>=0) and (int(wlen.get())>0) and (int(fr.get())>0):
-                error2=0
-                if div_type.get()==1:
-                    symb_type='equal-divs'
-                    x_divs,y_divs=None,None
-                elif div_type.get()==2:
-                    symb_type='equal-points'
-                    x_divs,y_divs=None,None
-                elif div_type.get()==3:
-                    x_divs=[float(i)*10**-6 for i in xdiv_vals.get().split(sep=',')]
-                    y_divs=[float(i)*10**-6 for i in ydiv_vals.get().split(sep=',')]
-                    symb_type=None
-                if (raw_or_epoch.get()==2) and (error==1):
-                    showinfo(title="Error",message="To work with epochs it is\nnecessary to have at\nleast 1 preprocessed data")
-                    error2=1
-                elif (raw_or_epoch.get()==1) and (raw1 is None):
-                    showinfo(title="Error",message="To work with raw it is\nnecessary to have loaded at\nleast 1 raw EDF file")
-                    error2=1
-                elif raw_or_epoch.get()==1:
-                    n_chans=len(xraw1.ch_names)
-                    delayval=int(float(delay.get())*xraw1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*xraw1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*xraw1.info['sfreq']/1000)
-                    vals1=xraw1.get_data()
-                    starttimes1=np.arange(0,vals1.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    dfc1=np.empty((len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if xraw2 is not None:
-                        vals2=xraw2.get_data()
-                        starttimes2=np.arange(0,vals2.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        dfc2=np.empty((len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                maxrounds+=1
-                            if xraw2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    maxrounds+=1
-                    k=0                
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/maxrounds
-                                pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                key_idx=0
-                                dfc1[m1,i,j]=mutual_info(vals1[i,starttimes1[m1]:endtimes1[m1]],vals1[j,starttimes1[m1]+delayval:endtimes1[m1]+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                            if xraw2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/maxrounds
-                                    pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                    key_idx=0
-                                    dfc2[m2,i,j]=mutual_info(vals2[i,starttimes2[m2]:endtimes2[m2]],vals2[j,starttimes2[m2]+delayval:endtimes2[m2]+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())                                   
-                elif raw_or_epoch.get()==2:
-                    n_chans=len(x1.ch_names)
-                    delayval=int(float(delay.get())*x1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*x1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*x1.info['sfreq']/1000)
-                    vals1=x1.get_data()[int(sel_epoch1.get()),:,:]
-                    starttimes1=np.arange(0,vals1.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    dfc1=np.empty((len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if x2 is not None:
-                        vals2=x2.get_data()[int(sel_epoch2.get()),:,:]
-                        starttimes2=np.arange(0,vals2.shape[1]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        dfc2=np.empty((len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                maxrounds+=1
-                            if x2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    maxrounds+=1
-                    k=0                
-                    for i in range(n_chans):
-                        for j in range(n_chans):
-                            for m1 in range(len(starttimes1)):
-                                win.update_idletasks()
-                                win.update()
-                                k+=1
-                                pbar['value'] += 100/maxrounds
-                                pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                key_idx=0
-                                dfc1[m1,i,j]=mutual_info(vals1[i,starttimes1[m1]:endtimes1[m1]],vals1[j,starttimes1[m1]+delayval:endtimes1[m1]+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                            if x2 is not None:
-                                for m2 in range(len(starttimes2)):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar['value'] += 100/maxrounds
-                                    pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                    key_idx=0
-                                    dfc2[m2,i,j]=mutual_info(vals2[i,starttimes2[m2]:endtimes2[m2]],vals2[j,starttimes2[m2]+delayval:endtimes2[m2]+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())                                    
-                elif raw_or_epoch.get()==3:
-                    event_names=list(event_dict.keys())
-                    n_chans=len(x1.ch_names)
-                    delayval=int(float(delay.get())*x1.info['sfreq']/1000)
-                    wlenval=int(float(wlen.get())*x1.info['sfreq']/1000)
-                    woverlapval=int(float(woverlap.get())*x1.info['sfreq']/1000)
-                    vals1=[]
-                    n_epochs1=[]
-                    for i in range(len(event_names)):
-                        vals1.append(x1[event_names[i]].get_data())
-                        n_epochs1.append(vals1[i].shape[0])
-                    starttimes1=np.arange(0,vals1[0].shape[2]-wlenval-delayval,wlenval-woverlapval)
-                    endtimes1=starttimes1+wlenval
-                    tdfc1=[]
-                    for i in range(len(event_names)):
-                        tdfc1.append(np.empty((n_epochs1[i],len(starttimes1),n_chans,n_chans)))
-                        tdfc1[i].fill(np.nan)
-                    dfc1=np.empty((len(event_names),len(starttimes1),n_chans,n_chans))
-                    dfc1.fill(np.nan)
-                    if x2 is not None:
-                        vals2=[]
-                        n_epochs2=[]
-                        for i in range(len(event_names)):
-                            vals2.append(x2[event_names[i]].get_data())
-                            n_epochs2.append(vals2[i].shape[0])
-                        starttimes2=np.arange(0,vals2[0].shape[2]-wlenval-delayval,wlenval-woverlapval)
-                        endtimes2=starttimes2+wlenval
-                        tdfc2=[]
-                        for i in range(len(event_names)):
-                            tdfc2.append(np.empty((n_epochs2[i],len(starttimes1),n_chans,n_chans)))
-                            tdfc2[i].fill(np.nan)
-                        dfc2=np.empty((len(event_names),len(starttimes2),n_chans,n_chans))
-                        dfc2.fill(np.nan)
-                    pbar['value']=0.0
-                    maxrounds=0
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    for e1 in range(n_epochs1[ev]):
-                                        maxrounds+=1
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        for e2 in range(n_epochs2[ev]):
-                                            maxrounds+=1
-                    k=0                
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    for e1 in range(n_epochs1[ev]):
-                                        win.update_idletasks()
-                                        win.update()
-                                        k+=1
-                                        pbar['value'] += 100/maxrounds
-                                        pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                        key_idx=0
-                                        tdfc1[ev][e1,m1,i,j]=mutual_info(vals1[ev][e1,i,int(starttimes1[m1]):int(endtimes1[m1])],vals1[ev][e1,j,int(starttimes1[m1])+delayval:int(endtimes1[m1])+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        for e2 in range(n_epochs2[ev]):
-                                            win.update_idletasks()
-                                            win.update()
-                                            k+=1
-                                            pbar['value'] += 100/maxrounds
-                                            pbtxt['text']=f"{k:d}/{maxrounds:d}"
-                                            key_idx=0
-                                            tdfc2[ev][e2,m2,i,j]=mutual_info(vals2[ev][e2,i,int(starttimes2[m2]):int(endtimes2[m2])],vals2[ev][e2,j,int(starttimes2[m2])+delayval:int(endtimes2[m2])+delayval],
-                                                                                symbolic_type=symb_type,n_symbols=int(ns.get()),tau=int(tau.get()),
-                                                                                symbolic_length=(int(lxp.get()),int(lyp.get())),
-                                                                                x_divs=x_divs,y_divs=y_divs,units=unit.get())
-                    pbtxt['text']="finishing, please wait"
-                    for ev in range(len(event_names)):
-                        for i in range(n_chans):
-                            for j in range(n_chans):
-                                for m1 in range(len(starttimes1)):
-                                    dfc1[ev,m1,i,j]=np.nanmean(tdfc1[ev][:,m1,i,j])
-                                if x2 is not None:
-                                    for m2 in range(len(starttimes2)):
-                                        dfc2[ev,m2,i,j]=np.nanmean(tdfc2[ev][:,m2,i,j])        
-                    pbtxt['text']="done!"
-                if error2==0:
-                    def make_film():
-                        winfilm=Toplevel(win)
-                        Label(winfilm,text="Make Dynamic Functional Connectivity animation").grid(row=0,column=0,padx=10,pady=10,columnspan=3)
-                        pbar2=Progressbar(winfilm,orient=HORIZONTAL,length=100,mode='determinate')
-                        pbar2['value']=0.0
-                        pbtxt2=Label(winfilm,text="--")
-                        def process_frames():
-                            if raw_or_epoch.get()==3:
-                                nocond2=0
-                                try:
-                                    n_frames=min(len(dfc1[0,:,0,0]),len(dfc2[0,:,0,0]))
-                                except:
-                                    n_frames=len(dfc1[0,:,0,0])
-                                    nocond2=1
-                                k=0
-                                os.mkdir('temp_DFC_frames')
-                                for frame in range(n_frames):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar2['value'] += 100/n_frames
-                                    pbtxt2['text']=f"{k:d}/{n_frames:d}"
-                                    y1=[]
-                                    if nocond2==1:
-                                        y2=None
-                                    else:
-                                        y2=[]
-                                    maxmi=0
-                                    for ev in range(len(event_names)):
-                                        y1.append(pd.DataFrame(dfc1[ev,frame,:,:],index=x1.ch_names,columns=x1.ch_names))
-                                        maxmi=max(maxmi,y1[ev].max().max())
-                                        if nocond2==0:
-                                            y2.append(pd.DataFrame(dfc2[ev,frame,:,:],index=x2.ch_names,columns=x2.ch_names))
-                                            maxmi=max(maxmi,y2[ev].max().max())
-                                    make_frame(y1,y2,vmin=0,vmax=maxmi,color='Reds',lblttl='Mutual Information',frttl=f'temp_DFC_frames/DFC_frame{frame:05d}.png')
-                                pbtxt2['text']="Finishing up"
-                                command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_frame%05d.png -pix_fmt yuv420p DFC_Mutual_Information.mp4'
-                                os.system(command)
-                                shutil.rmtree('temp_DFC_frames')
-                                showinfo(title="Info",message="Video of DFC was saved as DFC_Mutual_Information.mp4 at\n"+os.getcwd())
+    def step():
+        if (int(delay.get())>=0) and (int(wlen.get())>0) and (int(fr.get())>0):
+            error2=0
+            symb_type,x_divs,y_divs=symbolization_args(div_type.get(),xdiv_vals.get(),ydiv_vals.get())
+            if (raw_or_epoch.get() in (2,3)) and (error==1):
+                showinfo(title="Error",message="To work with epochs it is\nnecessary to have at\nleast 1 preprocessed data")
+                error2=1
+            elif (raw_or_epoch.get() in (1,4)) and (raw1 is None):
+                showinfo(title="Error",message="To work with raw it is\nnecessary to have loaded at\nleast 1 raw EDF file")
+                error2=1
+            elif raw_or_epoch.get() in (1,4):
+                #chunk by chunk from the loaded recordings, or from their files with the same preprocessing
+                sources=[xraw1,xraw2] if raw_or_epoch.get()==1 else [open_preprocessed_stream(steps) for steps in raw_steps if steps is not None]
+                jobs=[partial(compute_stream_dfc,src,float(delay.get()),float(wlen.get()),float(woverlap.get()),'mi',energy=raw_or_energy.get()==2,n_jobs=int(n_proc.get()),
+                              store=temp_dfc_store(raw_or_epoch.get()==4),symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,
+                              symbolic_length=(int(lxp.get()),int(lyp.get())),tau=int(tau.get()),units=unit.get()) for src in sources if src is not None]
+            elif raw_or_epoch.get()==2:
+                jobs=[partial(compute_dfc,epoch_data(x1,int(sel_epoch1.get())),x1.info['sfreq'],float(delay.get()),float(wlen.get()),float(woverlap.get()),'mi',n_jobs=int(n_proc.get()),store=temp_dfc_store(),
+                      symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,symbolic_length=(int(lxp.get()),int(lyp.get())),tau=int(tau.get()),units=unit.get())]
+                if x2 is not None:
+                    jobs.append(partial(compute_dfc,epoch_data(x2,int(sel_epoch2.get())),x2.info['sfreq'],float(delay.get()),float(wlen.get()),float(woverlap.get()),'mi',n_jobs=int(n_proc.get()),store=temp_dfc_store(),
+                                symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,symbolic_length=(int(lxp.get()),int(lyp.get())),tau=int(tau.get()),units=unit.get()))
+            elif raw_or_epoch.get()==3:
+                event_names=list(event_dict.keys())
+                jobs=[partial(compute_epochs_dfc,x1,event_names,float(delay.get()),float(wlen.get()),float(woverlap.get()),'mi',n_jobs=int(n_proc.get()),store=temp_dfc_store(),
+                      symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,symbolic_length=(int(lxp.get()),int(lyp.get())),tau=int(tau.get()),units=unit.get())]
+                if x2 is not None:
+                    jobs.append(partial(compute_epochs_dfc,x2,event_names,float(delay.get()),float(wlen.get()),float(woverlap.get()),'mi',n_jobs=int(n_proc.get()),store=temp_dfc_store(),
+                                symb_type=symb_type,n_symbols=int(ns.get()),x_divs=x_divs,y_divs=y_divs,symbolic_length=(int(lxp.get()),int(lyp.get())),tau=int(tau.get()),units=unit.get()))
+            if error2==0:
+                results=run_task(win,pbar,pbtxt,jobs)
+                if results is None:
+                    return
+                dfc1=results[0]
+                if len(results)>1:
+                    dfc2=results[1]
+                def make_film():
+                    winfilm=Toplevel(win)
+                    Label(winfilm,text="Make Dynamic Functional Connectivity animation").grid(row=0,column=0,padx=10,pady=10,columnspan=3)
+                    pbar2=Progressbar(winfilm,orient=HORIZONTAL,length=100,mode='determinate')
+                    pbar2['value']=0.0
+                    pbtxt2=Label(winfilm,text="--")
+                    n_render=StringVar()
+                    n_render.set(str(os.cpu_count()))
+                    def process_frames():
+                        y2=results[1] if len(results)>1 else None
+                        if raw_or_epoch.get()==3:
+                            fname=fd.asksaveasfilename(title="Video of DFC",initialfile="DFC_Mutual_Information.mp4",defaultextension=".mp4",filetypes=(("MP4 video", "*.mp4"),("All Files", "*.*")))
+                            if not fname:
+                                return
+                            fnames=[fname]
+                            jobs=[partial(render_dfc_video,fname,dfc1,y2,x1.ch_names,event_names,None if y2 is None else [cond1_name.get(),cond2_name.get()],fps=int(fr.get()),
+                                          vmin=0,vmax=None,color='Reds',lblttl='Mutual Information',n_jobs=int(n_render.get()))]
+                        else:
+                            if raw_or_epoch.get()==4:
+                                ch_names=dfc1['meta']['ch_names']
                             else:
-                                nocond2=0
-                                n_frames1=len(dfc1[:,0,0])
-                                total_frames=n_frames1
-                                if raw_or_epoch.get()==2:
-                                    ch_names=x1.ch_names
-                                else:
-                                    ch_names=xraw1.ch_names
-                                try:
-                                    n_frames2=len(dfc2[:,0,0])
-                                    total_frames+=n_frames2
-                                except:
-                                    nocond2=1
-                                k=0
-                                os.mkdir('temp_DFC_frames')
-                                for frame in range(n_frames1):
-                                    win.update_idletasks()
-                                    win.update()
-                                    k+=1
-                                    pbar2['value'] += 100/total_frames
-                                    pbtxt2['text']=f"{k:d}/{total_frames:d}"
-                                    y1=pd.DataFrame(dfc1[frame,:,:],index=ch_names,columns=ch_names)
-                                    make_frame2(y1,vmin=0,vmax=y1.max().max(),color='Reds',lblttl='Mutual Information',frttl=f'temp_DFC_frames/DFC_{cond1_name.get()}_frame{frame:05d}.png')
-                                if nocond==0:
-                                    for frame in range(n_frames2):
-                                        win.update_idletasks()
-                                        win.update()
-                                        k+=1
-                                        pbar2['value'] += 100/total_frames
-                                        pbtxt2['text']=f"{k:d}/{total_frames:d}"
-                                        y2=pd.DataFrame(dfc2[frame,:,:],index=ch_names,columns=ch_names)
-                                        make_frame2(y2,vmin=0,vmax=y2.max().max(),color='Reds',lblttl='Mutual Information',frttl=f'temp_DFC_frames/DFC_{cond2_name.get()}_frame{frame:05d}.png')
-                                pbtxt2['text']="Finishing up"
-                                command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_{cond1_name.get()}_frame%05d.png -pix_fmt yuv420p DFC_{cond1_name.get()}_Mutual_Information.mp4'
-                                os.system(command)
-                                if nocond==0:
-                                    command=f'ffmpeg -framerate {fr.get()} -i temp_DFC_frames/DFC_{cond2_name.get()}_frame%05d.png -pix_fmt yuv420p DFC_{cond2_name.get()}_Mutual_Information.mp4'
-                                    os.system(command)
-                                shutil.rmtree('temp_DFC_frames')
-                                if nocond==0:
-                                    showinfo(title="Info",message="Videos of DFC were saved as\nDFC_{cond1_name.get()}_Mutual_Information.mp4 and DFC_{cond1_name.get()}_Mutual_Information.mp4 at\n"+os.getcwd())
-                                else:
-                                    showinfo(title="Info",message="Video of DFC were saved as\nDFC_{cond1_name.get()}_Mutual_Information.mp4 at\n"+os.getcwd())
-                            winfilm.destroy()
-                        btn2=Button(winfilm, text='Create video', command=process_frames)
-                        btn2.grid(row=1,column=0,sticky=W,padx=10)
-                        pbar2.grid(row=1,column=1,sticky=W)
-                        pbtxt2.grid(row=1,column=2,sticky=W)
-                    def save_corr():
-                        showinfo(title="Info",message="The full results will be saved as a\nNumpy array of size (n_times,n_chans,n_chans))")
-                        fname1 = fd.asksaveasfilename(title="Mutual Information DFC condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
-                        np.save(fname1,dfc1)
-                        if (x2 is not None) or (raw2 is not None):
-                            fname2 = fd.asksaveasfilename(title="Mutual Information DFC condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
-                            np.save(fname2,dfc2)
-                    Button(win,text="Save results",command=save_corr).grid(row=19,column=0,padx=10,sticky=W)
-                    Button(win,text="Make DFC animations",command=make_film).grid(row=20,column=0,padx=10,sticky=W)
-                    Button(win,text="Close",command=win.destroy).grid(row=21,column=0,padx=10,pady=10,columnspan=5)
-            else:
-                showinfo(title="Error",message="Delay, window length and frame rate must be positive numbers")
-        Label(win,text="Calculate mutual information").grid(row=0,column=0,columnspan=4,padx=10,pady=10)
-        Label(win,text="Calculate from:").grid(row=1,column=0,padx=10,sticky=W)
-        Radiobutton(win,text="From raw EEG",variable=raw_or_epoch,value=1).grid(row=1,column=1,sticky=W)
-        Radiobutton(win,text="From epoch:",variable=raw_or_epoch,value=2).grid(row=2,column=1,sticky=W)
-        Entry(win,textvariable=sel_epoch1,width=2).grid(row=2,column=2,sticky=W)
-        Label(win,text=f"for {cond1_name.get()}").grid(row=2,column=3,sticky=W)
-        Entry(win,textvariable=sel_epoch2,width=2).grid(row=3,column=2,sticky=W)
-        Label(win,text=f"for {cond2_name.get()}").grid(row=3,column=3,sticky=W)
-        Radiobutton(win,text="Average of results of all epochs",variable=raw_or_epoch,value=3).grid(row=4,column=1,sticky=W,columnspan=3)
-        Label(win,text="Transmission delay between brain regions (ms):").grid(row=5,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=delay,width=4).grid(row=5,column=1,sticky=W)
-        Label(win,text="Number of symbols (partition divisions):").grid(row=6,column=0,sticky=W,padx=10)
-        Entry(win,textvariable=ns,width=3).grid(row=6,column=1,sticky=W)
-        Label(win,text="Partition divisions:").grid(row=7,column=0,sticky=W,padx=10)
-        Radiobutton(win,text="equal-sized divisions",variable=div_type,value=1).grid(row=7,column=1,sticky=W)
-        Radiobutton(win,text="divisions with same number of points",variable=div_type,value=2).grid(row=8,column=1,columnspan=4,sticky=W)
-        Radiobutton(win,text="other (separate with commas):",variable=div_type,value=3).grid(row=9,column=1,sticky=W)
-        Label(win,text=u" X divisions (\u03bcV):").grid(row=9,column=2,sticky=W)
-        Entry(win,textvariable=xdiv_vals,width=20).grid(row=9,column=3,sticky=W)
-        Label(win,text=u" Y divisions (\u03bcV):").grid(row=10,column=2,sticky=W)
-        Entry(win,textvariable=ydiv_vals,width=20).grid(row=10,column=3,sticky=W)
-        Label(win,text="Symbolic length:").grid(row=11,column=0,sticky=W,padx=10)
-        Label(win,text="for X:").grid(row=11,column=1,sticky=W)
-        Entry(win,textvariable=lxp,width=3).grid(row=11,column=2,sticky=W)
-        Label(win,text="for Y:").grid(row=12,column=1,sticky=W)
-        Entry(win,textvariable=lyp,width=3).grid(row=12,column=2,sticky=W)
-        Label(win,text="Tau:").grid(row=13,column=0,sticky=W,padx=10)
-        Entry(win,textvariable=tau,width=3).grid(row=13,column=1,sticky=W)
-        Label(win,text="Units:").grid(row=14,column=0,sticky=W,padx=10)
-        OptionMenu(win,unit,*optionlist).grid(row=14,column=1,sticky=W)
-        Label(win,text="Moving window length (ms):").grid(row=15,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=wlen,width=6).grid(row=15,column=1,sticky=W)
-        Label(win,text="Moving window overlap (ms):").grid(row=16,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=woverlap,width=6).grid(row=16,column=1,sticky=W)
-        Label(win,text="Frame rate:").grid(row=17,column=0,padx=10,sticky=W)
-        Entry(win,textvariable=fr,width=6).grid(row=17,column=1,sticky=W)
-        pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
-        pbar['value']=0.0
-        pbtxt=Label(win,text="--")
-        btn=Button(win, text='Start calculation', command=step)
-        btn.grid(row=18,column=0,sticky=W,padx=10)
-        pbar.grid(row=18,column=1,sticky=W)
-        pbtxt.grid(row=18,column=2,sticky=W,columnspan=3)
+                                ch_names=x1.ch_names if raw_or_epoch.get()==2 else xraw1.ch_names
+                            fnames=[]
+                            jobs=[]
+                            for y,cond in ((dfc1,cond1_name.get()),(y2,cond2_name.get())):
+                                if y is None:
+                                    continue
+                                fname=fd.asksaveasfilename(title="Video of DFC condition "+cond,initialfile=f"DFC_{cond}_Mutual_Information.mp4",defaultextension=".mp4",filetypes=(("MP4 video", "*.mp4"),("All Files", "*.*")))
+                                if not fname:
+                                    return
+                                fnames.append(fname)
+                                jobs.append(partial(render_dfc_video,fname,y,None,ch_names,fps=int(fr.get()),vmin=0,vmax=None,color='Reds',lblttl='Mutual Information',n_jobs=int(n_render.get())))
+                        if run_task(winfilm,pbar2,pbtxt2,jobs,title="Rendering frames") is None:
+                            return
+                        if len(fnames)>1:
+                            showinfo(title="Info",message="Videos of DFC were saved as\n"+"\nand\n".join(fnames))
+                        else:
+                            showinfo(title="Info",message="Video of DFC was saved as\n"+fnames[0])
+                        winfilm.destroy()
+                    btn2=Button(winfilm, text='Create video', command=process_frames)
+                    btn2.grid(row=1,column=0,sticky=W,padx=10)
+                    pbar2.grid(row=1,column=1,sticky=W)
+                    pbtxt2.grid(row=1,column=2,sticky=W)
+                    Label(winfilm,text="Number of processes:").grid(row=2,column=0,padx=10,pady=(0,10),sticky=W)
+                    Entry(winfilm,textvariable=n_render,width=3).grid(row=2,column=1,pady=(0,10),sticky=W)
+                def save_corr():
+                    showinfo(title="Info",message="The full results will be saved as a\nNumpy array of size (n_times,n_chans,n_chans))")
+                    fname1 = fd.asksaveasfilename(title="Mutual Information DFC condition "+cond1_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                    save_dfc(fname1,dfc1)
+                    if len(results)>1:
+                        fname2 = fd.asksaveasfilename(title="Mutual Information DFC condition "+cond2_name.get(),defaultextension=".npy",filetypes=(("Numpy array", "*.npy"),("All Files", "*.*")))
+                        save_dfc(fname2,dfc2)
+                Button(win,text="Save results",command=save_corr).grid(row=19,column=0,padx=10,sticky=W)
+                Button(win,text="Make DFC animations",command=make_film).grid(row=20,column=0,padx=10,sticky=W)
+                Button(win,text="Close",command=win.destroy).grid(row=21,column=0,padx=10,pady=10,columnspan=5)
+        else:
+            showinfo(title="Error",message="Delay, window length and frame rate must be positive numbers")
+    Label(win,text="Calculate mutual information").grid(row=0,column=0,columnspan=4,padx=10,pady=10)
+    Label(win,text="Calculate from:").grid(row=1,column=0,padx=10,sticky=W)
+    Radiobutton(win,text="From raw EEG",variable=raw_or_epoch,value=1).grid(row=1,column=1,sticky=W)
+    Radiobutton(win,text="Stream raw EEG from its EDF file on disk\n(same preprocessing, long recordings)",variable=raw_or_epoch,value=4).grid(row=1,column=2,sticky=W,columnspan=3)
+    Radiobutton(win,text="From epoch:",variable=raw_or_epoch,value=2).grid(row=2,column=1,sticky=W)
+    Entry(win,textvariable=sel_epoch1,width=2).grid(row=2,column=2,sticky=W)
+    Label(win,text=f"for {cond1_name.get()}").grid(row=2,column=3,sticky=W)
+    Entry(win,textvariable=sel_epoch2,width=2).grid(row=3,column=2,sticky=W)
+    Label(win,text=f"for {cond2_name.get()}").grid(row=3,column=3,sticky=W)
+    Radiobutton(win,text="Average of results of all epochs",variable=raw_or_epoch,value=3).grid(row=4,column=1,sticky=W,columnspan=3)
+    Label(win,text="Transmission delay between brain regions (ms):").grid(row=5,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=delay,width=4).grid(row=5,column=1,sticky=W)
+    Label(win,text="Number of symbols (partition divisions):").grid(row=6,column=0,sticky=W,padx=10)
+    Entry(win,textvariable=ns,width=3).grid(row=6,column=1,sticky=W)
+    Label(win,text="Partition divisions:").grid(row=7,column=0,sticky=W,padx=10)
+    Radiobutton(win,text="equal-sized divisions",variable=div_type,value=1).grid(row=7,column=1,sticky=W)
+    Radiobutton(win,text="divisions with same number of points",variable=div_type,value=2).grid(row=8,column=1,columnspan=4,sticky=W)
+    Radiobutton(win,text="other (separate with commas):",variable=div_type,value=3).grid(row=9,column=1,sticky=W)
+    Label(win,text=u" X divisions (\u03bcV):").grid(row=9,column=2,sticky=W)
+    Entry(win,textvariable=xdiv_vals,width=20).grid(row=9,column=3,sticky=W)
+    Label(win,text=u" Y divisions (\u03bcV):").grid(row=10,column=2,sticky=W)
+    Entry(win,textvariable=ydiv_vals,width=20).grid(row=10,column=3,sticky=W)
+    Label(win,text="Symbolic length:").grid(row=11,column=0,sticky=W,padx=10)
+    Label(win,text="for X:").grid(row=11,column=1,sticky=W)
+    Entry(win,textvariable=lxp,width=3).grid(row=11,column=2,sticky=W)
+    Label(win,text="for Y:").grid(row=12,column=1,sticky=W)
+    Entry(win,textvariable=lyp,width=3).grid(row=12,column=2,sticky=W)
+    Label(win,text="Tau:").grid(row=13,column=0,sticky=W,padx=10)
+    Entry(win,textvariable=tau,width=3).grid(row=13,column=1,sticky=W)
+    Label(win,text="Units:").grid(row=14,column=0,sticky=W,padx=10)
+    OptionMenu(win,unit,*optionlist).grid(row=14,column=1,sticky=W)
+    Label(win,text="Number of processes:").grid(row=14,column=2,sticky=W)
+    Entry(win,textvariable=n_proc,width=3).grid(row=14,column=3,sticky=W)
+    Label(win,text="Moving window length (ms):").grid(row=15,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=wlen,width=6).grid(row=15,column=1,sticky=W)
+    Label(win,text="Moving window overlap (ms):").grid(row=16,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=woverlap,width=6).grid(row=16,column=1,sticky=W)
+    Label(win,text="Frame rate:").grid(row=17,column=0,padx=10,sticky=W)
+    Entry(win,textvariable=fr,width=6).grid(row=17,column=1,sticky=W)
+    pbar=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
+    pbar['value']=0.0
+    pbtxt=Label(win,text="--")
+    btn=Button(win, text='Start calculation', command=step)
+    btn.grid(row=18,column=0,sticky=W,padx=10)
+    pbar.grid(row=18,column=1,sticky=W)
+    pbtxt.grid(row=18,column=2,sticky=W,columnspan=3)
+
+#headless morlet time-frequency representation of every event
+def compute_tfr(epochs,event_names,fmin=5,fmax=30,nfreq=50,n_jobs=1,progress=None):
+    """Morlet wavelet power and inter-trial coherence of every event, without
+    any user interface.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    event_names : list
+        Names of the events to analyse.
+    fmin, fmax : float
+        Limits of the logarithmically spaced frequencies, in Hz.
+    nfreq : int
+        Number of frequencies.
+    n_jobs : int
+        Number of jobs passed to mne.
+    progress : function, None
+        Called as progress(done,total) after each event.
+    Returns
+    -------
+    power, itc : list
+        Lists of mne.time_frequency.AverageTFR, one per event.
+    """
+    if not (0<float(fmin)<float(fmax)) or (int(nfreq)<=0):
+        raise ValueError("Frequencies must be positive, with fmax>fmin and at least 1 frequency")
+    freqs=np.logspace(*np.log10([float(fmin), float(fmax)]), num=int(nfreq))
+    n_cycles=freqs/2.
+    power=[]
+    itc=[]
+    for k,key in enumerate(event_names):
+        a,b = mne.time_frequency.tfr_morlet(epochs[key], freqs=freqs, n_cycles=n_cycles, use_fft=True,return_itc=True, decim=3, n_jobs=n_jobs)
+        power.append(a)
+        itc.append(b)
+        if progress is not None:
+            progress(k+1,len(event_names))
+    return power,itc
 
 def tfr():
     win=Toplevel(main)
@@ -4699,34 +6619,17 @@ def tfr():
     else:
         def calculate_tfr():
             if (float(fmin.get())>0) and (float(fmax.get())>float(fmin.get())) and (int(nfreq.get())>0):
-                freqs=np.logspace(*np.log10([float(fmin.get()), float(fmax.get())]), num=int(nfreq.get()))
-                n_cycles=freqs/2.
-                power1=[]
-                itc1=[]
+                jobs=[partial(compute_tfr,x1,list(event_dict.keys()),float(fmin.get()),float(fmax.get()),int(nfreq.get()))]
+                if x2 is not None:
+                    jobs.append(partial(compute_tfr,x2,list(event_dict.keys()),float(fmin.get()),float(fmax.get()),int(nfreq.get())))
+                results=run_task(win,pbar,pbtxt,jobs)
+                if results is None:
+                    return
+                power1,itc1=results[0]
                 power2=[]
                 itc2=[]
-                pmax=len(event_dict.keys())
                 if x2 is not None:
-                    pmax=2*pmax
-                k=0
-                for key in event_dict.keys():
-                    win.update_idletasks()
-                    win.update()
-                    k+=1
-                    pbar['value'] += 100/pmax
-                    pbtxt['text']=f"{k:d}/{pmax:d}"
-                    a1,b1 = mne.time_frequency.tfr_morlet(x1[key], freqs=freqs, n_cycles=n_cycles, use_fft=True,return_itc=True, decim=3, n_jobs=1)
-                    power1.append(a1)
-                    itc1.append(b1)
-                    if x2 is not None:
-                        win.update_idletasks()
-                        win.update()
-                        k+=1
-                        pbar['value'] += 100/pmax
-                        pbtxt['text']=f"{k:d}/{pmax:d}"
-                        a2,b2 = mne.time_frequency.tfr_morlet(x2[key], freqs=freqs, n_cycles=n_cycles, use_fft=True,return_itc=True, decim=3, n_jobs=1)
-                        power2.append(a2)
-                        itc2.append(b2)
+                    power2,itc2=results[1]
                 def make_plot():
                     optionlist=x1.ch_names
                     sel_chan=StringVar()
@@ -4830,91 +6733,48 @@ def animtopo():
         framerate.set("30")
         mean_or_indiv=IntVar()
         mean_or_indiv.set(1)
+        n_proc=StringVar()
+        n_proc.set(str(os.cpu_count()))
         Label(win,text="Generate animated topoplots:").grid(row=0,column=0,padx=10,pady=10)
         Radiobutton(win,text="For average of epochs",variable=mean_or_indiv,value=1).grid(row=0,column=1,pady=10,sticky=W,columnspan=3)
         Radiobutton(win,text="For individual epochs",variable=mean_or_indiv,value=2).grid(row=1,column=1,pady=10,sticky=W,columnspan=3)
         Label(win,text="Frame rate: ").grid(row=2,column=0,padx=0,sticky=W)
         Entry(win,textvariable=framerate,width=3).grid(row=2,column=1,sticky=W)
+        Label(win,text="Number of processes: ").grid(row=3,column=0,padx=0,sticky=W)
+        Entry(win,textvariable=n_proc,width=3).grid(row=3,column=1,sticky=W)
         def proceed():
             fr=int(framerate.get())
+            n_jobs=int(n_proc.get())
             win.destroy()
-            if mean_or_indiv.get()==2:
-                for key in event_dict.keys():
-                    fname1 = fd.asksaveasfilename(title="Animated topoplot condition "+cond1_name.get()+" event "+key,defaultextension=".mp4",filetypes=(("MPEG-4", "*.mp4"),("All Files", "*.*")))
-                    win2=Toplevel(main)
-                    lab=Label(win2,text="Generating animations, may take a while\n(Please do not close the program,\nit is not frozen)")
-                    lab.grid(row=0,column=0,padx=10,pady=10)
-                    win2.update()
-                    n_epochs=len(x1[key])
-                    for epoch in range(n_epochs):
-                        lab['text']=f'Generating animations, may take a while\nepoch {epoch+1} of {n_epochs}\n(Please do not close the program,\nit is not frozen)'
-                        win2.update()
-                        evoked=mne.EvokedArray(x1[key].get_data()[epoch,:,:],x1.info)
-                        fig,anim=evoked.animate_topomap(blit=False,show=False,frame_rate=fr,times=x1.times[1:-1]-x1.times[0])
-                        anim.save(f'{fname1[:-4]}_{epoch:03}.mp4')
-                        fig.clf()
-                        plt.close()
-                        gc.collect()
-                    win2.destroy()
-                    if x2 is not None:
-                        fname2 = fd.asksaveasfilename(title="Animated topoplot condition "+cond2_name.get()+" event "+key,defaultextension=".mp4",filetypes=(("MPEG-4", "*.mp4"),("All Files", "*.*")))
-                        win2=Toplevel(main)
-                        lab=Label(win2,text="Generating animations, may take a while\n(Please do not close the program,\nit is not frozen)")
-                        lab.grid(row=0,column=0,padx=10,pady=10)
-                        win2.update()
-                        n_epochs=len(x2[key])
-                        for epoch in range(n_epochs):
-                            lab['text']=f'Generating animations, may take a while\nepoch {epoch+1} of {n_epochs}\n(Please do not close the program,\nit is not frozen)'
-                            win2.update()
-                            evoked=mne.EvokedArray(x2[key].get_data()[epoch,:,:],x2.info)
-                            fig,anim=evoked.animate_topomap(blit=False,show=False,frame_rate=fr,times=x2.times[1:-1]-x2.times[0])
-                            anim.save(f'{fname2[:-4]}_{epoch:03}.mp4')
-                            fig.clf()
-                            plt.close()
-                            gc.collect()
-                        win2.destroy()
-            else:
-                for key in event_dict.keys():
-                    fname1 = fd.asksaveasfilename(title="Animated topoplot condition "+cond1_name.get()+" event "+key,defaultextension=".mp4",filetypes=(("MPEG-4", "*.mp4"),("All Files", "*.*")))
-                    win2=Toplevel(main)
-                    Label(win2,text="Calculating averages, please wait\n(Please do not close the program,\nit is not frozen)").grid(row=0,column=0,padx=10,pady=10)
-                    win2.update()
-                    mean_x1=np.zeros(x1[key].get_data().shape[1:])
-                    for ch in range(x1[key].get_data().shape[1]):
-                        for t in range(x1[key].get_data().shape[2]):
-                            mean_x1[ch,t]=np.nanmean(x1[key].get_data()[:,ch,t])
-                    win2.destroy()
-                    win2=Toplevel(main)
-                    Label(win2,text="Generating animations, may take a while\n(Please do not close the program,\nit is not frozen)").grid(row=0,column=0,padx=10,pady=10)
-                    win2.update()
-                    evoked=mne.EvokedArray(mean_x1,x1.info)
-                    fig,anim=evoked.animate_topomap(blit=False,show=False,frame_rate=fr,times=x1.times[1:-1]-x1.times[0])
-                    anim.save(fname1)
-                    fig.clf()
-                    plt.close()
-                    gc.collect()
-                    win2.destroy()
-                    if x2 is not None:
-                        fname2 = fd.asksaveasfilename(title="Animated topoplot condition "+cond2_name.get()+" event "+key,defaultextension=".mp4",filetypes=(("MPEG-4", "*.mp4"),("All Files", "*.*")))
-                        win2=Toplevel(main)
-                        Label(win2,text="Calculating averages, please wait\n(Please do not close the program,\nit is not frozen)").grid(row=0,column=0,padx=10,pady=10)
-                        win2.update()
-                        mean_x2=np.zeros(x2[key].get_data().shape[1:])
-                        for ch in range(x2[key].get_data().shape[1]):
-                            for t in range(x2[key].get_data().shape[2]):
-                                mean_x2[ch,t]=np.nanmean(x2[key].get_data()[:,ch,t])
-                        win2.destroy()
-                        win2=Toplevel(main)
-                        Label(win2,text="Generating animations, may take a while\n(Please do not close the program,\nit is not frozen)").grid(row=0,column=0,padx=10,pady=10)
-                        win2.update()
-                        evoked=mne.EvokedArray(mean_x2,x2.info)
-                        fig,anim=evoked.animate_topomap(blit=False,show=False,frame_rate=fr,times=x2.times[1:-1]-x2.times[0])
-                        anim.save(fname2)
-                        fig.clf()
-                        plt.close()
-                        gc.collect()
-                        win2.destroy()
-        Button(win,text="OK",command=proceed).grid(row=3,column=0,padx=10,pady=10,columnspan=3)
+            conditions=[(x1,cond1_name.get())]
+            if x2 is not None:
+                conditions.append((x2,cond2_name.get()))
+            jobs=[]
+            for key in event_dict.keys():
+                for x,cond in conditions:
+                    fname = fd.asksaveasfilename(title="Animated topoplot condition "+cond+" event "+key,defaultextension=".mp4",filetypes=(("MPEG-4", "*.mp4"),("All Files", "*.*")))
+                    if not fname:
+                        continue
+                    if mean_or_indiv.get()==2:
+                        items=event_data(x,key)
+                        fnames=[f'{fname[:-4]}_{epoch:03}.mp4' for epoch in range(items.shape[0])]
+                    else:
+                        items=np.nanmean(event_data(x,key),axis=0)[None]
+                        fnames=[fname]
+                    jobs.append(partial(parallel_topomaps,items,x.info,x.times[1:-1]-x.times[0],fr,fnames,n_jobs=n_jobs))
+            if len(jobs)==0:
+                return
+            win2=Toplevel(main)
+            Label(win2,text="Generating animations, may take a while").grid(row=0,column=0,columnspan=2,padx=10,pady=10)
+            pbar=Progressbar(win2,orient=HORIZONTAL,length=100,mode='determinate')
+            pbar.grid(row=1,column=0,padx=10,pady=10)
+            pbtxt=Label(win2,text="--")
+            pbtxt.grid(row=1,column=1,padx=10,pady=10)
+            results=run_task(win2,pbar,pbtxt,jobs,title="Generating animations")
+            win2.destroy()
+            if results is not None:
+                showinfo(title="Info",message=f"{sum(len(r) for r in results):d} animated topoplot(s) saved")
+        Button(win,text="OK",command=proceed).grid(row=4,column=0,padx=10,pady=10,columnspan=3)
 
 #Find optimal Delay
 def complexity_delay(signal, delay_max=None):
@@ -5120,6 +6980,80 @@ def complexity_lyapunov(signal,delay=None,dimension=None,len_trajectory=20,min_n
     le, _ = np.polyfit(np.arange(1,len(divergence_rate)+1),divergence_rate,1)
     return le
 
+#headless optimal embedding parameters of one channel
+def compute_embedding_params(epochs,event_names,channel,progress=None):
+    """Optimal Takens' delay and embedding dimension of one channel, for every
+    epoch of every event, without any user interface.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    event_names : list
+        Names of the events to analyse.
+    channel : str, int
+        Name or index of the channel.
+    progress : function, None
+        Called as progress(done,total) after each epoch.
+    Returns
+    -------
+    optim_tau, optim_dim : np.array
+        Arrays of shape (n_events,max_epochs), padded with NaN for the events
+        with less epochs.
+    """
+    if isinstance(channel,str):
+        channel=epochs.ch_names.index(channel)
+    data=[event_data(epochs,key) for key in event_names]
+    max_epochs=max([vals.shape[0] for vals in data])
+    optim_tau=np.full((len(event_names),max_epochs),np.nan)
+    optim_dim=np.full((len(event_names),max_epochs),np.nan)
+    total=sum([vals.shape[0] for vals in data])
+    count=0
+    for k,vals in enumerate(data):
+        for ev in range(vals.shape[0]):
+            optim_tau[k,ev]=int(complexity_delay(vals[ev,channel,:]))
+            optim_dim[k,ev],_=optimal_dimension(vals[ev,channel,:], delay=int(optim_tau[k,ev]), dimension_max=None)
+            count+=1
+            if progress is not None:
+                progress(count,total)
+    return optim_tau,optim_dim
+
+#headless maximum lyapunov exponent of one channel
+def compute_lyapunov(epochs,event_names,channel,tau=1,dimension=2,len_trajectory=20,progress=None):
+    """Maximum Lyapunov exponent of one channel, for every epoch of every
+    event, without any user interface.
+    Parameters
+    ----------
+    epochs : mne.Epochs
+        Epoched data.
+    event_names : list
+        Names of the events to analyse.
+    channel : str, int
+        Name or index of the channel.
+    tau : int
+        Takens' reconstruction delay, in samples.
+    dimension : int
+        Reconstruction dimension.
+    len_trajectory : int
+        Number of samples used to fit the divergence of the trajectories.
+    progress : function, None
+        Called as progress(done,total) after each event.
+    Returns
+    -------
+    le : np.array
+        Array of shape (n_events,max_epochs), padded with NaN for the events
+        with less epochs.
+    """
+    if isinstance(channel,str):
+        channel=epochs.ch_names.index(channel)
+    data=[event_data(epochs,key) for key in event_names]
+    le=np.full((len(event_names),max([vals.shape[0] for vals in data])),np.nan)
+    for k,vals in enumerate(data):
+        for ev in range(vals.shape[0]):
+            le[k,ev]=complexity_lyapunov(vals[ev,channel,:],delay=int(tau),dimension=int(dimension),len_trajectory=len_trajectory,min_neighbors="default",fs=epochs.info["sfreq"])
+        if progress is not None:
+            progress(k+1,len(event_names))
+    return le
+
 def lyapunov():
     error=make_x()
     win=Toplevel(main)
@@ -5136,41 +7070,17 @@ def lyapunov():
         sel_chan_name.set(namelist[0])
         def find_optimal_params():
             event_names=list(event_dict.keys())
-            optim_tau=np.empty((1,len(event_names),len(x1.events)+1))
-            optim_dim=np.empty((1,len(event_names),len(x1.events)+1))
+            jobs=[partial(compute_embedding_params,x1,event_names,sel_chan_name.get())]
             if x2 is not None:
-                optim_tau=np.empty((2,len(event_names),len(x1.events)+1))
-                optim_dim=np.empty((2,len(event_names),len(x1.events)+1))
-            optim_tau.fill(np.nan)
-            optim_dim.fill(np.nan)
-            count=0
-            pmax2=0
-            for k in range(len(event_names)):
-                for ev in range(len(x1[event_names[k]])):
-                    pmax2+=1
-                if x2 is not None:
-                    for ev in range(len(x2[event_names[k]])):
-                        pmax2+=1
-            for k in range(len(event_names)):
-                vals1=x1[event_names[k]].get_data()
-                for ev in range(vals1.shape[0]):
-                    count+=1
-                    win.update_idletasks()
-                    win.update()
-                    pbar2['value'] += 100/pmax2
-                    pbtxt2['text']=f"{count:d}/{pmax2:d}"
-                    optim_tau[0,k,ev]=int(complexity_delay(vals1[ev,sel_chan,:]))
-                    optim_dim[0,k,ev],_=optimal_dimension(vals1[ev,sel_chan,:], delay=optim_tau[0,k,ev], dimension_max=None)
-                if x2 is not None:
-                    vals2=x2[event_names[k]].get_data()
-                    for ev in range(vals2.shape[0]):
-                        count+=1
-                        win.update_idletasks()
-                        win.update()
-                        pbar2['value'] += 100/pmax2
-                        pbtxt2['text']=f"{count:d}/{pmax2:d}"
-                        optim_tau[1,k,ev]=int(complexity_delay(vals2[ev,sel_chan,:]))
-                        optim_dim[1,k,ev],_=optimal_dimension(vals2[ev,sel_chan,:], delay=optim_tau[0,k,ev], dimension_max=None)
+                jobs.append(partial(compute_embedding_params,x2,event_names,sel_chan_name.get()))
+            results=run_task(win,pbar2,pbtxt2,jobs)
+            if results is None:
+                return
+            optim_tau=np.full((len(results),len(event_names),max([r[0].shape[1] for r in results])),np.nan)
+            optim_dim=np.full(optim_tau.shape,np.nan)
+            for cond in range(len(results)):
+                optim_tau[cond,:,:results[cond][0].shape[1]]=results[cond][0]
+                optim_dim[cond,:,:results[cond][1].shape[1]]=results[cond][1]
             cond_names=[cond1_name.get()]
             if x2 is not None:
                 cond_names.append(cond2_name.get())
@@ -5198,38 +7108,16 @@ def lyapunov():
             ax2.set_title(sel_chan_name.get())
             plt.show()                
         def calculate_lyap():
-            k=0
-            count=0
             event_names=list(event_dict.keys())
-            le=np.empty((1,len(event_dict.keys()),len(x1.events)))
-            le.fill(np.nan)
+            jobs=[partial(compute_lyapunov,x1,event_names,sel_chan_name.get(),int(sel_tau.get()),int(sel_dim.get()))]
             if x2 is not None:
-                le=np.empty((2,len(event_dict.keys()),max((len(x1.events),len(x2.events)))))
-                le.fill(np.nan)                            
-            pmax=len(event_dict.keys())
-            if x2 is not None:
-                pmax=len(event_dict.keys())*2
-            for key in event_dict.keys():
-                k+=1
-                count+=1
-                win.update_idletasks()
-                win.update()
-                pbar['value'] += 100/pmax
-                pbtxt['text']=f"{count:d}/{pmax:d}"
-                #compute lyapunov
-                vals1=x1[event_names[k-1]].get_data()
-                for ev in range(vals1.shape[0]):
-                    le[0,k-1,ev]=complexity_lyapunov(vals1[ev,sel_chan,:],delay=int(sel_tau.get()),dimension=int(sel_dim.get()),len_trajectory=20,min_neighbors="default",fs=x1.info["sfreq"])
-                if x2 is not None:
-                    win.update_idletasks()
-                    win.update()
-                    count+=1
-                    pbar['value'] += 100/pmax
-                    pbtxt['text']=f"{count:d}/{pmax:d}"
-                    #compute lyapunov
-                    vals2=x2[event_names[k-1]].get_data()
-                    for ev in range(vals2.shape[0]):
-                        le[1,k-1,ev]=complexity_lyapunov(vals2[ev,sel_chan,:],delay=int(sel_tau.get()),dimension=int(sel_dim.get()),len_trajectory=20,min_neighbors="default",fs=x1.info["sfreq"])
+                jobs.append(partial(compute_lyapunov,x2,event_names,sel_chan_name.get(),int(sel_tau.get()),int(sel_dim.get())))
+            results=run_task(win,pbar,pbtxt,jobs)
+            if results is None:
+                return
+            le=np.full((len(results),len(event_names),max([r.shape[1] for r in results])),np.nan)
+            for cond in range(len(results)):
+                le[cond,:,:results[cond].shape[1]]=results[cond]
             cond_names=[cond1_name.get()]
             if x2 is not None:
                 cond_names.append(cond2_name.get())
@@ -5255,7 +7143,6 @@ def lyapunov():
         Label(win,text="Calculate Maximum Lyapunov Exponent").grid(row=0,column=0,columnspan=4,padx=10,pady=10)
         Label(win,text="Select channel").grid(row=1,column=0,padx=10,sticky=W)
         OptionMenu(win,sel_chan_name,namelist[0],*namelist).grid(row=1,column=1,padx=10,sticky=W)
-        sel_chan=namelist.index(sel_chan_name.get())
         #Entry(win,textvariable=sel_chan,width=4).grid(row=1,column=1,sticky=W)
         btn_find_optim=Button(win,text="Find optimal parameters\n(tau/dimension)",command=find_optimal_params)
         pbar2=Progressbar(win,orient=HORIZONTAL,length=100,mode='determinate')
@@ -5277,66 +7164,431 @@ def lyapunov():
         pbtxt.grid(row=5,column=2,sticky=W,columnspan=3)
 
 
-main=Tk()
-main.title("EEG Causality Tools")
-
-raw_or_energy=IntVar()
-raw_or_energy.set(1)
-cond1_name=StringVar()
-cond1_name.set("DBS Off")
-cond2_name=StringVar()
-cond2_name.set("DBS On")
-
-
-#main window layout
-Label(main,text="EEG \nCausality \nTools").grid(row=0,column=0,padx=(10,0),pady=(10,0),rowspan=15,sticky=W)
-Separator(main,orient="vertical").grid(row=0,column=1,rowspan=8,sticky='ns')
-Separator(main,orient="horizontal").grid(row=0,column=1,columnspan=8,sticky='ew')
-Label(main,text="Load data").grid(row=1,column=2,columnspan=2)
-Button(main,text="Load raw EEG (*.edf)",command=load_edf,width=22).grid(row=2,column=2,padx=10,pady=(10,0),sticky=W)
-Button(main,text="Load/select EEG montage",command=load_montage,width=22).grid(row=2,column=3,padx=10,pady=(10,0),sticky=E)
-Button(main,text="Preprocess raw EEG",command=preprocess,width=22).grid(row=3,column=2,padx=10,pady=10,sticky=W)
-frame_cond_1=Frame(main)
-Label(frame_cond_1,text="Condition 1 name:").grid(row=0,column=0,sticky=W)
-Entry(frame_cond_1,textvariable=cond1_name,width=8).grid(row=0,column=1,sticky=E)
-frame_cond_1.grid(row=3,column=3,padx=10,pady=10)
-Button(main,text="Load preprocessed EEG (*.fif)",command=load_fif,width=22).grid(row=4,column=2,padx=10,sticky=W)
-frame_cond_2=Frame(main)
-Label(frame_cond_2,text="Condition 2 name:").grid(row=0,column=0,sticky=W)
-Entry(frame_cond_2,textvariable=cond2_name,width=8).grid(row=0,column=1,sticky=E)
-frame_cond_2.grid(row=4,column=3,padx=10,pady=10)
-Button(main,text="Select frequency band",command=select_freq,width=22).grid(row=5,column=2,padx=10,pady=10,sticky=W)
-Radiobutton(main,text="Analyse using\nraw value (\u00B5V)",variable=raw_or_energy,value=1).grid(row=6,column=2,rowspan=2,padx=10,pady=10,sticky=W)
-Radiobutton(main,text="Analyse using\nenergy value ((\u00B5V)\u00B2)",variable=raw_or_energy,value=2).grid(row=6,column=3,rowspan=2,padx=10,pady=10,sticky=W)
-Separator(main,orient="vertical").grid(row=0,column=4,rowspan=8,sticky='ns')
-Separator(main,orient="horizontal").grid(row=8,column=1,columnspan=4,sticky='ew')
-Label(main,text="Correlation analysis on epochs").grid(row=1,column=5,columnspan=2)
-Button(main,text="Pearson correlation",command=pearson_corr,width=22).grid(row=2,column=5,padx=10,pady=10,sticky=W)
-Button(main,text="Spearman correlation",command=spearman_corr,width=22).grid(row=2,column=6,padx=10,pady=10,sticky=E)
-Separator(main,orient="vertical").grid(row=0,column=7,rowspan=8,sticky='ns')
-Separator(main,orient="horizontal").grid(row=3,column=4,columnspan=4,sticky='new')
-Label(main,text="Frequency analysis on epochs").grid(row=3,column=5,columnspan=2)
-Button(main,text="Coherence",command=coherence,width=22).grid(row=4,column=5,padx=10,pady=10,sticky=W)
-Button(main,text="Weighted phase\n      lag index",command=wpli,width=22).grid(row=4,column=6,padx=10,pady=10,sticky=E)
-Separator(main,orient="horizontal").grid(row=5,column=4,columnspan=4,sticky='new')
-Label(main,text="Information-theory analysis on epochs").grid(row=5,column=5,columnspan=2)
-Button(main,text="Mutual information",command=mi,width=22).grid(row=6,column=5,padx=10,pady=10,sticky=W)
-Button(main,text="Transfer entropy",command=te,width=22).grid(row=6,column=6,padx=10,pady=10,sticky=E)
-Separator(main,orient="horizontal").grid(row=8,column=4,columnspan=4,sticky='new')
-Separator(main,orient="vertical").grid(row=9,column=1,rowspan=5,sticky='ns')
-Label(main,text="Build dynamic functional connectome\non whole EEG time-series",justify=CENTER).grid(row=9,column=2,columnspan=2,rowspan=2,pady=(10,0))
-Button(main,text="Pearson correlation",command=pearson_dfc,width=22).grid(row=11,column=2,padx=10,pady=10,sticky=W)
-Button(main,text="Spearman correlation",command=spearman_dfc,width=22).grid(row=11,column=3,padx=10,pady=10,sticky=E)
-Button(main,text="Mutual information",command=mi_dfc,width=22).grid(row=12,column=2,padx=10,pady=10,sticky=W)
-Button(main,text="Transfer entropy",command=te_dfc,width=22).grid(row=12,column=3,padx=10,pady=10,sticky=E)
-Separator(main,orient="vertical").grid(row=9,column=4,rowspan=5,sticky='ns')
-Separator(main,orient="horizontal").grid(row=14,column=1,columnspan=4,sticky='ew')
-Label(main,text="Additional tools").grid(row=9,column=5,pady=10,columnspan=2)
-Button(main,text="Time-frequency analysis",command=tfr,width=22).grid(row=11,column=5,pady=10,padx=10)
-Button(main,text="Animated topoplot",command=animtopo,width=22).grid(row=11,column=6,pady=10,padx=10)
-Button(main,text="Lyapunov exponent",command=lyapunov,width=22).grid(row=12,column=5,pady=10,padx=10)
-Separator(main,orient="vertical").grid(row=9,column=7,rowspan=5,sticky='ns')
-Separator(main,orient="horizontal").grid(row=14,column=5,columnspan=4,sticky='ew')
-
-#run
-main.mainloop()
+#default parameters of the batch pipeline (see run_batch)
+batch_defaults={
+    'preprocess':{'montage':None,'drop_channels':[],'l_freq':1,'h_freq':50,'notch':None,'reference':'average',
+                  'stim_channel':None,'events':None,'min_duration':1,'tmin':0,'duration':None,'reject':None,'flat':1},
+    'band':None,
+    'energy':False,
+    'metrics':[{'measure':'pearson','delay':10}],
+    'dfc':[],
+    'n_jobs':None,
+    'precision':'float64'}
+
+#reads the parameter file of the batch pipeline
+def read_batch_params(fname=None):
+    """Reads a JSON parameter file and fills the missing entries with
+    batch_defaults.
+    Parameters
+    ----------
+    fname : str, None
+        Path of the JSON file (None to use only the defaults).
+    Returns
+    -------
+    params : dict
+        Parameters of the pipeline.
+    """
+    params=json.loads(json.dumps(batch_defaults))
+    if fname is not None:
+        with open(fname) as f:
+            user=json.load(f)
+        for key,value in user.items():
+            if key not in params:
+                raise ValueError(f"Unknown parameter '{key}' in {fname}")
+            if isinstance(params[key],dict):
+                params[key].update(value)
+            else:
+                params[key]=value
+    return params
+
+#events from thresholds on the stimulus channel
+def stim_events(raw,stim_channel,thresholds,min_duration=1):
+    """Finds the events from the values of the stimulus channel, as in the
+    montage window of the GUI.
+    Parameters
+    ----------
+    raw : mne.io.Raw
+        Continuous data containing the stimulus channel.
+    stim_channel : str
+        Name of the stimulus channel.
+    thresholds : dict
+        For each event name, a dict with one of 'above' (value), 'below'
+        (value) or 'between' ([low,high]), in the units of the channel. When
+        several events match a sample, the first one is kept.
+    min_duration : float
+        Minimum duration of the events, in seconds.
+    Returns
+    -------
+    events : np.array
+        Events array, as in mne.find_events.
+    event_dict : dict
+        Event names and codes.
+    """
+    vals=raw.get_data(picks=[stim_channel])[0]
+    codes=np.zeros(len(vals))
+    event_dict={}
+    for k,(name,rule) in enumerate(thresholds.items()):
+        if 'between' in rule:
+            mask=(vals>=float(rule['between'][0])) & (vals<=float(rule['between'][1]))
+        elif 'above' in rule:
+            mask=vals>=float(rule['above'])
+        elif 'below' in rule:
+            mask=vals<=float(rule['below'])
+        else:
+            raise ValueError(f"Event '{name}' needs an 'above', 'below' or 'between' threshold")
+        codes[mask & (codes==0)]=k+1
+        event_dict[name]=k+1
+    info=mne.create_info(['STI'],raw.info['sfreq'],['stim'])
+    stim=mne.io.RawArray(codes[None,:],info,verbose='ERROR')
+    events=mne.find_events(stim,consecutive=False,min_duration=float(min_duration),verbose='ERROR')
+    return events,event_dict
+
+#non-interactive version of the preprocessing pipeline
+def preprocess_raw(raw,params):
+    """Runs the preprocessing pipeline of the GUI without prompts: events,
+    montage, bad channels, band-pass and notch filters, re-referencing and
+    epoching. ICA and the manual inspection of epochs need visual inspection
+    and are not part of the batch pipeline.
+    Parameters
+    ----------
+    raw : mne.io.Raw
+        Continuous data (loaded in memory).
+    params : dict
+        The 'preprocess' entry of the batch parameters.
+    Returns
+    -------
+    raw : mne.io.Raw
+        Preprocessed continuous data.
+    epochs : mne.Epochs
+        Epoched data.
+    """
+    if params['stim_channel'] is not None:
+        events,event_dict=stim_events(raw,params['stim_channel'],params['events'],params['min_duration'])
+        raw=raw.copy().drop_channels([params['stim_channel']])
+    else:
+        events,event_dict=mne.events_from_annotations(raw,event_id=params['events'],verbose='ERROR')
+    if params['montage'] is not None:
+        if params['montage']=='cap1020':
+            montage=mne.channels.read_custom_montage(os.path.join(os.path.dirname(os.path.abspath(__file__)),'cap1020.txt'))
+        elif os.path.isfile(params['montage']):
+            montage=mne.channels.read_custom_montage(params['montage'])
+        else:
+            montage=mne.channels.make_standard_montage(params['montage'])
+        connection_dic={}
+        for name in montage.ch_names:
+            for chan in raw.ch_names:
+                if (name in chan) and (chan not in connection_dic):
+                    connection_dic[chan]=name
+                    break
+        raw=raw.copy().pick_channels(list(connection_dic.keys()))
+        raw.rename_channels(mapping=connection_dic)
+        raw.set_montage(montage)
+    if len(params['drop_channels'])>0:
+        raw=raw.copy().drop_channels(params['drop_channels'])
+    raw=raw.copy().filter(params['l_freq'],params['h_freq'],verbose='ERROR')
+    if params['notch'] is not None:
+        raw=raw.notch_filter(params['notch'],verbose='ERROR')
+    if params['reference']=='average':
+        raw=raw.set_eeg_reference(verbose='ERROR')
+    elif isinstance(params['reference'],list):
+        raw=raw.set_eeg_reference(params['reference'],verbose='ERROR')
+    duration=params['duration']
+    if duration is None:
+        duration=int(np.median(np.diff(events[:,0]))/raw.info['sfreq'])
+    reject=None
+    if params['reject'] is not None:
+        reject=dict(eeg=float(params['reject'])*10**-6)
+    flat=None
+    if params['flat'] is not None:
+        flat=dict(eeg=float(params['flat'])*10**-6)
+    epochs=mne.Epochs(raw,events,tmin=float(params['tmin']),tmax=float(params['tmin'])+float(duration),event_id=event_dict,
+                      preload=True,baseline=None,reject=reject,flat=flat,verbose='ERROR')
+    return raw,epochs
+
+#frequency band of the batch pipeline
+def band_limits(band):
+    """Returns (fmin,fmax) from a band name of the GUI list (e.g. 'Alpha
+    (8-12 Hz)' or just 'Alpha') or from a [fmin,fmax] pair."""
+    if isinstance(band,str):
+        for name,limits in zip(band_options,band_ranges):
+            if band.lower() in (name.lower(),name.split(' ')[0].lower()):
+                return limits
+        raise ValueError(f"Unknown frequency band '{band}'")
+    return float(band[0]),float(band[1])
+
+#TE/MI parameters of a batch entry
+def batch_info_spec(spec):
+    """Returns a copy of a 'metrics' or 'dfc' entry of the batch parameters
+    with the 'x_divs'/'y_divs' given in uV converted to V (see divisions_volts)
+    and the 'symbolic_length' list as a tuple."""
+    spec=dict(spec)
+    for key in ('x_divs','y_divs'):
+        if spec.get(key) is not None:
+            spec[key]=divisions_volts(spec[key])
+    if spec.get('symbolic_length') is not None:
+        spec['symbolic_length']=tuple(spec['symbolic_length'])
+    return spec
+
+#one metric of the batch pipeline
+def batch_metric(epochs,event_names,spec,n_jobs=None,progress=None):
+    """Computes one entry of the 'metrics' list of the batch parameters.
+    Returns an array of shape (n_events,n_epochs,n_chans,n_chans), or
+    (n_events,n_chans,n_chans) for the spectral measures, or a dict of the
+    latter for the 'spectral' bundle (all methods from one estimate) and for
+    the spectral measures computed in several 'bands' (one entry per band).
+    With 'symmetric':true the last two axes are packed (see pack_triangle).
+    With 'surrogates':{'n':1000,'kind':'shift'} a dict with the 'value', 'z'
+    and 'p' arrays of compute_surrogate_test is returned instead."""
+    spec=batch_info_spec(spec)
+    measure=spec.pop('measure')
+    if 'surrogates' in spec:
+        surr=dict(spec.pop('surrogates'))
+        return compute_surrogate_test(epochs,event_names,measure,n_surrogates=surr.get('n',1000),kind=surr.get('kind','shift'),
+                                      seed=surr.get('seed'),n_jobs=n_jobs,progress=progress,**spec)
+    if measure in ('pearson','spearman'):
+        return compute_corr(epochs,event_names,spec.get('delay',10),measure,progress=progress,symmetric=spec.get('symmetric',False))
+    elif measure in ('te','mi'):
+        return compute_info(epochs,event_names,measure=measure,n_jobs=n_jobs,progress=progress,**spec)
+    elif (measure in spectral_signs) or (measure=='spectral'):
+        methods=spec.get('methods',tuple(spectral_signs)) if measure=='spectral' else (measure,)
+        if 'bands' not in spec:
+            con=compute_spectral_bundle(epochs,event_names,spec['fmin'],spec['fmax'],methods,n_jobs=n_jobs,progress=progress,symmetric=spec.get('symmetric',False))
+            return con if measure=='spectral' else con[measure]
+        bands=band_options if spec['bands']=='all' else spec['bands']
+        con=compute_multiband(epochs,event_names,[band_limits(b) for b in bands],methods,n_jobs=n_jobs,progress=progress,symmetric=spec.get('symmetric',False))
+        labels=[b.split(' ')[0] if isinstance(b,str) else f'{b[0]}-{b[1]}Hz' for b in bands]
+        if measure!='spectral':
+            return {lbl:con[measure][i] for i,lbl in enumerate(labels)}
+        return {f'{method}_{lbl}':val[i] for method,val in con.items() for i,lbl in enumerate(labels)}
+    raise ValueError(f"Unknown measure '{measure}'")
+
+#one dynamic functional connectivity of the batch pipeline
+def batch_dfc(raw,epochs,event_names,spec,n_jobs=None,progress=None,store=None):
+    """Computes one entry of the 'dfc' list of the batch parameters, either on
+    the continuous data ('source':'raw', read chunk by chunk, see
+    compute_stream_dfc) or averaged over the epochs of each event
+    ('source':'epochs', the default). With store, the result is written
+    to a DFC store in that directory (see create_dfc_store)."""
+    spec=batch_info_spec(spec)
+    measure=spec.pop('measure')
+    source=spec.pop('source','epochs')
+    if source=='raw':
+        if raw is None:
+            raise ValueError("DFC from raw data needs a continuous (EDF/raw FIF) recording")
+        return compute_stream_dfc(raw,measure=measure,n_jobs=n_jobs,progress=progress,store=store,**spec)
+    return compute_epochs_dfc(epochs,event_names,measure=measure,n_jobs=n_jobs,progress=progress,store=store,**spec)
+
+#limits how often a progress callback is called
+def throttled(progress,interval=0.5):
+    """Wraps a progress(done,total) callback so that it is called at most once
+    every interval seconds (the last step is always reported)."""
+    last=[-np.inf]
+    def wrapper(done,total):
+        now=time.monotonic()
+        if (done>=total) or (now-last[0]>=interval):
+            last[0]=now
+            progress(done,total)
+    return wrapper
+
+#non-interactive pipeline over a directory of recordings
+def run_batch(input_dir,output_dir,params,verbose=True):
+    """Runs preprocessing, frequency band selection, metrics and DFC for every
+    recording of a directory, without any dialog.
+    Each EDF or raw FIF file is preprocessed with preprocess_raw; epoched FIF
+    files (*_epo.fif / *-epo.fif) are used as they are. The results are
+    written to:
+        output_dir/batch_parameters.json
+        output_dir/batch_log.csv
+        output_dir/<subject>/<subject>_epo.fif
+        output_dir/<subject>/metrics/<name>.npy (and <name>_<event>.csv, averaged over epochs)
+        output_dir/<subject>/dfc/<name>.npy (or the DFC store <name>/ if "on_disk" is set, see open_dfc_store)
+    where <name> is the 'name' of the metric/DFC entry (default: its measure),
+    followed by _<method> for the entries of a 'spectral' bundle.
+    A failure in one subject is logged and the next subject is processed.
+    Parameters
+    ----------
+    input_dir : str
+        Directory with the recordings.
+    output_dir : str
+        Root of the output tree (created if needed).
+    params : dict
+        Parameters, as returned by read_batch_params.
+    verbose : bool
+        Whether to print the progress.
+    Returns
+    -------
+    log : pd.DataFrame
+        Status of every subject.
+    """
+    set_precision(params['precision'])
+    files=sorted([f for f in os.listdir(input_dir) if f.lower().endswith(('.edf','.fif'))])
+    os.makedirs(output_dir,exist_ok=True)
+    with open(os.path.join(output_dir,'batch_parameters.json'),'w') as f:
+        json.dump(params,f,indent=2)
+    log=[]
+    for n,fname in enumerate(files):
+        subject=os.path.splitext(fname)[0]
+        for suffix in ('_epo','-epo','_raw','-raw'):
+            if subject.endswith(suffix):
+                subject=subject[:-len(suffix)]
+        subj_dir=os.path.join(output_dir,subject)
+        t0=time.time()
+        def report(label):
+            if not verbose:
+                return None
+            return throttled(lambda done,total: print(f"[{n+1}/{len(files)}] {subject} {label}: {done}/{total}",flush=True))
+        try:
+            path=os.path.join(input_dir,fname)
+            raw=None
+            if fname.lower().endswith(('_epo.fif','-epo.fif')):
+                epochs=mne.read_epochs(path,preload=True,verbose='ERROR')
+            else:
+                if fname.lower().endswith('.edf'):
+                    raw=mne.io.read_raw_edf(path,preload=True,verbose='ERROR')
+                else:
+                    raw=mne.io.read_raw_fif(path,preload=True,verbose='ERROR')
+                raw,epochs=preprocess_raw(raw,params['preprocess'])
+            os.makedirs(subj_dir,exist_ok=True)
+            epochs.save(os.path.join(subj_dir,subject+'_epo.fif'),overwrite=True,verbose='ERROR')
+            if params['band'] is not None:
+                fmin,fmax=band_limits(params['band'])
+                epochs=epochs.copy().filter(fmin,fmax,verbose='ERROR')
+                if raw is not None:
+                    raw=raw.copy().filter(fmin,fmax,verbose='ERROR')
+            if params['energy']:
+                epochs=mne.EpochsArray(np.square(epochs.get_data()),epochs.info,events=epochs.events,event_id=epochs.event_id,tmin=epochs.tmin,verbose='ERROR')
+                if raw is not None:
+                    raw=mne.io.RawArray(np.square(raw.get_data()),raw.info,verbose='ERROR')
+            event_names=list(epochs.event_id.keys())
+            if len(params['metrics'])>0:
+                os.makedirs(os.path.join(subj_dir,'metrics'),exist_ok=True)
+            for spec in params['metrics']:
+                name=spec.get('name',spec['measure'])
+                res=batch_metric(epochs,event_names,{k:v for k,v in spec.items() if k!='name'},params['n_jobs'],report(name))
+                if not isinstance(res,dict):
+                    res={name:(res,spec['measure'])}
+                else:
+                    res={name+'_'+key:(val,key.split('_')[0] if spec['measure']=='spectral' else spec['measure']) for key,val in res.items()}
+                packed=spec.get('symmetric',False)
+                for res_name,(val,method) in res.items():
+                    np.save(os.path.join(subj_dir,'metrics',res_name+'.npy'),val)
+                    for k,key in enumerate(event_names):
+                        mean_val=val[k] if val.ndim==3-int(packed) else np.nanmean(val[k],axis=0)
+                        if packed:
+                            mean_val=unpack_triangle(mean_val,spectral_signs.get(method,1))
+                        pd.DataFrame(mean_val,index=epochs.ch_names,columns=epochs.ch_names).to_csv(os.path.join(subj_dir,'metrics',f'{res_name}_{key}.csv'))
+            if len(params['dfc'])>0:
+                os.makedirs(os.path.join(subj_dir,'dfc'),exist_ok=True)
+            for spec in params['dfc']:
+                name=spec.get('name',spec['measure'])
+                on_disk=spec.get('on_disk',False)
+                res=batch_dfc(raw,epochs,event_names,{k:v for k,v in spec.items() if k not in ('name','on_disk')},params['n_jobs'],report('DFC '+name),
+                              store=os.path.join(subj_dir,'dfc',name) if on_disk else None)
+                if not on_disk:
+                    np.save(os.path.join(subj_dir,'dfc',name+'.npy'),res)
+            log.append([subject,fname,'ok','',time.time()-t0])
+        except Exception as e:
+            log.append([subject,fname,'error',repr(e),time.time()-t0])
+            if verbose:
+                print(f"[{n+1}/{len(files)}] {subject} failed: {e!r}",flush=True)
+        log_df=pd.DataFrame(log,columns=['subject','file','status','message','seconds'])
+        log_df.to_csv(os.path.join(output_dir,'batch_log.csv'),index=False)
+    return pd.DataFrame(log,columns=['subject','file','status','message','seconds'])
+
+#command-line entry point of the batch pipeline
+def batch_main(argv=None):
+    """Command-line interface: python EEG_causality_tools.py INPUT_DIR OUTPUT_DIR [-p PARAMS.json]"""
+    parser=argparse.ArgumentParser(description="EEG Causality Tools - batch pipeline over a directory of EDF/FIF recordings")
+    parser.add_argument('input_dir',help="directory with the EDF/FIF recordings (one per subject)")
+    parser.add_argument('output_dir',help="root of the output tree")
+    parser.add_argument('-p','--params',default=None,help="JSON parameter file (default: built-in parameters)")
+    parser.add_argument('-j','--n-jobs',type=int,default=None,help="number of processes (overrides the parameter file)")
+    parser.add_argument('-q','--quiet',action='store_true',help="do not print the progress")
+    parser.add_argument('--float32',action='store_true',help="single precision data and results (overrides the parameter file)")
+    args=parser.parse_args(argv)
+    params=read_batch_params(args.params)
+    if args.n_jobs is not None:
+        params['n_jobs']=args.n_jobs
+    if args.float32:
+        params['precision']='float32'
+    log=run_batch(args.input_dir,args.output_dir,params,verbose=not args.quiet)
+    return int((log['status']!='ok').any()) if len(log)>0 else 0
+
+#batch mode: python EEG_causality_tools.py INPUT_DIR OUTPUT_DIR [-p PARAMS.json]
+if __name__=="__main__" and len(sys.argv)>1:
+    sys.exit(batch_main(sys.argv[1:]))
+
+#main window (only when run as a script, so the process pool workers can import this file)
+if __name__=="__main__":
+    main=Tk()
+    main.title("EEG Causality Tools")
+
+    raw_or_energy=IntVar()
+    raw_or_energy.set(1)
+    cond1_name=StringVar()
+    cond1_name.set("DBS Off")
+    cond2_name=StringVar()
+    cond2_name.set("DBS On")
+    single_precision=IntVar()
+    single_precision.set(0)
+    dfc_on_disk=IntVar()
+    dfc_on_disk.set(0)
+
+
+    #main window layout
+    Label(main,text="EEG \nCausality \nTools").grid(row=0,column=0,padx=(10,0),pady=(10,0),rowspan=15,sticky=W)
+    Separator(main,orient="vertical").grid(row=0,column=1,rowspan=8,sticky='ns')
+    Separator(main,orient="horizontal").grid(row=0,column=1,columnspan=8,sticky='ew')
+    Label(main,text="Load data").grid(row=1,column=2,columnspan=2)
+    Button(main,text="Load raw EEG (*.edf)",command=load_edf,width=22).grid(row=2,column=2,padx=10,pady=(10,0),sticky=W)
+    Button(main,text="Load/select EEG montage",command=load_montage,width=22).grid(row=2,column=3,padx=10,pady=(10,0),sticky=E)
+    Button(main,text="Preprocess raw EEG",command=preprocess,width=22).grid(row=3,column=2,padx=10,pady=10,sticky=W)
+    frame_cond_1=Frame(main)
+    Label(frame_cond_1,text="Condition 1 name:").grid(row=0,column=0,sticky=W)
+    Entry(frame_cond_1,textvariable=cond1_name,width=8).grid(row=0,column=1,sticky=E)
+    frame_cond_1.grid(row=3,column=3,padx=10,pady=10)
+    Button(main,text="Load preprocessed EEG (*.fif)",command=load_fif,width=22).grid(row=4,column=2,padx=10,sticky=W)
+    frame_cond_2=Frame(main)
+    Label(frame_cond_2,text="Condition 2 name:").grid(row=0,column=0,sticky=W)
+    Entry(frame_cond_2,textvariable=cond2_name,width=8).grid(row=0,column=1,sticky=E)
+    frame_cond_2.grid(row=4,column=3,padx=10,pady=10)
+    Button(main,text="Select frequency band",command=select_freq,width=22).grid(row=5,column=2,padx=10,pady=10,sticky=W)
+    Radiobutton(main,text="Analyse using\nraw value (\u00B5V)",variable=raw_or_energy,value=1).grid(row=6,column=2,rowspan=2,padx=10,pady=10,sticky=W)
+    Radiobutton(main,text="Analyse using\nenergy value ((\u00B5V)\u00B2)",variable=raw_or_energy,value=2).grid(row=6,column=3,rowspan=2,padx=10,pady=10,sticky=W)
+    Separator(main,orient="vertical").grid(row=0,column=4,rowspan=8,sticky='ns')
+    Separator(main,orient="horizontal").grid(row=8,column=1,columnspan=4,sticky='ew')
+    Label(main,text="Correlation analysis on epochs").grid(row=1,column=5,columnspan=2)
+    Button(main,text="Pearson correlation",command=pearson_corr,width=22).grid(row=2,column=5,padx=10,pady=10,sticky=W)
+    Button(main,text="Spearman correlation",command=spearman_corr,width=22).grid(row=2,column=6,padx=10,pady=10,sticky=E)
+    Separator(main,orient="vertical").grid(row=0,column=7,rowspan=8,sticky='ns')
+    Separator(main,orient="horizontal").grid(row=3,column=4,columnspan=4,sticky='new')
+    Label(main,text="Frequency analysis on epochs").grid(row=3,column=5,columnspan=2)
+    Button(main,text="Coherence",command=coherence,width=22).grid(row=4,column=5,padx=10,pady=10,sticky=W)
+    Button(main,text="Weighted phase\n      lag index",command=wpli,width=22).grid(row=4,column=6,padx=10,pady=10,sticky=E)
+    Separator(main,orient="horizontal").grid(row=5,column=4,columnspan=4,sticky='new')
+    Label(main,text="Information-theory analysis on epochs").grid(row=5,column=5,columnspan=2)
+    Button(main,text="Mutual information",command=mi,width=22).grid(row=6,column=5,padx=10,pady=10,sticky=W)
+    Button(main,text="Transfer entropy",command=te,width=22).grid(row=6,column=6,padx=10,pady=10,sticky=E)
+    Separator(main,orient="horizontal").grid(row=8,column=4,columnspan=4,sticky='new')
+    Separator(main,orient="vertical").grid(row=9,column=1,rowspan=5,sticky='ns')
+    Label(main,text="Build dynamic functional connectome\non whole EEG time-series",justify=CENTER).grid(row=9,column=2,columnspan=2,rowspan=2,pady=(10,0))
+    Button(main,text="Pearson correlation",command=pearson_dfc,width=22).grid(row=11,column=2,padx=10,pady=10,sticky=W)
+    Button(main,text="Spearman correlation",command=spearman_dfc,width=22).grid(row=11,column=3,padx=10,pady=10,sticky=E)
+    Button(main,text="Mutual information",command=mi_dfc,width=22).grid(row=12,column=2,padx=10,pady=10,sticky=W)
+    Button(main,text="Transfer entropy",command=te_dfc,width=22).grid(row=12,column=3,padx=10,pady=10,sticky=E)
+    Checkbutton(main,text="Keep DFC results on disk (long recordings)",variable=dfc_on_disk,
+                command=lambda: dfc_storage.update(on_disk=dfc_on_disk.get()==1)).grid(row=13,column=2,columnspan=2,pady=(0,10),padx=10,sticky=W)
+    Separator(main,orient="vertical").grid(row=9,column=4,rowspan=5,sticky='ns')
+    Separator(main,orient="horizontal").grid(row=14,column=1,columnspan=4,sticky='ew')
+    Label(main,text="Additional tools").grid(row=9,column=5,pady=10,columnspan=2)
+    Button(main,text="Time-frequency analysis",command=tfr,width=22).grid(row=11,column=5,pady=10,padx=10)
+    Button(main,text="Animated topoplot",command=animtopo,width=22).grid(row=11,column=6,pady=10,padx=10)
+    Button(main,text="Lyapunov exponent",command=lyapunov,width=22).grid(row=12,column=5,pady=10,padx=10)
+    Button(main,text="Clear spectral cache",command=lambda: (clear_spectral_cache(),showinfo(title="Info",message="Spectral cache cleared")),width=22).grid(row=12,column=6,pady=10,padx=10)
+    Checkbutton(main,text="Single precision (float32, half memory)",variable=single_precision,
+                command=lambda: set_precision('float32' if single_precision.get()==1 else 'float64')).grid(row=13,column=5,columnspan=2,pady=(0,10),padx=10,sticky=W)
+    Separator(main,orient="vertical").grid(row=9,column=7,rowspan=5,sticky='ns')
+    Separator(main,orient="horizontal").grid(row=14,column=5,columnspan=4,sticky='ew')
+
+    #run
+    main.mainloop()
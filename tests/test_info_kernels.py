@@ -0,0 +1,62 @@
+"""The all-pairs transfer entropy and mutual information kernels must give
+the same values as the pairwise estimators of cami-python that they replace."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tkinter')
+cami=pytest.importorskip('cami')
+pytest.importorskip('mne')
+pytest.importorskip('mne_connectivity')
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import EEG_causality_tools as ect
+
+N_SYMBOLS=3
+DELAY=3
+
+#coupled series: every channel drives the next one
+def coupled_series(n_chans=4,n_times=800,seed=0):
+    rng=np.random.default_rng(seed)
+    vals=rng.normal(size=(n_chans,n_times))
+    for i in range(1,n_chans):
+        vals[i,DELAY:]+=0.8*vals[i-1,:-DELAY]
+    return vals
+
+@pytest.mark.parametrize('units',['bits','nat','ban'])
+@pytest.mark.parametrize('symbolic_length,tau',[((1,1,1),1),((2,1,2),1),((2,2,1),2),((1,2,2),3)])
+@pytest.mark.parametrize('symb_type',['equal-divs','equal-points'])
+def test_te_matrix_matches_cami(symb_type,symbolic_length,tau,units):
+    x,y=ect.lagged_slices(coupled_series(),DELAY)
+    sx=ect.symbolize(x,symb_type,N_SYMBOLS)
+    sy=ect.symbolize(y,symb_type,N_SYMBOLS)
+    te=ect.te_matrix(sx,sy,N_SYMBOLS,symbolic_length,tau,units)
+    for i in range(x.shape[0]):
+        for j in range(y.shape[0]):
+            ref=cami.transfer_entropy(x[i],y[j],symbolic_type=symb_type,n_symbols=N_SYMBOLS,tau=tau,
+                                      symbolic_length=symbolic_length,units=units)
+            assert te[i,j]==pytest.approx(ref,abs=1e-10)
+
+@pytest.mark.parametrize('units',['bits','nat','ban'])
+@pytest.mark.parametrize('symbolic_length,tau',[((1,1),1),((2,1),1),((2,2),2),((1,3),3)])
+@pytest.mark.parametrize('symb_type',['equal-divs','equal-points'])
+def test_mi_matrix_matches_cami(symb_type,symbolic_length,tau,units):
+    x,y=ect.lagged_slices(coupled_series(),DELAY)
+    sx=ect.symbolize(x,symb_type,N_SYMBOLS)
+    sy=ect.symbolize(y,symb_type,N_SYMBOLS)
+    mi=ect.mi_matrix(sx,sy,N_SYMBOLS,symbolic_length,tau,units)
+    for i in range(x.shape[0]):
+        for j in range(y.shape[0]):
+            ref=cami.mutual_info(x[i],y[j],symbolic_type=symb_type,n_symbols=N_SYMBOLS,tau=tau,
+                                 symbolic_length=symbolic_length,units=units)
+            assert mi[i,j]==pytest.approx(ref,abs=1e-10)
+
+def test_pair_counts_blocks():
+    #the blocks of source channels (and the reduction of each block) do not change the counts
+    rng=np.random.default_rng(1)
+    src=rng.integers(0,5,(7,200))
+    tgt=rng.integers(0,5,(7,200))*5
+    full=ect.pair_counts(src,tgt,25)
+    assert np.array_equal(ect.pair_counts(src,tgt,25,max_items=1),full)
+    assert np.array_equal(ect.pair_counts(src,tgt,25,lambda c:c.sum(axis=-1),max_items=300),full.sum(axis=-1))